@@ -10,34 +10,134 @@ from .cloud_store import (
     file_exists,
     upload_pdf,
     upsert_row,
-    save_resolution,
+    save_resolutions,
+    resolution_row,
     fetch_resolutions,
+    latest_update,
     make_metric_key,
 )
-from .quartr_loader import load_company_years
-from .guidance import extract_for_ticker
-from .merge import merge_items, canon_period, canon_metric, bucketize
+from .backfill import backfill, BACKFILL_WORKERS
+from .pipeline import run_pipeline, format_time_to_guidance
+from .quartr_loader import format_latency
+from .jobs import enqueue, get_queue, start_worker, worker_pid, OPEN as OPEN_TASKS
+from . import telemetry
+from .guidance import extract_for_ticker, extract_async, EXTRACT_CONCURRENCY, DEFAULT_MODEL
+from .merge import merge_rows, canon_period, canon_metric
+from .portfolio import parse_tickers, merge_portfolio, to_frame, to_csv_bytes, to_parquet_bytes
 
 def _inject_secrets_to_env():
     load_dotenv()
-    if hasattr(st, "secrets"):
-        for key, val in st.secrets.items():
-            if isinstance(val, str) and not os.getenv(key):
-                os.environ[key] = val
+    # Without a .streamlit/secrets.toml (local runs configured through .env) there is nothing to copy;
+    # reading st.secrets would raise FileNotFoundError.
+    if not st.secrets.load_if_toml_exists():
+        return
+    for key, val in st.secrets.items():
+        if isinstance(val, str) and not os.getenv(key):
+            os.environ[key] = val
+
+_playwright_ok = None
 
 def ensure_playwright():
+    # Checked (and installed if missing) once per process, when a backfill first needs it.
+    global _playwright_ok
+    if _playwright_ok is not None:
+        return _playwright_ok
     try:
         from playwright.sync_api import sync_playwright  # noqa: F401
-        return True
+        _playwright_ok = True
     except Exception:
         try:
             import subprocess
             import sys
             subprocess.run([sys.executable, "-m", "playwright", "install", "chromium", "--with-deps"], check=True)
-            return True
+            _playwright_ok = True
         except Exception as e:
             st.warning(f"Playwright install may be incomplete: {e}")
-            return False
+            _playwright_ok = False
+    return _playwright_ok
+
+# Cached reads for the Guidance tab; every widget interaction reruns main(). Keys include a change
+# stamp of the guidance rows (row count + newest updated_at), taken when a view is built, so rows
+# written since then miss the cache; extraction and resolution saves also clear it.
+
+def guidance_stamp(ticker, start_year, end_year, start_q, end_q) -> str:
+    return latest_update(ticker, "guidance_json", "json", start_year, end_year, start_q, end_q)
+
+@st.cache_data(show_spinner="Fetching and merging guidance...", max_entries=64)
+def load_merged_view(ticker, start_year, end_year, start_q, end_q, stamp):
+    rows = fetch_rows(ticker, file_type="guidance_json", file_format="json",
+                      columns="year,quarter,source_url,text_content",
+                      start_year=start_year, end_year=end_year, start_q=start_q, end_q=end_q)
+    return merge_rows(rows)
+
+@st.cache_data(show_spinner=False, ttl=600)
+def load_resolutions(ticker):
+    return fetch_resolutions(ticker)
+
+@st.cache_data(show_spinner="Fetching and merging guidance...", max_entries=16)
+def load_portfolio(tickers, start_year, end_year, start_q, end_q, stamp):
+    df = to_frame(merge_portfolio(list(tickers), start_year, end_year, start_q, end_q))
+    return df, to_csv_bytes(df), to_parquet_bytes(df)
+
+def refresh_views():
+    # After new guidance was written: drop cached merges and re-stamp the views that are on screen.
+    load_merged_view.clear()
+    load_portfolio.clear()
+    for name in ("merged_view", "portfolio_view"):
+        view = st.session_state.get(name)
+        if view:
+            st.session_state[name] = view[:-1] + (guidance_stamp(*view[:-1]),)
+
+def run_summary_panel(name):
+    # Per-stage timing and counters of the last backfill / extraction run in this session.
+    summary = st.session_state.get("run_summaries", {}).get(name)
+    if not summary:
+        return
+    with st.expander(f"Run summary — {summary['seconds']:.1f}s", expanded=False):
+        st.dataframe(pd.DataFrame(summary["stages"], columns=["stage", "count", "seconds", "mean_ms", "max_ms", "errors"]),
+                     use_container_width=True, hide_index=True)
+        if summary["counters"]:
+            st.dataframe(pd.DataFrame(list(summary["counters"].items()), columns=["counter", "value"]),
+                         use_container_width=True, hide_index=True)
+        st.caption("Nested and concurrent stages overlap, so stage totals can exceed the run time.")
+
+@st.experimental_fragment(run_every=5)
+def jobs_panel():
+    # Background backfill jobs; the worker process does the work, this only polls the queue.
+    queue = get_queue()
+    jobs = queue.jobs(limit=10)
+    if not jobs:
+        return
+    st.markdown("**Background jobs**")
+    pid = worker_pid()
+    open_tasks = sum(j["counts"][s] for j in jobs for s in OPEN_TASKS)
+    st.caption(f"Worker running (pid {pid})" if pid else "No worker running on this machine")
+    if not pid and open_tasks and st.button("Start worker", key="start_worker"):
+        start_worker()
+        st.rerun()
+    for job in jobs:
+        p, c = job["params"], job["counts"]
+        total = sum(c.values())
+        finished = total - sum(c[s] for s in OPEN_TASKS)
+        label = (f"#{job['id']} {', '.join(p['tickers'][:5])}{' …' if len(p['tickers']) > 5 else ''} "
+                 f"{p['start_q']} {p['start_year']}–{p['end_q']} {p['end_year']}: {finished}/{total} task(s) — "
+                 + ", ".join(f"{n} {s}" for s, n in c.items() if n))
+        st.progress(finished / total if total else 1.0, text=label)
+        cols = st.columns([1, 1, 6])
+        if c["failed"] or c["cancelled"]:
+            if cols[0].button("Retry failed", key=f"retry_job_{job['id']}"):
+                queue.retry(job["id"])
+                if not worker_pid():
+                    start_worker()
+                st.rerun()
+        if c["pending"] and cols[1].button("Cancel", key=f"cancel_job_{job['id']}"):
+            queue.cancel(job["id"])
+            st.rerun()
+        if c["failed"]:
+            with st.expander(f"Failed tasks of job #{job['id']}", expanded=False):
+                st.dataframe(pd.DataFrame(queue.tasks(job["id"], ["failed"]),
+                                          columns=["ticker", "year", "quarter", "file_type", "attempts", "last_error"]),
+                             use_container_width=True, hide_index=True)
 
 def main():
     _inject_secrets_to_env()
@@ -47,7 +147,6 @@ def main():
     tab1, tab2 = st.tabs(["Load data", "Guidance (extract, merge, resolve)"])
 
     with tab1:
-        ensure_playwright()
         st.subheader("Backfill from Quartr → Supabase")
         tickers = st.text_input("Tickers (comma-separated)", "AAPL, MSFT")
         col1, col2 = st.columns(2)
@@ -58,15 +157,52 @@ def main():
             end_year = st.number_input("End year", min_value=2000, max_value=2100, value=2024, step=1)
             end_q = st.selectbox("End quarter", ["Q1","Q2","Q3","Q4"], index=3)
         headless = st.checkbox("Run headless", value=True, help="Must be ON in Streamlit Cloud (no DISPLAY)")
+        workers = st.number_input("Parallel browser pages", min_value=1, max_value=32, value=BACKFILL_WORKERS, step=1,
+                                  help="Quarters are scraped concurrently in isolated contexts of one logged-in browser")
+        extract_too = st.checkbox("Extract guidance while loading", value=False,
+                                  help="Streaming pipeline: each downloaded quarter goes straight to text extraction and "
+                                       f"the model ({DEFAULT_MODEL}) while the next quarter is scraped")
         if st.button("Run backfill"):
+            ensure_playwright()
             os.environ["HEADLESS"] = "1" if headless else "0"
-            for t in [t.strip().upper() for t in tickers.split(",") if t.strip()]:
-                with st.spinner(f"Loading {t} {start_year}-{end_year}..."):
-                    try:
-                        load_company_years(t, start_year, end_year, start_q, end_q)
+            tlist = [t.strip().upper() for t in tickers.split(",") if t.strip()]
+            with st.spinner(f"Loading {len(tlist)} ticker(s) {start_year}-{end_year} with {workers} page(s)..."), \
+                    telemetry.run("backfill") as trace:
+                try:
+                    if extract_too:
+                        summary = run_pipeline(tlist, start_year, end_year, start_q, end_q, workers=int(workers))
+                    else:
+                        summary = backfill(tlist, start_year, end_year, start_q, end_q, workers=int(workers))
+                except Exception as e:
+                    st.error(f"Backfill failed: {e}")
+                    summary = None
+            st.session_state.setdefault("run_summaries", {})["backfill"] = trace.summary()
+            if summary:
+                failed_tickers = sorted({f[0] for f in summary["failed"]})
+                for t in tlist:
+                    if t not in failed_tickers:
                         st.success(f"Loaded {t}")
-                    except Exception as e:
-                        st.error(f"Failed {t}: {e}")
+                for ticker, year, quarter, err in summary["failed"]:
+                    st.error(f"Failed {ticker} {quarter} {year}: {err}")
+                st.caption(f"{summary['units']} quarter(s), {summary['unopened']} could not be opened; documents: "
+                           f"{summary['saved']} saved, {summary['skipped']} already stored, {summary['missing']} not available; "
+                           f"{format_latency(summary['latency'])}")
+                if "time_to_guidance" in summary:
+                    for ticker, year, quarter, src, err in summary["extract_failed"]:
+                        st.error(f"Extraction failed {ticker} {quarter} {year} {src}: {err}")
+                    st.caption(f"{summary['documents']} document(s) extracted in {summary['requests']} request(s); "
+                               f"{format_time_to_guidance(summary['time_to_guidance'])}")
+                    refresh_views()
+        run_summary_panel("backfill")
+        if st.button("Queue as background job", help="Resumable: a separate worker process scrapes the quarters, "
+                     "retries failed documents and keeps going if this page is closed"):
+            os.environ["HEADLESS"] = "1" if headless else "0"
+            tlist = [t.strip().upper() for t in tickers.split(",") if t.strip()]
+            job_id, n = enqueue(tlist, start_year, end_year, start_q, end_q)
+            if n and ensure_playwright():
+                start_worker(int(workers))
+            st.success(f"Job #{job_id}: {n} task(s) queued" if n else f"Job #{job_id}: every task is already queued")
+        jobs_panel()
 
     with tab2:
         st.subheader("Extract & Merge")
@@ -79,10 +215,39 @@ def main():
         with gc2:
             g_end_year = st.number_input("Extract: End year", min_value=2000, max_value=2100, value=2024, step=1)
             g_end_q = st.selectbox("Extract: End quarter", ["Q1","Q2","Q3","Q4"], index=3, key="g_end_q")
+        ec1, ec2 = st.columns(2)
+        with ec1:
+            use_async = st.checkbox("Concurrent extraction", value=True,
+                                    help="Send documents across sources, quarters and tickers to OpenAI concurrently")
+            incremental = st.checkbox("Only new or changed documents", value=False,
+                                      help="Skip documents whose text, prompt and model match the stored guidance fingerprint")
+        with ec2:
+            concurrency = st.number_input("Max concurrent OpenAI requests", min_value=1, max_value=64,
+                                          value=EXTRACT_CONCURRENCY, step=1)
         if st.button("Run extraction for ticker"):
-            with st.spinner("Extracting guidance from press releases, presentations, and transcripts..."):
-                extract_for_ticker(tg.upper(), mdl, g_start_year, g_end_year, g_start_q, g_end_q)
+            tlist = [x.strip().upper() for x in tg.split(",") if x.strip()]
+            with st.spinner("Extracting guidance from press releases, presentations, and transcripts..."), \
+                    telemetry.run("extract") as trace:
+                if use_async:
+                    res = extract_async(tlist, mdl, g_start_year, g_end_year, g_start_q, g_end_q,
+                                        concurrency=int(concurrency), incremental=incremental)
+                    for ticker, year, quarter, src, err in res["failed"]:
+                        st.error(f"Failed {ticker} {quarter} {year} {src}: {err}")
+                    results = [res]
+                else:
+                    results = [extract_for_ticker(x, mdl, g_start_year, g_end_year, g_start_q, g_end_q,
+                                                  incremental=incremental) for x in tlist]
+            st.session_state.setdefault("run_summaries", {})["extract"] = trace.summary()
+            refresh_views()
             st.success("Extraction completed.")
+            hits = sum(r["cache"]["hits"] for r in results)
+            misses = sum(r["cache"]["misses"] for r in results)
+            saved = sum(r["cache"]["tokens_saved"] for r in results)
+            mined = sum(r["plan"]["candidates"] for r in results)
+            sent = sum(r["plan"]["sent"] for r in results)
+            st.caption(f"{sent} of {mined} candidate(s) sent after deduplication · "
+                       f"LLM cache: {hits} hit(s), {misses} miss(es), ~{saved:,} tokens saved")
+        run_summary_panel("extract")
 
         st.divider()
         st.subheader("Build merged table")
@@ -95,35 +260,16 @@ def main():
             v_end_year = st.number_input("View: End year", min_value=2000, max_value=2100, value=2024, step=1)
             v_end_q = st.selectbox("View: End quarter", ["Q1","Q2","Q3","Q4"], index=3, key="v_end_q")
         if st.button("Build merged view"):
-            ticker = (t or tg).strip().upper()
-            rows = fetch_rows(ticker, file_type="guidance_json", file_format="json")
-            # Filter guidance_json rows to selected view window
-            QMAP = {'Q1':1,'Q2':2,'Q3':3,'Q4':4}
-            frows = []
-            for r in rows:
-                y = r.get('year')
-                q = r.get('quarter')
-                if y is None or not q:
-                    continue
-                qn = QMAP.get(str(q).upper(), 0)
-                qn_start = QMAP[v_start_q] if y == v_start_year else 1
-                qn_end = QMAP[v_end_q] if y == v_end_year else 4
-                if v_start_year < y < v_end_year or (y == v_start_year and qn >= qn_start) or (y == v_end_year and qn <= qn_end):
-                    frows.append(r)
-            rows = frows
-            by_src = {"press_release": [], "presentation": [], "transcript": []}
-            for r in rows:
-                try:
-                    items = json.loads(r.get("text_content") or "[]")
-                except Exception:
-                    items = []
-                for it in items:
-                    src = it.get("source") or "transcript"
-                    it.setdefault("provenance", [])
-                    it["provenance"].append(r.get("source_url"))
-                    by_src.setdefault(src, []).append(it)
-
-            merged = merge_items(by_src)
+            ticker = (t or tg.split(",")[0]).strip().upper()
+            window = (int(v_start_year), int(v_end_year), v_start_q, v_end_q)
+            st.session_state.merged_view = (ticker,) + window + (guidance_stamp(ticker, *window),)
+
+        # The built view lives in session state, so conflict choices and other reruns redraw it from
+        # the cache instead of refetching and re-merging.
+        view = st.session_state.get("merged_view")
+        if view:
+            ticker = view[0]
+            merged = load_merged_view(*view)
             data = [{
                 "Metric": m.get("metric"),
                 "Value of guide": m.get("guidance_value_text"),
@@ -139,6 +285,7 @@ def main():
                 "Metric", "Value of guide", "Period", "Period type",
                 "Low end of guidance", "High end of guidance", "Average", "Filing date"
             ])
+            st.caption(f"{ticker}: {view[3]} {view[1]} – {view[4]} {view[2]}")
             if df.empty:
                 st.info("No structured guidance yet. Try extracting or a different ticker.")
             else:
@@ -147,8 +294,6 @@ def main():
             st.divider()
             st.subheader("Resolve conflicts (if any)")
 
-            merged_for_conf = merge_items(by_src)
-
             from collections import defaultdict
             def key_label(k):
                 metric, ptype, fy, q = k
@@ -156,14 +301,14 @@ def main():
                 return f"{metric} — {per} ({ptype})"
 
             merged_by_key = defaultdict(list)
-            for m in merged_for_conf:
+            for m in merged:
                 _pt, _fy, _q = canon_period(m.get("period") or "")
                 pt = m.get("period_type") if m.get("period_type") in ("quarter", "full year") else _pt
                 k = (canon_metric(m.get("metric", "")), pt, _fy, _q)
                 merged_by_key[k].append(m)
 
             # Load previous resolutions for preselect
-            prev = fetch_resolutions(ticker)
+            prev = load_resolutions(ticker)
             prev_map = {r.get("metric_key"): r.get("chosen_json") for r in (prev or [])}
 
             def preselect_index_for_key(k, items):
@@ -222,14 +367,15 @@ def main():
                         idx = st.session_state.conflict_choices.get(key_str, 0)
                         kept.append(items[idx])
 
-                # Persist chosen resolutions
+                # Persist chosen resolutions in one request
+                resolutions = []
                 for m in kept:
                     fy, q, pt = canon_period(m.get("period") or "")
                     key = make_metric_key(m.get("metric") or "", m.get("period_type") or pt, fy, q)
-                    try:
-                        save_resolution(ticker, int(fy) if (fy and str(fy).isdigit()) else 0, q or "", key, json.dumps(m, ensure_ascii=False))
-                    except Exception:
-                        save_resolution(ticker, 0, q or "", key, json.dumps(m, ensure_ascii=False))
+                    year = int(fy) if (fy and str(fy).isdigit()) else 0
+                    resolutions.append(resolution_row(ticker, year, q or "", key, json.dumps(m, ensure_ascii=False)))
+                save_resolutions(resolutions)
+                load_resolutions.clear()
 
                 final_rows = [{
                     "Metric": m.get("metric"),
@@ -252,3 +398,37 @@ def main():
                     st.dataframe(final_df, use_container_width=True)
                     st.download_button("Download CSV", final_df.to_csv(index=False).encode("utf-8"),
                                        file_name=f"{ticker}_guidance_FINAL.csv", mime="text/csv")
+
+        st.divider()
+        st.subheader("Portfolio view (many tickers)")
+        pc1, pc2 = st.columns(2)
+        with pc1:
+            p_tickers = st.text_area("Tickers (commas, spaces or one per line)", "", key="p_tickers")
+        with pc2:
+            watchlist = st.file_uploader("…or a watchlist file", type=["txt", "csv"], key="p_watchlist")
+        if st.button("Build portfolio view"):
+            plist = parse_tickers(p_tickers)
+            if watchlist is not None:
+                plist = list(dict.fromkeys(plist + parse_tickers(watchlist.getvalue().decode("utf-8", "ignore"))))
+            if not plist:
+                st.warning("Enter at least one ticker or upload a watchlist.")
+            else:
+                window = (int(v_start_year), int(v_end_year), v_start_q, v_end_q)
+                st.session_state.portfolio_view = (tuple(plist),) + window + (guidance_stamp(plist, *window),)
+        pview = st.session_state.get("portfolio_view")
+        if pview:
+            port_df, csv_bytes, parquet_bytes = load_portfolio(*pview)
+            if port_df.empty:
+                st.info("No structured guidance for these tickers in the view window.")
+            else:
+                st.caption(f"{len(port_df)} row(s) across {port_df['Ticker'].nunique()} ticker(s); "
+                           f"{int(port_df['Conflict'].sum())} in conflict groups (resolve per ticker above).")
+                st.dataframe(port_df, use_container_width=True)
+                dc1, dc2 = st.columns(2)
+                with dc1:
+                    st.download_button("Download CSV", csv_bytes, file_name="portfolio_guidance.csv",
+                                       mime="text/csv", key="p_csv")
+                with dc2:
+                    if parquet_bytes is not None:
+                        st.download_button("Download Parquet", parquet_bytes, file_name="portfolio_guidance.parquet",
+                                           mime="application/octet-stream", key="p_parquet")
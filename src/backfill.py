@@ -0,0 +1,278 @@
+import os
+import time
+import asyncio
+from typing import List, Dict, Any, Optional, Tuple, Callable, Awaitable
+from .cloud_store import WriteBehindQueue
+from .telemetry import span, count, traced
+from .inventory import Inventory
+from .pdf_text import pdf_bytes_to_text, get_pdf_pool
+from .quartr_loader import (
+    EMAIL,
+    PASSWORD,
+    HEADLESS,
+    SLOW_MO_MS,
+    LABELS,
+    LOGIN_URL,
+    SCRAPE_FAST,
+    SCRAPE_TIMEOUT_MS,
+    SCRAPE_SETTLE_MS,
+    QUARTER_RGX,
+    LABEL_RGX,
+    should_block,
+    is_documents_response,
+    latency_stats,
+    format_latency,
+    is_cloud_headless,
+    iter_quarters,
+    save_document,
+    stored_quarter,
+    ensure_text_row_from_existing_pdf,
+)
+
+# Backfill scheduler: one Chromium, one login, N isolated contexts sharing the
+# login's storage state. Work is fanned out as (ticker, year, quarter) units.
+# The Quartr page steps and the per-quarter routine (scrape_quarter) below are the only implementation;
+# quartr_loader.load_company_years, src/jobs.py and src/pipeline.py all drive them.
+
+BACKFILL_WORKERS = int(os.getenv("BACKFILL_WORKERS", "4"))
+
+async def block_resources(context):
+    async def handle(route):
+        if should_block(route.request.resource_type, route.request.url):
+            await route.abort()
+        else:
+            await route.continue_()
+    await context.route("**/*", handle)
+
+@traced("quartr.login")
+async def login(page):
+    if not SCRAPE_FAST:
+        await page.goto(LOGIN_URL, wait_until="networkidle")
+        await page.wait_for_timeout(500)
+    else:
+        # fill() and click() already wait for their element; the app shell is enough.
+        await page.goto(LOGIN_URL, wait_until="domcontentloaded")
+    await page.get_by_placeholder("Email").fill(EMAIL)
+    await page.get_by_placeholder("Password").fill(PASSWORD)
+    await page.get_by_role("button", name="Log in").click()
+    if SCRAPE_FAST:
+        await page.get_by_placeholder("Search").wait_for(timeout=SCRAPE_TIMEOUT_MS)
+    else:
+        await page.wait_for_load_state("networkidle")
+
+@traced("quartr.open_company")
+async def open_company(page, ticker: str):
+    await page.get_by_placeholder("Search").click()
+    await page.get_by_placeholder("Search").fill(ticker)
+    await page.keyboard.press("Enter")
+    if not SCRAPE_FAST:
+        await page.wait_for_timeout(1200)
+        await page.get_by_text(ticker.upper(), exact=False).first.click()
+        await page.wait_for_load_state("networkidle")
+        return
+    await page.get_by_text(ticker.upper(), exact=False).first.click(timeout=SCRAPE_TIMEOUT_MS)
+    await page.get_by_text(QUARTER_RGX).first.wait_for(timeout=SCRAPE_TIMEOUT_MS)
+
+@traced("quartr.open_quarter")
+async def open_quarter(page, year: int, quarter: str) -> bool:
+    from playwright.async_api import TimeoutError as PWTimeoutError
+    patterns = [f"{quarter} {year}", f"{quarter} FY{year}", f"{quarter} {str(year)[-2:]}"]
+    for pat in patterns:
+        loc = page.get_by_text(pat, exact=False)
+        if await loc.count():
+            if not SCRAPE_FAST:
+                await loc.first.click()
+                await page.wait_for_load_state("networkidle")
+                await page.wait_for_timeout(600)
+                return True
+            # The company page stays open, so the previous quarter's labels are still on it; they must be gone
+            # before download_label looks for this quarter's, or it would fetch the previous documents.
+            stale = await page.get_by_text(LABEL_RGX).element_handles()
+            try:
+                async with page.expect_response(is_documents_response, timeout=SCRAPE_SETTLE_MS):
+                    await loc.first.click()
+            except PWTimeoutError:
+                pass
+            try:
+                for el in stale:
+                    await el.wait_for_element_state("hidden", timeout=SCRAPE_SETTLE_MS)
+            except PWTimeoutError:
+                # The labels were updated in place (or the click changed nothing): no element tells the
+                # quarters apart, so settle the way SCRAPE_FAST=0 does.
+                count("quartr.settle_fallbacks")
+                await page.wait_for_load_state("networkidle")
+                await page.wait_for_timeout(600)
+                return True
+            try:
+                await page.get_by_text(LABEL_RGX).first.wait_for(timeout=SCRAPE_SETTLE_MS)
+            except PWTimeoutError:
+                pass
+            return True
+    return False
+
+@traced("quartr.download")
+async def download_label(page, label_text: str):
+    locator = page.get_by_text(label_text, exact=False).first
+    if not await locator.count():
+        return None, None
+    from playwright.async_api import TimeoutError as PWTimeoutError
+    try:
+        async with page.expect_download() as dl_info:
+            await locator.click()
+        dl = await dl_info.value
+        path = await dl.path()
+        with open(path, "rb") as fh:
+            data = fh.read()
+        count("quartr.bytes_downloaded", len(data))
+        return data, dl.url
+    except PWTimeoutError:
+        return None, None
+
+def work_units(tickers: List[str], start_year: int, end_year: int, start_q: str = 'Q1', end_q: str = 'Q4') -> List[Tuple[str, int, str]]:
+    units = []
+    for t in tickers:
+        for year, quarter in iter_quarters(start_year, end_year, start_q, end_q):
+            units.append((t.upper(), year, quarter))
+    return units
+
+async def save_download(ticker: str, year: int, quarter: str, ftype: str, data: bytes, url: str, inventory: Inventory,
+                        writer: Optional[WriteBehindQueue] = None):
+    # PyMuPDF parsing runs in the process pool so large decks neither block the event loop nor hold the GIL.
+    with span("pdf.to_text"):
+        text = await asyncio.get_running_loop().run_in_executor(get_pdf_pool(), pdf_bytes_to_text, data)
+    await asyncio.to_thread(save_document, ticker, year, quarter, ftype, data, url, inventory, writer, text)
+
+async def scrape_quarter(page, state: Dict[str, Any], inventory: Inventory, ticker: str, year: int, quarter: str,
+                         on_download: Callable[[str, str, bytes, str], Awaitable[None]],
+                         ftypes: Optional[List[str]] = None) -> Dict[str, Any]:
+    # One quarter for the backfill, the job worker and the pipeline. Documents whose PDF is stored only get
+    # their text row; the company (state["ticker"] is the one the page is on) and the quarter are opened
+    # when something is left to download, and each download goes to on_download(ftype, label, data, url)
+    # before the next label is clicked. Returns the file types "stored", "saved" and "missing" (all of the
+    # remaining ones when the quarter was not "opened"), and the "seconds" spent navigating and downloading.
+    result: Dict[str, Any] = {"opened": True, "stored": [], "saved": [], "missing": [], "seconds": 0.0}
+    todo = []
+    for label, ftype in LABELS:
+        if ftypes is not None and ftype not in ftypes:
+            continue
+        if await asyncio.to_thread(inventory.has_pdf, year, quarter, ftype):
+            await asyncio.to_thread(ensure_text_row_from_existing_pdf, ticker, year, quarter, ftype, inventory)
+            result["stored"].append(ftype)
+        else:
+            todo.append((label, ftype))
+    if not todo:
+        return result
+    started = time.perf_counter()
+    if state.get("ticker") != ticker:
+        await open_company(page, ticker)
+        state["ticker"] = ticker
+    opened = await open_quarter(page, year, quarter)
+    result["seconds"] += time.perf_counter() - started
+    if not opened:
+        print(f"[{ticker}] Skip: could not open {quarter} {year}")
+        result["opened"] = False
+        result["missing"] = [ftype for _label, ftype in todo]
+        return result
+    for label, ftype in todo:
+        started = time.perf_counter()
+        b, url = await download_label(page, label)
+        result["seconds"] += time.perf_counter() - started
+        if not b:
+            print(f"[{ticker}] {quarter} {year} — {label}: not available")
+            result["missing"].append(ftype)
+            continue
+        await on_download(ftype, label, b, url)
+        result["saved"].append(ftype)
+    return result
+
+async def _process_unit(page, state: Dict[str, Any], inventory: Inventory, writer: WriteBehindQueue, ticker: str, year: int,
+                        quarter: str, summary: Dict[str, Any]):
+    async def save(ftype, label, data, url):
+        await save_download(ticker, year, quarter, ftype, data, url, inventory, writer)
+        print(f"[{ticker}] Saved {label} PDF & TEXT ({quarter} {year})")
+
+    result = await scrape_quarter(page, state, inventory, ticker, year, quarter, save)
+    summary["skipped"] += len(result["stored"])
+    if not result["opened"]:
+        summary["unopened"] += 1
+        return
+    summary["saved"] += len(result["saved"])
+    summary["missing"] += len(result["missing"])
+    # Scrape latency: navigation and downloads, not text extraction or storage.
+    summary["scrape_seconds"].append(result["seconds"])
+
+async def _worker(browser, state: Dict[str, Any], queue: asyncio.Queue, inventories: Dict[str, Inventory],
+                  writer: WriteBehindQueue, summary: Dict[str, Any]):
+    ctx = await browser.new_context(accept_downloads=True, storage_state=state)
+    if SCRAPE_FAST:
+        await block_resources(ctx)
+    page = await ctx.new_page()
+    current: Dict[str, Any] = {}
+    try:
+        while True:
+            try:
+                ticker, year, quarter = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            try:
+                await _process_unit(page, current, inventories[ticker], writer, ticker, year, quarter, summary)
+            except Exception as e:
+                # Force a fresh company page for the next unit; the page may be in any state now.
+                current.clear()
+                summary["failed"].append((ticker, year, quarter, str(e)))
+                print(f"[{ticker}] {quarter} {year} failed: {e}")
+    finally:
+        await ctx.close()
+
+def _pending_units(units: List[Tuple[str, int, str]], inventories: Dict[str, Inventory], summary: Dict[str, Any]):
+    pending = []
+    for ticker, year, quarter in units:
+        if stored_quarter(inventories[ticker], year, quarter):
+            summary["skipped"] += len(LABELS)
+        else:
+            pending.append((ticker, year, quarter))
+    return pending
+
+async def _backfill(units: List[Tuple[str, int, str]], workers: int) -> Dict[str, Any]:
+    # "units" and "unopened" count quarters; "saved", "skipped" and "missing" count documents.
+    summary: Dict[str, Any] = {"units": len(units), "unopened": 0, "saved": 0, "skipped": 0, "missing": 0, "failed": [],
+                               "scrape_seconds": []}
+    tickers = sorted({u[0] for u in units})
+    loaded = await asyncio.gather(*[asyncio.to_thread(lambda t=t: Inventory(t).load()) for t in tickers])
+    inventories = {inv.ticker: inv for inv in loaded}
+    units = await asyncio.to_thread(_pending_units, units, inventories, summary)
+    if not units:
+        return summary
+    from playwright.async_api import async_playwright
+    queue: asyncio.Queue = asyncio.Queue()
+    for u in units:
+        queue.put_nowait(u)
+    async with async_playwright() as p:
+        args = ["--no-sandbox", "--disable-dev-shm-usage"]
+        headless_flag = True if is_cloud_headless() else HEADLESS
+        browser = await p.chromium.launch(headless=headless_flag, slow_mo=SLOW_MO_MS, args=args)
+        writer = WriteBehindQueue()
+        try:
+            login_ctx = await browser.new_context()
+            if SCRAPE_FAST:
+                await block_resources(login_ctx)
+            await login(await login_ctx.new_page())
+            state = await login_ctx.storage_state()
+            await login_ctx.close()
+            n = max(1, min(workers, len(units)))
+            await asyncio.gather(*[_worker(browser, state, queue, inventories, writer, summary) for _ in range(n)])
+        finally:
+            await browser.close()
+            await asyncio.to_thread(writer.close)
+    # Only reached when nothing else failed; flush errors must not mask an exception from the run itself.
+    writer.check()
+    return summary
+
+def backfill(tickers: List[str], start_year: int, end_year: int, start_q: str = 'Q1', end_q: str = 'Q4',
+             workers: Optional[int] = None) -> Dict[str, Any]:
+    units = work_units(tickers, start_year, end_year, start_q, end_q)
+    summary = asyncio.run(_backfill(units, workers or BACKFILL_WORKERS))
+    # Per-quarter scrape latency (p50/p90 seconds) of the quarters that were navigated to.
+    summary["latency"] = latency_stats(summary.pop("scrape_seconds"))
+    print(f"[backfill] {format_latency(summary['latency'])}")
+    return summary
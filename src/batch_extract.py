@@ -0,0 +1,353 @@
+# Offline extraction through the OpenAI Batch API, for large historical backfills where cost and rate
+# limits matter more than latency. Every pending request is written to a JSONL batch file, uploaded and
+# submitted; results are polled for and ingested into guidance_json rows. Each run keeps its state under
+# .cache/batches/<run_id>.json and can be resumed at any step. Usage:
+#   python -m src.batch_extract run --tickers AAPL,MSFT --start-year 2015 --end-year 2024 --incremental
+#   python -m src.batch_extract status [RUN_ID]
+#   python -m src.batch_extract resume RUN_ID
+import os
+import sys
+import json
+import time
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Any, Optional
+from dotenv import load_dotenv
+
+load_dotenv()
+
+from openai import OpenAI  # noqa: E402
+from .guidance import (  # noqa: E402
+    DEFAULT_MODEL,
+    QuarterWriter,
+    build_messages,
+    parse_items,
+    load_fingerprints,
+    extraction_version,
+    _prepare,
+    _request_docs,
+    candidate_keys,
+    _cache_lookup,
+    _cache_store,
+    openai_client,
+)
+from .llm_cache import get_cache, CacheStats  # noqa: E402
+from .batching import plan_requests, plan_stats, DocCollector  # noqa: E402
+
+BATCH_DIR = os.getenv("OPENAI_BATCH_DIR", os.path.join(".cache", "batches"))
+# OpenAI limits one batch input file to 50,000 requests and 200 MB.
+BATCH_MAX_REQUESTS = int(os.getenv("OPENAI_BATCH_MAX_REQUESTS", "50000"))
+BATCH_MAX_BYTES = int(os.getenv("OPENAI_BATCH_MAX_BYTES", str(190 * 1024 * 1024)))
+BATCH_POLL_SECONDS = float(os.getenv("OPENAI_BATCH_POLL_SECONDS", "60"))
+ENDPOINT = "/v1/chat/completions"
+TERMINAL = {"completed", "failed", "expired", "cancelled"}
+
+def _client() -> OpenAI:
+    return openai_client()
+
+def state_path(run_id: str) -> str:
+    return os.path.join(BATCH_DIR, f"{run_id}.json")
+
+def save_state(state: Dict[str, Any]):
+    # Written to a temp file and renamed, so an interrupted run never leaves a truncated state behind.
+    os.makedirs(BATCH_DIR, exist_ok=True)
+    tmp = state_path(state["run_id"]) + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as fh:
+        json.dump(state, fh, ensure_ascii=False)
+    os.replace(tmp, state_path(state["run_id"]))
+
+def load_state(run_id: str) -> Dict[str, Any]:
+    with open(state_path(run_id), encoding="utf-8") as fh:
+        return json.load(fh)
+
+def list_runs() -> List[str]:
+    if not os.path.isdir(BATCH_DIR):
+        return []
+    return sorted(f[:-5] for f in os.listdir(BATCH_DIR) if f.endswith(".json"))
+
+def _batch_line(custom_id: str, model: str, messages) -> Dict[str, Any]:
+    return {"custom_id": custom_id, "method": "POST", "url": ENDPOINT,
+            "body": {"model": model, "temperature": 0, "messages": messages, "response_format": {"type": "json_object"}}}
+
+def _write_parts(run_id: str, lines: List[str]) -> List[Dict[str, Any]]:
+    parts, chunk, size = [], [], 0
+    def close():
+        path = os.path.join(BATCH_DIR, f"{run_id}.part{len(parts)}.input.jsonl")
+        with open(path, "w", encoding="utf-8") as fh:
+            fh.writelines(chunk)
+        parts.append({"input": path, "requests": len(chunk), "file_id": None, "batch_id": None, "status": None,
+                      "output_file_id": None, "error_file_id": None, "output": None, "errors": None})
+    for line in lines:
+        if chunk and (len(chunk) >= BATCH_MAX_REQUESTS or size + len(line.encode("utf-8")) > BATCH_MAX_BYTES):
+            close()
+            chunk, size = [], 0
+        chunk.append(line)
+        size += len(line.encode("utf-8"))
+    if chunk:
+        close()
+    return parts
+
+def prepare_batch(tickers: List[str], model: Optional[str] = None, start_year: Optional[int] = None, end_year: Optional[int] = None,
+                  start_q: str = 'Q1', end_q: str = 'Q4', incremental: bool = False, token_budget: Optional[int] = None,
+                  run_id: Optional[str] = None) -> Dict[str, Any]:
+    # Mines candidates and plans requests exactly like the online paths; candidates already in the LLM cache
+    # are answered locally and never submitted.
+    model = model or DEFAULT_MODEL
+    tickers = [t.upper() for t in ([tickers] if isinstance(tickers, str) else tickers)]
+    run_id = run_id or time.strftime("%Y%m%d-%H%M%S")
+    with ThreadPoolExecutor(max_workers=max(1, min(8, len(tickers)))) as ex:
+        prepared = list(ex.map(lambda t: _prepare(t, model, start_year, end_year, start_q, end_q, incremental), tickers))
+    docs = [d for lst, _v, _e in prepared for d in lst]
+    docs.sort(key=lambda d: (d["ticker"], d["year"], d["quarter"]))
+    requests = plan_requests(docs, token_budget)
+    cache = get_cache()
+    stats = CacheStats()
+    cached, lines = {}, []
+    for n, req in enumerate(requests):
+        req["custom_id"] = f"r{n}"
+        found = _cache_lookup(cache, candidate_keys(model, req["candidates"]), stats) if cache else {}
+        if found:
+            cached[req["custom_id"]] = [it for its in found.values() for it in its]
+        todo = [c for c in req["candidates"] if c["id"] not in found]
+        # Only the candidates missing from the cache are submitted; ingest adds the cached items back.
+        req["sent"] = bool(todo)
+        if todo:
+            lines.append(json.dumps(_batch_line(req["custom_id"], model, build_messages(todo)), ensure_ascii=False) + "\n")
+    os.makedirs(BATCH_DIR, exist_ok=True)
+    state = {
+        "run_id": run_id,
+        "model": model,
+        "version": extraction_version(model),
+        "tickers": tickers,
+        "window": {"start_year": start_year, "end_year": end_year, "start_q": start_q, "end_q": end_q},
+        "incremental": incremental,
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "phase": "prepared",
+        # Candidates are only needed to build the batch file; routing needs the owners alone.
+        "docs": [dict(d, candidates=len(d["candidates"])) for d in docs],
+        "requests": [{"custom_id": r["custom_id"], "owners": r["owners"], "sent": r["sent"]} for r in requests],
+        "cached": cached,
+        "parts": _write_parts(run_id, lines),
+        "plan": plan_stats(docs, requests),
+        "cache": stats.as_dict(),
+        "summary": None,
+    }
+    save_state(state)
+    print(f"[batch {run_id}] {len(requests)} request(s) for {len(docs)} document(s); "
+          f"{len(lines)} to submit in {len(state['parts'])} part(s), {len(requests) - len(lines)} from cache")
+    return state
+
+def _find_batch(client: OpenAI, run_id: str, part: int) -> Optional[str]:
+    # A run interrupted between batches.create and save_state would otherwise submit the same part twice.
+    # Iterating the page follows the `after` cursor through every batch of the account, newest first.
+    for b in client.batches.list(limit=100):
+        meta = b.metadata or {}
+        if meta.get("run_id") == run_id and meta.get("part") == str(part) and b.status not in ("failed", "cancelled"):
+            return b.id
+    return None
+
+def submit_batch(state: Dict[str, Any], client: Optional[OpenAI] = None) -> Dict[str, Any]:
+    client = client or _client()
+    for n, part in enumerate(state["parts"]):
+        if part["batch_id"]:
+            continue
+        if not part["file_id"]:
+            with open(part["input"], "rb") as fh:
+                part["file_id"] = client.files.create(file=fh, purpose="batch").id
+            save_state(state)
+        part["batch_id"] = _find_batch(client, state["run_id"], n) or client.batches.create(
+            input_file_id=part["file_id"], endpoint=ENDPOINT, completion_window="24h",
+            metadata={"run_id": state["run_id"], "part": str(n)},
+        ).id
+        part["status"] = "validating"
+        save_state(state)
+        print(f"[batch {state['run_id']}] part {n}: submitted {part['requests']} request(s) as {part['batch_id']}")
+    state["phase"] = "submitted"
+    save_state(state)
+    return state
+
+def poll_batch(state: Dict[str, Any], client: Optional[OpenAI] = None) -> bool:
+    # Refreshes every unfinished part; returns True once all parts reached a terminal status.
+    client = client or _client()
+    for n, part in enumerate(state["parts"]):
+        if part["status"] in TERMINAL:
+            continue
+        b = client.batches.retrieve(part["batch_id"])
+        part.update(status=b.status, output_file_id=b.output_file_id, error_file_id=b.error_file_id,
+                    counts=b.request_counts.model_dump() if b.request_counts else None)
+        print(f"[batch {state['run_id']}] part {n}: {b.status} {part.get('counts') or ''}")
+    save_state(state)
+    return all(p["status"] in TERMINAL for p in state["parts"])
+
+def _download(client: OpenAI, file_id: Optional[str], path: str) -> Optional[str]:
+    if not file_id:
+        return None
+    if not os.path.exists(path):
+        with open(path + ".tmp", "wb") as fh:
+            fh.write(client.files.content(file_id).content)
+        os.replace(path + ".tmp", path)
+    return path
+
+def _read_results(part: Dict[str, Any], results: Dict[str, Any], errors: Dict[str, str]):
+    for path in (part.get("output"), part.get("errors")):
+        if not path:
+            continue
+        with open(path, encoding="utf-8") as fh:
+            for line in fh:
+                if not line.strip():
+                    continue
+                row = json.loads(line)
+                cid, resp = row.get("custom_id"), row.get("response") or {}
+                try:
+                    if row.get("error") or resp.get("status_code") != 200:
+                        raise ValueError(json.dumps(row.get("error") or resp.get("body"))[:300])
+                    results[cid] = parse_items(resp["body"]["choices"][0]["message"]["content"])
+                except Exception as e:
+                    errors[cid] = str(e)
+
+def _read_messages(part: Dict[str, Any], wanted) -> Dict[str, Any]:
+    out = {}
+    with open(part["input"], encoding="utf-8") as fh:
+        for line in fh:
+            row = json.loads(line)
+            if row["custom_id"] in wanted:
+                out[row["custom_id"]] = row["body"]["messages"]
+    return out
+
+def _sent(state: Dict[str, Any]) -> set:
+    # Custom ids of the requests with candidates in the batch. Runs prepared before requests recorded
+    # "sent" kept a request in "cached" only when nothing of it was submitted.
+    return {r["custom_id"] for r in state["requests"] if r.get("sent", r["custom_id"] not in state["cached"])}
+
+def ingest_batch(state: Dict[str, Any], client: Optional[OpenAI] = None) -> Dict[str, Any]:
+    # Writes guidance_json rows from the batch output. Requests that errored, expired or were cancelled mark
+    # their documents as failed; QuarterWriter then leaves those quarters' stored rows untouched (whatever
+    # `incremental` was), and the next run extracts them again.
+    client = client or (_client() if state["parts"] else None)
+    run_id = state["run_id"]
+    sent = _sent(state)
+    results: Dict[str, Any] = {cid: items for cid, items in state["cached"].items() if cid not in sent}
+    errors: Dict[str, str] = {}
+    cache = get_cache()
+    for n, part in enumerate(state["parts"]):
+        part["output"] = _download(client, part["output_file_id"], os.path.join(BATCH_DIR, f"{run_id}.part{n}.output.jsonl"))
+        part["errors"] = _download(client, part["error_file_id"], os.path.join(BATCH_DIR, f"{run_id}.part{n}.errors.jsonl"))
+        save_state(state)
+        fresh: Dict[str, Any] = {}
+        _read_results(part, fresh, errors)
+        if cache and fresh:
+            for cid, messages in _read_messages(part, fresh).items():
+                candidates = json.loads(messages[-1]["content"])["candidates"]
+                _cache_store(cache, state["model"], candidate_keys(state["model"], candidates), candidates, fresh[cid])
+        for cid, items in fresh.items():
+            results[cid] = state["cached"].get(cid, []) + items
+
+    docs = state["docs"]
+    existing = {}
+    if state["incremental"]:
+        for t in state["tickers"]:
+            existing.update({(t,) + k: v for k, v in load_fingerprints(t, **state["window"]).items()})
+    writer = QuarterWriter(docs, state["version"], existing)
+    collector = DocCollector(state["requests"])
+    failed = []
+    for doc in docs:
+        if not doc["candidates"]:
+            done = writer.add(doc, [])
+            if done:
+                writer.write(done)
+    for req in state["requests"]:
+        cid = req["custom_id"]
+        items = results.get(cid)
+        if items is None:
+            err = errors.get(cid) or "no result (batch expired, cancelled or failed)"
+            failed.extend((d["ticker"], d["year"], d["quarter"], d["source"], err) for d in _request_docs(req, docs))
+        for i, its, ok in collector.add(req, items):
+            done = writer.add(docs[i], its, ok)
+            if done:
+                writer.write(done)
+    state["phase"] = "ingested"
+    state["summary"] = {"documents": len(docs), "requests": len(state["requests"]), "quarters": writer.written,
+                        "quarters_skipped": writer.skipped, "unrouted": collector.unrouted, "failed": failed, "plan": state["plan"], "cache": state["cache"]}
+    save_state(state)
+    print(f"[batch {run_id}] wrote {writer.written} quarter(s), left {writer.skipped} with failed documents as stored; "
+          f"{len(failed)} document(s) failed")
+    return state["summary"]
+
+def run_batch(state: Dict[str, Any], wait: bool = True, poll_seconds: Optional[float] = None) -> Optional[Dict[str, Any]]:
+    # Advances a run from whatever step it stopped at. Returns the summary, or None when not waiting
+    # and the batch is still running.
+    if state["phase"] == "ingested":
+        return state["summary"]
+    client = _client() if state["parts"] else None
+    if state["phase"] == "prepared":
+        submit_batch(state, client)
+    while state["parts"] and not poll_batch(state, client):
+        if not wait:
+            return None
+        time.sleep(BATCH_POLL_SECONDS if poll_seconds is None else poll_seconds)
+    return ingest_batch(state, client)
+
+def cancel_batch(state: Dict[str, Any]):
+    client = _client()
+    for part in state["parts"]:
+        if part["batch_id"] and part["status"] not in TERMINAL:
+            client.batches.cancel(part["batch_id"])
+    poll_batch(state, client)
+
+def _print_status(state: Dict[str, Any]):
+    print(f"{state['run_id']}: {state['phase']} — {len(state['docs'])} document(s), {len(state['requests'])} request(s), "
+          f"{len(state['requests']) - len(_sent(state))} from cache, model {state['model']}")
+    for n, p in enumerate(state["parts"]):
+        print(f"  part {n}: {p['requests']} request(s), batch {p['batch_id'] or '-'}, {p['status'] or 'not submitted'}")
+    if state.get("summary"):
+        s = state["summary"]
+        print(f"  wrote {s['quarters']} quarter(s); {len(s['failed'])} failed document(s)")
+
+def main(argv: Optional[List[str]] = None):
+    ap = argparse.ArgumentParser(prog="python -m src.batch_extract", description="Guidance extraction through the OpenAI Batch API.")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    run = sub.add_parser("run", help="Plan, submit, wait for and ingest a new batch run")
+    run.add_argument("--tickers", required=True, help="Comma-separated tickers")
+    run.add_argument("--start-year", type=int)
+    run.add_argument("--end-year", type=int)
+    run.add_argument("--start-q", default="Q1", choices=["Q1", "Q2", "Q3", "Q4"])
+    run.add_argument("--end-q", default="Q4", choices=["Q1", "Q2", "Q3", "Q4"])
+    run.add_argument("--model", default=DEFAULT_MODEL)
+    run.add_argument("--incremental", action="store_true", help="Only new or changed documents")
+    run.add_argument("--token-budget", type=int, help="Prompt tokens per request")
+    resume = sub.add_parser("resume", help="Continue a run from where it stopped")
+    resume.add_argument("run_id")
+    for p in (run, resume):
+        p.add_argument("--no-wait", action="store_true", help="Submit or poll once and exit")
+        p.add_argument("--poll-seconds", type=float, default=BATCH_POLL_SECONDS)
+    sub.add_parser("status", help="Show one run, or list runs").add_argument("run_id", nargs="?")
+    sub.add_parser("cancel", help="Cancel the unfinished parts of a run").add_argument("run_id")
+    args = ap.parse_args(argv)
+
+    if args.cmd == "status":
+        for run_id in [args.run_id] if args.run_id else list_runs():
+            _print_status(load_state(run_id))
+        return 0
+    if args.cmd == "cancel":
+        state = load_state(args.run_id)
+        cancel_batch(state)
+        _print_status(state)
+        return 0
+    if args.cmd == "run":
+        if (args.start_year is None) != (args.end_year is None):
+            ap.error("--start-year and --end-year go together")
+        tickers = [t.strip().upper() for t in args.tickers.split(",") if t.strip()]
+        state = prepare_batch(tickers, args.model, args.start_year, args.end_year, args.start_q, args.end_q,
+                              args.incremental, args.token_budget)
+    else:
+        state = load_state(args.run_id)
+    summary = run_batch(state, wait=not args.no_wait, poll_seconds=args.poll_seconds)
+    if summary is None:
+        print(f"[batch {state['run_id']}] still running; continue with: python -m src.batch_extract resume {state['run_id']}")
+        return 0
+    for t, y, q, src, err in summary["failed"]:
+        print(f"[batch {state['run_id']}] failed {t} {q} {y} {src}: {err}")
+    return 1 if summary["failed"] else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,117 @@
+import os
+import json
+from typing import List, Dict, Any, Tuple, Optional
+from .dedup import CandidateIndex
+
+# Token-budgeted request planning for extraction. Candidates of oversized documents are split into
+# chunks under the budget, and small documents of the same ticker are packed into shared requests.
+# Every candidate carries an "id" the model echoes back, which routes items to their documents.
+# Duplicate candidates of a ticker are sent once; their id lists every document they came from.
+
+TOKEN_BUDGET = int(os.getenv("EXTRACT_TOKEN_BUDGET", "6000"))
+MAX_CANDIDATES = int(os.getenv("EXTRACT_MAX_CANDIDATES", "40"))
+
+def count_tokens(text: str) -> int:
+    return len(text) // 4 + 1
+
+def candidate_tokens(c: Dict[str, Any]) -> int:
+    return count_tokens(json.dumps(c)) + 4
+
+def plan_requests(docs: List[Dict[str, Any]], budget: Optional[int] = None,
+                  max_candidates: Optional[int] = None, dedup: Optional[str] = None) -> List[Dict[str, Any]]:
+    # Returns requests as {"ticker", "candidates": [...with "id"], "owners": {id: [doc index, ...]}}.
+    # Docs are packed in their given order, so documents of one quarter tend to share a request.
+    # `dedup` is "exact", "minhash" or "off" (default EXTRACT_DEDUP).
+    budget = budget or TOKEN_BUDGET
+    max_candidates = max_candidates or MAX_CANDIDATES
+    requests: List[Dict[str, Any]] = []
+    current: Dict[str, Dict[str, Any]] = {}
+    used: Dict[str, int] = {}
+    seen: Dict[str, CandidateIndex] = {}
+
+    def close(ticker):
+        req = current.pop(ticker, None)
+        if req and req["candidates"]:
+            requests.append(req)
+
+    for idx, doc in enumerate(docs):
+        ticker = doc["ticker"]
+        index = seen.setdefault(ticker, CandidateIndex(dedup))
+        for c in doc["candidates"]:
+            dup = index.find(c)
+            if dup is not None:
+                owners = dup[0]["owners"][dup[1]]
+                if idx not in owners:
+                    owners.append(idx)
+                continue
+            cost = candidate_tokens(c)
+            req = current.get(ticker)
+            if req and (used[ticker] + cost > budget or len(req["candidates"]) >= max_candidates):
+                close(ticker)
+                req = None
+            if req is None:
+                req = current[ticker] = {"ticker": ticker, "candidates": [], "owners": {}}
+                used[ticker] = 0
+            cid = f"c{len(req['candidates'])}"
+            req["candidates"].append(dict(c, id=cid))
+            req["owners"][cid] = [idx]
+            used[ticker] += cost
+            index.add(c, (req, cid))
+    for ticker in list(current):
+        close(ticker)
+    return requests
+
+def plan_stats(docs: List[Dict[str, Any]], requests: List[Dict[str, Any]]) -> Dict[str, int]:
+    # Candidates mined vs. sent, and the prompt tokens of the sent ones.
+    return {"candidates": sum(len(d["candidates"]) for d in docs),
+            "sent": sum(len(r["candidates"]) for r in requests),
+            "prompt_tokens": sum(candidate_tokens(c) for r in requests for c in r["candidates"])}
+
+def route_items(request: Dict[str, Any], items: List[Dict[str, Any]]) -> Tuple[Dict[int, List[Dict[str, Any]]], int]:
+    # Returns ({doc index: items}, unrouted count). Items without a known id can only be placed when
+    # every candidate of the request belongs to the same documents.
+    owners = request["owners"]
+    all_docs = {i for idxs in owners.values() for i in idxs}
+    fallback = sorted(all_docs) if len({tuple(v) for v in owners.values()}) == 1 else None
+    routed: Dict[int, List[Dict[str, Any]]] = {i: [] for i in all_docs}
+    unrouted = 0
+    for it in items:
+        if not isinstance(it, dict):
+            continue
+        targets = owners.get(str(it.pop("id", "")), fallback)
+        if not targets:
+            unrouted += 1
+            continue
+        for n, i in enumerate(targets):
+            routed[i].append(it if n == 0 else dict(it))
+    return routed, unrouted
+
+# Tracks which requests each document is spread over; a document is complete once all of them returned.
+class DocCollector:
+    def __init__(self, requests: List[Dict[str, Any]]):
+        self.pending: Dict[int, int] = {}
+        self.items: Dict[int, List[Dict[str, Any]]] = {}
+        self.ok: Dict[int, bool] = {}
+        self.unrouted = 0
+        for req in requests:
+            for i in {i for idxs in req["owners"].values() for i in idxs}:
+                self.pending[i] = self.pending.get(i, 0) + 1
+                self.items.setdefault(i, [])
+                self.ok.setdefault(i, True)
+
+    def add(self, request: Dict[str, Any], items: Optional[List[Dict[str, Any]]]) -> List[Tuple[int, List[Dict[str, Any]], bool]]:
+        # `items` is None when the request failed. Returns (doc index, items, ok) for completed documents.
+        if items is None:
+            routed = {i: [] for idxs in request["owners"].values() for i in idxs}
+            for i in routed:
+                self.ok[i] = False
+        else:
+            routed, unrouted = route_items(request, items)
+            self.unrouted += unrouted
+        done = []
+        for i, its in routed.items():
+            self.items[i].extend(its)
+            self.pending[i] -= 1
+            if self.pending[i] == 0:
+                done.append((i, self.items.pop(i), self.ok.pop(i)))
+        return done
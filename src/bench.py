@@ -0,0 +1,352 @@
+# Offline benchmarks on synthetic earnings documents: no Quartr, OpenAI or Supabase needed. Extraction runs
+# against the stand-in OpenAI server (src/fake_openai.py) and a temporary local store (STORE_BACKEND=local).
+# Reports throughput and peak Python memory per stage and flags regressions against a saved baseline:
+#   python -m src.bench --size small --save-baseline      # record this machine's baseline
+#   python -m src.bench --size small                      # compare; exit code 1 on a regression
+#   python -m src.bench --size medium --only mine,merge --repeat 5
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import tempfile
+import platform
+import tracemalloc
+from typing import List, Dict, Any, Optional, Callable, Tuple
+
+BASELINE_PATH = os.getenv("BENCH_BASELINE", os.path.join(".cache", "bench_baseline.json"))
+
+SIZES = {
+    #          tickers, years, paragraphs per document, PDFs, guidance items per quarter, fake OpenAI latency (s)
+    "small":  dict(tickers=2, years=2, paragraphs=60, pdfs=6, items=60, latency=0.02),
+    "medium": dict(tickers=5, years=4, paragraphs=120, pdfs=24, items=120, latency=0.05),
+    "large":  dict(tickers=20, years=5, paragraphs=200, pdfs=80, items=200, latency=0.05),
+}
+SOURCES = ["press_release", "presentation", "transcript"]
+
+METRICS = [("revenue", "Revenue"), ("eps", "EPS"), ("gross margin", "Gross margin"), ("operating margin", "Operating margin"),
+           ("capex", "Capital expenditures"), ("fcf", "Free cash flow")]
+FILLER = [
+    "Our teams continued to execute on the product roadmap and we saw healthy engagement across regions.",
+    "We remain focused on disciplined investment, customer satisfaction and long-term value creation.",
+    "Demand trends were consistent with what we described last quarter, with strength in enterprise accounts.",
+    "We thank our employees, partners and shareholders for their continued support.",
+]
+SAFE_HARBOR = ("This release contains forward-looking statements within the meaning of the safe harbor provisions. "
+               "Actual results may differ materially from those expressed, and we expect no obligation to update them.")
+
+# ---- synthetic corpus ------------------------------------------------------------------------------------
+
+def guidance_paragraph(rng: random.Random, year: int, quarter: str) -> str:
+    key, name = rng.choice(METRICS)
+    nq = f"Q{int(quarter[1]) % 4 + 1}"
+    period = rng.choice([f"{nq} FY{year}", f"full year {year}", f"FY{year}", f"{nq} {year}"])
+    if key in ("gross margin", "operating margin"):
+        lo = rng.randint(20, 60)
+        return rng.choice([
+            f"For {period}, we expect {name.lower()} of {lo}% to {lo + 2}%.",
+            f"Our outlook for {period} {name.lower()} is approximately {lo}.5%, plus or minus 50 basis points.",
+        ])
+    if key == "eps":
+        lo = round(rng.uniform(0.5, 9), 2)
+        return f"We now expect {period} EPS in the range of ${lo} to ${lo + 0.2:.2f} per share."
+    lo = round(rng.uniform(1, 120), 1)
+    unit = rng.choice(["billion", "million"])
+    return rng.choice([
+        f"For {period}, we expect {name.lower()} of ${lo} {unit} to ${lo * 1.05:.1f} {unit}.",
+        f"We are raising our {period} guidance for {name.lower()} to ${lo} {unit}.",
+        f"{name} guidance for {period} is ${lo} {unit}, reflecting current demand.",
+    ])
+
+def history_paragraph(rng: random.Random) -> str:
+    _key, name = rng.choice(METRICS)
+    return (f"{name} for the quarter was ${round(rng.uniform(1, 90), 1)} billion, "
+            f"up {rng.randint(1, 30)}% year over year and {rng.randint(1, 9)}% sequentially.")
+
+def make_document(rng: random.Random, source: str, ticker: str, year: int, quarter: str, paragraphs: int) -> str:
+    out = []
+    if source == "press_release":
+        out.append(f"{ticker} Reports {quarter} {year} Results")
+    for i in range(paragraphs):
+        r = rng.random()
+        if r < 0.12:
+            p = guidance_paragraph(rng, year, quarter)
+        elif r < 0.35:
+            p = history_paragraph(rng)
+        else:
+            p = " ".join(rng.sample(FILLER, 2))
+        if source == "transcript":
+            p = f"{rng.choice(['Operator', 'Chief Executive Officer', 'Chief Financial Officer', 'Analyst'])}: {p}"
+        elif source == "presentation":
+            p = "• " + p
+        out.append(p)
+    out.append(SAFE_HARBOR)
+    return "\n\n".join(out)
+
+def make_corpus(rng: random.Random, tickers: int, years: int, paragraphs: int, **_) -> List[Dict[str, Any]]:
+    docs = []
+    for t in range(tickers):
+        ticker = f"T{t:03d}"
+        for year in range(2024 - years + 1, 2025):
+            for qi in range(1, 5):
+                for src in SOURCES:
+                    docs.append({"ticker": ticker, "year": year, "quarter": f"Q{qi}", "source": src,
+                                 "text": make_document(rng, src, ticker, year, f"Q{qi}", paragraphs)})
+    return docs
+
+def make_pdf(text: str, lines_per_page: int = 40) -> bytes:
+    import fitz  # PyMuPDF
+    doc = fitz.open()
+    lines = text.split("\n")
+    i = 0
+    while i < len(lines):
+        n = lines_per_page
+        while True:
+            page = doc.new_page()
+            # A negative result means the text did not fit and nothing was written; retry with fewer lines.
+            if page.insert_textbox(fitz.Rect(36, 36, 576, 806), "\n".join(lines[i:i + n]), fontsize=8) >= 0 or n == 1:
+                break
+            doc.delete_page(-1)
+            n = max(1, n // 2)
+        i += n
+    data = doc.tobytes()
+    doc.close()
+    return data
+
+def make_items(rng: random.Random, n: int, year: int) -> Dict[str, List[Dict[str, Any]]]:
+    # Guidance items as the model returns them: the same guide often appears in several sources, with
+    # slightly different wording, rounding or units.
+    by_src: Dict[str, List[Dict[str, Any]]] = {s: [] for s in SOURCES}
+    for _ in range(n):
+        _key, name = rng.choice(METRICS)
+        period = rng.choice([f"Q{rng.randint(1, 4)} FY{year}", f"full year {year}", f"FY{year}"])
+        lo = round(rng.uniform(1, 100), 1)
+        hi = lo if rng.random() < 0.3 else round(lo * 1.05, 1)
+        units = rng.choice(["USD billions", "$bn", "billion", "percent"])
+        for src in rng.sample(SOURCES, rng.randint(1, 3)):
+            jitter = 1 + rng.choice([0, 0, 0.0005, 0.03])
+            by_src[src].append({
+                "metric": rng.choice([name, name.lower(), name.upper()]),
+                "guidance_value_text": f"${lo} to ${hi}",
+                "period": period,
+                "period_type": "quarter" if period.startswith("Q") else "full year",
+                "low_end": round(lo * jitter, 3), "high_end": round(hi * jitter, 3),
+                "units": units, "filing_date": None,
+            })
+    return by_src
+
+# ---- measurement -----------------------------------------------------------------------------------------
+
+def measure(fn: Callable[[], Tuple[float, str]], repeat: int) -> Dict[str, Any]:
+    # fn() does the work once and returns (amount of work, unit). Throughput is from the fastest of
+    # `repeat` runs; peak memory (Python allocations, via tracemalloc) from one extra traced run.
+    best = None
+    for _ in range(max(1, repeat)):
+        start = time.perf_counter()
+        amount, unit = fn()
+        seconds = time.perf_counter() - start
+        best = seconds if best is None else min(best, seconds)
+    tracemalloc.start()
+    try:
+        fn()
+        _cur, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {"seconds": round(best, 4), "amount": amount, "unit": unit,
+            "throughput": round(amount / best, 2) if best else None, "peak_mb": round(peak / 2 ** 20, 2)}
+
+class Bench:
+    def __init__(self, size: Dict[str, Any], seed: int = 7):
+        self.size = size
+        self.seed = seed
+        self.docs = make_corpus(self.rng("corpus"), **size)
+        self.tmp = tempfile.mkdtemp(prefix="bench-")
+
+    def rng(self, name: str) -> random.Random:
+        # One generator per benchmark, seeded from (seed, name): a benchmark's workload does not depend on
+        # which other benchmarks ran before it, so --only runs compare against the same baseline inputs.
+        return random.Random(f"{self.seed}:{name}")
+
+    def bench_pdf(self):
+        from .pdf_text import pdf_bytes_to_text
+        blobs = [make_pdf(d["text"]) for d in self.docs[:self.size["pdfs"]]]
+        mb = sum(len(b) for b in blobs) / 2 ** 20
+
+        def run():
+            for b in blobs:
+                pdf_bytes_to_text(b)
+            return mb, "MB/s"
+        return run
+
+    def bench_mine(self):
+        from .prefilter import mine_candidates
+        texts = [d["text"] for d in self.docs]
+        mb = sum(len(t) for t in texts) / 2 ** 20
+
+        def run():
+            for t in texts:
+                mine_candidates(t)
+            return mb, "MB/s"
+        return run
+
+    def _quarter_items(self, rng: random.Random):
+        years = range(2024 - self.size["years"] + 1, 2025)
+        return [make_items(rng, self.size["items"], y) for _t in range(self.size["tickers"]) for y in years for _q in range(4)]
+
+    def bench_merge(self):
+        from .merge import merge_items
+        groups = self._quarter_items(self.rng("merge"))
+        n = sum(len(v) for g in groups for v in g.values())
+
+        def run():
+            for g in groups:
+                # merge_items annotates its input items; merge copies like the app's fresh JSON parse would.
+                merge_items({s: [dict(it) for it in lst] for s, lst in g.items()})
+            return n, "items/s"
+        return run
+
+    def bench_bucketize(self):
+        from .merge import bucketize
+        groups = self._quarter_items(self.rng("bucketize"))
+        n = sum(len(v) for g in groups for v in g.values())
+
+        def run():
+            for g in groups:
+                bucketize(g)
+            return n, "items/s"
+        return run
+
+    def _local_store(self, name: str):
+        from .stores import LocalStore, set_store
+        return set_store(LocalStore(os.path.join(self.tmp, name)))
+
+    def bench_view(self):
+        # The app's merged view: window-filtered guidance_json rows from the store, JSON parse, merge.
+        from .cloud_store import file_row, upsert_rows, fetch_rows
+        from .merge import merge_rows
+        self._local_store("view")
+        rng = self.rng("view")
+        rows, tickers = [], sorted({d["ticker"] for d in self.docs})
+        for d in self.docs:
+            if d["source"] == "transcript":
+                items = [dict(it, source=s) for s, lst in make_items(rng, self.size["items"] // 3, d["year"]).items() for it in lst]
+                rows.append(file_row(d["ticker"], d["year"], d["quarter"], "guidance_json", "json", None, "u", json.dumps(items)))
+        upsert_rows(rows)
+        last = 2024
+
+        def run():
+            n = 0
+            for t in tickers:
+                got = fetch_rows(t, file_type="guidance_json", file_format="json", columns="year,quarter,source_url,text_content",
+                                 start_year=last - 1, end_year=last, start_q="Q2", end_q="Q3")
+                merge_rows(got)
+                n += len(got)
+            return n, "rows/s"
+        return run
+
+    def bench_extract(self):
+        # Extraction loop (prefilter, dedup, request planning, concurrent requests, quarter writes) against
+        # the stand-in OpenAI server with a fixed per-request latency, on a local store.
+        from .fake_openai import serve
+        from .cloud_store import file_row, upsert_rows
+        server, url = serve(latency=self.size["latency"])
+        os.environ["OPENAI_BASE_URL"] = url
+        os.environ.setdefault("OPENAI_API_KEY", "bench")
+        from . import guidance
+        self._local_store("extract")
+        upsert_rows([file_row(d["ticker"], d["year"], d["quarter"], d["source"], "text", None, "u", d["text"]) for d in self.docs])
+        tickers = sorted({d["ticker"] for d in self.docs})
+
+        def run():
+            res = guidance.extract_async(tickers, "bench-model", 2024 - self.size["years"] + 1, 2024)
+            if res["failed"]:
+                raise RuntimeError(f"{len(res['failed'])} document(s) failed")
+            return res["documents"], "docs/s"
+        return run
+
+BENCHES = ["pdf", "mine", "merge", "bucketize", "view", "extract"]
+# Bumped whenever the synthetic inputs change for the same size and seed; older baselines are not compared.
+WORKLOAD = 2
+
+def compare(results: Dict[str, Any], baseline: Dict[str, Any], tolerance: float) -> List[str]:
+    flagged = []
+    for name, r in results.items():
+        b = baseline.get("results", {}).get(name)
+        if not b:
+            continue
+        if b.get("throughput") and r["throughput"] < b["throughput"] * (1 - tolerance):
+            flagged.append(f"{name}: throughput {r['throughput']:g} {r['unit']} vs baseline {b['throughput']:g} "
+                           f"({100 * (r['throughput'] / b['throughput'] - 1):+.0f}%)")
+        if b.get("peak_mb") and r["peak_mb"] > max(b["peak_mb"] * (1 + tolerance), b["peak_mb"] + 1):
+            flagged.append(f"{name}: peak memory {r['peak_mb']:g} MB vs baseline {b['peak_mb']:g} MB")
+    return flagged
+
+def main(argv: Optional[List[str]] = None):
+    ap = argparse.ArgumentParser(prog="python -m src.bench", description="Offline benchmarks on a synthetic earnings corpus.")
+    ap.add_argument("--size", default="small", choices=sorted(SIZES))
+    ap.add_argument("--only", help=f"Comma-separated subset of: {','.join(BENCHES)}")
+    ap.add_argument("--repeat", type=int, default=3, help="Timed runs per benchmark (fastest is reported)")
+    ap.add_argument("--seed", type=int, default=7)
+    ap.add_argument("--format", default="plain", choices=["plain", "compact"], help="Storage format of the local store (STORE_FORMAT)")
+    ap.add_argument("--baseline", default=BASELINE_PATH, help="Baseline JSON file")
+    ap.add_argument("--save-baseline", action="store_true", help="Write these results as the new baseline")
+    ap.add_argument("--tolerance", type=float, default=0.15, help="Allowed slowdown / memory growth before flagging")
+    ap.add_argument("--json", help="Also write the results to this file")
+    args = ap.parse_args(argv)
+
+    # The run must not touch the real store, cache or telemetry files.
+    os.environ["STORE_BACKEND"] = "local"
+    os.environ["STORE_FORMAT"] = args.format
+    os.environ["LLM_CACHE_BACKEND"] = "off"
+    os.environ.pop("TELEMETRY_EXPORT", None)
+    names = [n.strip() for n in (args.only or ",".join(BENCHES)).split(",") if n.strip()]
+    unknown = [n for n in names if n not in BENCHES]
+    if unknown:
+        ap.error(f"unknown benchmark(s): {', '.join(unknown)}")
+
+    bench = Bench(SIZES[args.size], args.seed)
+    print(f"[bench] size={args.size}: {len(bench.docs)} documents, "
+          f"{sum(len(d['text']) for d in bench.docs) / 2 ** 20:.1f} MB of text")
+    results = {}
+    for name in names:
+        # Extraction hits a local HTTP server; one timed run is enough to see concurrency regressions.
+        repeat = 1 if name == "extract" else args.repeat
+        r = measure(getattr(bench, f"bench_{name}")(), repeat)
+        results[name] = r
+        print(f"[bench] {name:<10} {r['throughput']:>12,.1f} {r['unit']:<8} {r['seconds']:>8.3f}s  peak {r['peak_mb']:>8.1f} MB")
+
+    report = {"size": args.size, "seed": args.seed, "format": args.format, "workload": WORKLOAD, "params": SIZES[args.size], "python": platform.python_version(),
+              "machine": platform.machine(), "created": time.strftime("%Y-%m-%dT%H:%M:%S"), "results": results}
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as fh:
+            json.dump(report, fh, indent=2)
+
+    status = 0
+    if args.save_baseline:
+        if os.path.dirname(args.baseline):
+            os.makedirs(os.path.dirname(args.baseline), exist_ok=True)
+        with open(args.baseline, "w", encoding="utf-8") as fh:
+            json.dump(report, fh, indent=2)
+        print(f"[bench] baseline saved to {args.baseline}")
+    elif os.path.exists(args.baseline):
+        with open(args.baseline, encoding="utf-8") as fh:
+            baseline = json.load(fh)
+        if (baseline.get("size"), baseline.get("seed"), baseline.get("format", "plain"), baseline.get("workload", 1)) != \
+                (args.size, args.seed, args.format, WORKLOAD):
+            print(f"[bench] baseline is for size={baseline.get('size')} seed={baseline.get('seed')} "
+                  f"format={baseline.get('format', 'plain')} workload={baseline.get('workload', 1)}; not compared "
+                  f"(run with --save-baseline to record a new one)")
+        else:
+            flagged = compare(results, baseline, args.tolerance)
+            for f in flagged:
+                print(f"[bench] REGRESSION {f}")
+            if not flagged:
+                print(f"[bench] no regressions against {args.baseline} (tolerance {args.tolerance:.0%})")
+            status = 1 if flagged else 0
+    else:
+        print(f"[bench] no baseline at {args.baseline}; run with --save-baseline to record one")
+    return status
+
+if __name__ == "__main__":
+    sys.exit(main())
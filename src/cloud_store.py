@@ -1,42 +1,121 @@
 import os
-from typing import Optional, List, Dict, Any
-from supabase import create_client, Client
+import gzip
+import json
+import base64
+import hashlib
+import threading
+from datetime import datetime, timezone
+from typing import Optional, List, Dict, Any, Tuple, Union
+from .stores import get_store
+from .telemetry import span, count, traced
+from .prefilter import mine_candidates, try_iso_date_from_text, PREFILTER_VERSION
 
-SUPABASE_URL = os.getenv("SUPABASE_URL")
-SUPABASE_KEY = os.getenv("SUPABASE_ANON_KEY")
-BUCKET = os.getenv("SUPABASE_BUCKET", "earnings")
-
-sb: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
+# Row and PDF storage. The backend (Supabase, local SQLite, or Supabase behind a local mirror) is
+# chosen by STORE_BACKEND; see src/stores.py.
 
 def path_for(ticker: str, year: int, quarter: str, file_type: str) -> str:
     return f"pdfs/{ticker.upper()}/{year}-{quarter}/{file_type}.pdf"
 
+@traced("store.file_exists")
 def file_exists(storage_path: str) -> bool:
     if not storage_path:
         return False
-    parent, name = storage_path.rsplit("/", 1)
-    try:
-        entries = sb.storage.from_(BUCKET).list(path=parent)
-        return any(e.get("name") == name for e in entries)
-    except Exception:
-        return False
+    return get_store().exists(storage_path)
+
+@traced("store.list_files")
+def list_files(prefix: str, page_size: int = 1000) -> List[Dict[str, Any]]:
+    return get_store().list_files(prefix, page_size)
 
 def upload_pdf(ticker: str, year: int, quarter: str, file_type: str, pdf_bytes: bytes) -> str:
     key = path_for(ticker, year, quarter, file_type)
-    sb.storage.from_(BUCKET).upload(key, pdf_bytes, {"content-type": "application/pdf", "upsert": True})
+    with span("store.upload_pdf"):
+        get_store().upload(key, pdf_bytes)
+    count("store.bytes_uploaded", len(pdf_bytes))
     return key
 
 def download_pdf(storage_path: str) -> Optional[bytes]:
+    with span("store.download_pdf"):
+        data = get_store().download(storage_path)
+    count("store.bytes_downloaded", len(data or b""))
+    return data
+
+def content_hash(text: Optional[str]) -> Optional[str]:
+    if text is None:
+        return None
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+# Storage format of earnings_files bodies (STORE_FORMAT):
+#   plain    text and guidance JSON as strings in text_content (default)
+#   compact  text compressed into text_zip (zstd when the zstandard package is installed, else gzip),
+#            its mined candidates and filing date in candidates (JSON), guidance items as JSON in items;
+#            text_content stays empty. Needs the columns from SETUP_INSTRUCTIONS.txt.
+# In compact mode readers handle rows in either format, so existing rows can be migrated gradually
+# (python -m src.migrate_storage).
+STORE_FORMAT = os.getenv("STORE_FORMAT", "plain")
+STORE_TEXT_CODEC = os.getenv("STORE_TEXT_CODEC", "")  # zstd | gzip; default zstd if available
+BODY_COLUMNS = "text_zip,items"
+
+def _zstd():
     try:
-        return sb.storage.from_(BUCKET).download(storage_path)
-    except Exception:
+        import zstandard
+        return zstandard
+    except ImportError:
         return None
 
-def upsert_row(ticker: str, year: int, quarter: str,
-               file_type: str, file_format: str,
-               storage_path: Optional[str], source_url: Optional[str],
-               text_content: Optional[str]) -> None:
-    sb.table("earnings_files").upsert({
+def compress_text(text: str) -> str:
+    # Base64 with a codec prefix, so the column stays text and each value says how to read it.
+    raw = text.encode("utf-8")
+    codec = STORE_TEXT_CODEC or ("zstd" if _zstd() else "gzip")
+    if codec == "zstd":
+        return "zs:" + base64.b64encode(_zstd().ZstdCompressor(level=10).compress(raw)).decode("ascii")
+    return "gz:" + base64.b64encode(gzip.compress(raw, 6)).decode("ascii")
+
+def decompress_text(blob: str) -> str:
+    codec, data = blob[:3], base64.b64decode(blob[3:])
+    if codec == "zs:":
+        zstd = _zstd()
+        if zstd is None:
+            raise RuntimeError("zstd-compressed text rows need the zstandard package")
+        return zstd.ZstdDecompressor().decompress(data).decode("utf-8")
+    return gzip.decompress(data).decode("utf-8")
+
+def mined_document(text: str, candidates: Optional[List[Dict[str, Any]]] = None) -> Dict[str, Any]:
+    return {"version": PREFILTER_VERSION, "blank": not text.strip(), "filing_date": try_iso_date_from_text(text[:2000]),
+            "candidates": mine_candidates(text) if candidates is None else candidates}
+
+def compact_body(file_format: str, text_content: Optional[str], candidates=None) -> Dict[str, Any]:
+    # Compact-format columns for a row body; text_content is cleared.
+    if text_content is None:
+        return {}
+    if file_format == "json":
+        return {"text_content": None, "items": json.loads(text_content)}
+    if file_format == "text":
+        return {"text_content": None, "text_zip": compress_text(text_content),
+                "candidates": mined_document(text_content, candidates)}
+    return {}
+
+def plain_body(row: Dict[str, Any]) -> Dict[str, Any]:
+    # Plain-format columns for a row read in either format.
+    if row.get("text_zip"):
+        return {"text_content": decompress_text(row["text_zip"]), "text_zip": None, "candidates": None}
+    if row.get("items") is not None:
+        return {"text_content": json.dumps(row["items"], ensure_ascii=False), "items": None}
+    return {}
+
+FILES_CONFLICT = "ticker,year,quarter,file_type,file_format"
+RESOLVED_CONFLICT = "ticker,year,quarter,metric_key"
+UPSERT_BATCH = int(os.getenv("SUPABASE_UPSERT_BATCH", "500"))
+
+def now_iso() -> str:
+    # Upserts only get the column default on insert; rows carry updated_at so updates bump it too.
+    return datetime.now(timezone.utc).isoformat()
+
+def file_row(ticker: str, year: int, quarter: str,
+             file_type: str, file_format: str,
+             storage_path: Optional[str], source_url: Optional[str],
+             text_content: Optional[str], fingerprint: Optional[str] = None, candidates=None) -> Dict[str, Any]:
+    # `candidates` may pass already mined candidates of a text body (compact format only).
+    row = {
         "ticker": ticker.upper(),
         "year": year,
         "quarter": quarter,
@@ -44,17 +123,95 @@ def upsert_row(ticker: str, year: int, quarter: str,
         "file_format": file_format,
         "storage_path": storage_path,
         "source_url": source_url,
-        "text_content": text_content
-    }, on_conflict="ticker,year,quarter,file_type,file_format").execute()
-
-def fetch_rows(ticker: str, file_type: Optional[str] = None, file_format: Optional[str] = None) -> List[Dict[str, Any]]:
-    q = sb.table("earnings_files").select("*").eq("ticker", ticker.upper())
-    if file_type:
-        q = q.eq("file_type", file_type)
-    if file_format:
-        q = q.eq("file_format", file_format)
-    q = q.order("year", desc=True).order("quarter", desc=True)
-    return q.execute().data
+        "text_content": text_content,
+        "content_hash": content_hash(text_content),
+        "updated_at": now_iso(),
+    }
+    if fingerprint is not None:
+        row["fingerprint"] = fingerprint
+    if STORE_FORMAT == "compact":
+        row.update(compact_body(file_format, text_content, candidates))
+    return row
+
+def upsert_row(ticker: str, year: int, quarter: str,
+               file_type: str, file_format: str,
+               storage_path: Optional[str], source_url: Optional[str],
+               text_content: Optional[str], fingerprint: Optional[str] = None) -> None:
+    upsert_rows([file_row(ticker, year, quarter, file_type, file_format, storage_path, source_url, text_content, fingerprint)])
+
+def _bulk_upsert(table: str, rows: List[Dict[str, Any]], on_conflict: str):
+    # Postgres rejects a statement that touches the same conflict key twice, so the last write per
+    # key wins. PostgREST also needs identical keys across a payload, so rows are grouped by shape.
+    cols = on_conflict.split(",")
+    latest: Dict[Tuple, Dict[str, Any]] = {}
+    for r in rows:
+        latest[tuple(r.get(c) for c in cols)] = r
+    shapes: Dict[Tuple, List[Dict[str, Any]]] = {}
+    for r in latest.values():
+        shapes.setdefault(tuple(sorted(r)), []).append(r)
+    for group in shapes.values():
+        for i in range(0, len(group), UPSERT_BATCH):
+            with span("store.upsert", table=table):
+                get_store().upsert(table, group[i:i + UPSERT_BATCH], on_conflict)
+    count("store.rows_written", len(latest))
+
+def upsert_rows(rows: List[Dict[str, Any]]) -> None:
+    if rows:
+        _bulk_upsert("earnings_files", rows, FILES_CONFLICT)
+
+QMAP = {'Q1':1,'Q2':2,'Q3':3,'Q4':4}
+PAGE_SIZE = int(os.getenv("SUPABASE_PAGE_SIZE", "500"))
+META_COLUMNS = "id,ticker,year,quarter,file_type,file_format,storage_path,source_url,content_hash,updated_at"
+
+def in_window(year: Optional[int], quarter: Optional[str], start_year: int, end_year: int, start_q: str = 'Q1', end_q: str = 'Q4') -> bool:
+    if year is None or not quarter:
+        return False
+    # Same range as the store's window filter: (start_year, start_q) <= (year, quarter) <= (end_year, end_q).
+    qn = QMAP.get(str(quarter).upper())
+    return qn is not None and (start_year, QMAP[start_q]) <= (year, qn) <= (end_year, QMAP[end_q])
+
+def _tickers(ticker: Union[str, List[str]]) -> List[str]:
+    return [ticker.upper()] if isinstance(ticker, str) else sorted({t.upper() for t in ticker})
+
+def _window(start_year: Optional[int], end_year: Optional[int], start_q: str, end_q: str):
+    return (start_year, end_year, start_q, end_q) if start_year is not None and end_year is not None else None
+
+@traced("store.latest_update")
+def latest_update(ticker: Union[str, List[str]], file_type: Optional[str] = None, file_format: Optional[str] = None,
+                  start_year: Optional[int] = None, end_year: Optional[int] = None, start_q: str = 'Q1', end_q: str = 'Q4') -> str:
+    # Change stamp of the matching rows ("<count>:<newest updated_at>") from one single-row query;
+    # used to key caches of data derived from those rows.
+    tickers = _tickers(ticker)
+    if not tickers:
+        return "0:"
+    return get_store().latest_update(tickers, file_type, file_format, _window(start_year, end_year, start_q, end_q))
+
+def fetch_rows(ticker: Union[str, List[str]], file_type: Optional[str] = None, file_format: Optional[str] = None,
+               columns: str = "*", start_year: Optional[int] = None, end_year: Optional[int] = None,
+               start_q: str = 'Q1', end_q: str = 'Q4', periods: Optional[List[Tuple[int, str]]] = None,
+               page_size: int = PAGE_SIZE) -> List[Dict[str, Any]]:
+    # The year/quarter window (or an explicit list of (year, quarter) periods) and the column list are
+    # applied by the backend; results are paged so large tickers stay under the response-size limit.
+    # `ticker` may be a list: its rows come back from one paged query, ordered by ticker first.
+    if periods is not None and not periods:
+        return []
+    tickers = _tickers(ticker)
+    if not tickers:
+        return []
+    compact = STORE_FORMAT == "compact" and "text_content" in columns.split(",")
+    if compact:
+        columns += "," + BODY_COLUMNS
+    with span("store.fetch_rows", file_type=file_type):
+        rows = get_store().select_files(tickers, file_type, file_format, columns,
+                                        _window(start_year, end_year, start_q, end_q), periods, page_size)
+    count("store.rows_read", len(rows))
+    if compact:
+        # Text bodies come back as text_content; guidance items stay parsed in "items" (see merge.row_items).
+        for r in rows:
+            blob = r.pop("text_zip", None)
+            if blob:
+                r["text_content"] = decompress_text(blob)
+    return rows
 
 # Conflict resolution persistence
 def make_metric_key(metric: str, period_type: str, fy: Optional[str], q: Optional[str]) -> str:
@@ -62,19 +219,98 @@ def make_metric_key(metric: str, period_type: str, fy: Optional[str], q: Optiona
     pt = (period_type or "").strip().lower()
     return f"{m}|{pt}|{fy or ''}|{q or ''}"
 
-def save_resolution(ticker: str, year: int, quarter: str, metric_key: str, chosen_json_text: str):
-    sb.table("guidance_resolved").upsert({
+def resolution_row(ticker: str, year: int, quarter: str, metric_key: str, chosen_json_text: str) -> Dict[str, Any]:
+    return {
         "ticker": ticker.upper(),
         "year": year,
         "quarter": quarter,
         "metric_key": metric_key,
-        "chosen_json": chosen_json_text
-    }, on_conflict="ticker,year,quarter,metric_key").execute()
+        "chosen_json": chosen_json_text,
+        "updated_at": now_iso(),
+    }
+
+def save_resolution(ticker: str, year: int, quarter: str, metric_key: str, chosen_json_text: str):
+    save_resolutions([resolution_row(ticker, year, quarter, metric_key, chosen_json_text)])
+
+def save_resolutions(rows: List[Dict[str, Any]]) -> None:
+    if rows:
+        _bulk_upsert("guidance_resolved", rows, RESOLVED_CONFLICT)
 
+@traced("store.fetch_resolutions")
 def fetch_resolutions(ticker: str, year: Optional[int] = None, quarter: Optional[str] = None):
-    q = sb.table("guidance_resolved").select("*").eq("ticker", ticker.upper())
-    if year is not None:
-        q = q.eq("year", year)
-    if quarter is not None:
-        q = q.eq("quarter", quarter)
-    return q.execute().data
+    return get_store().select_resolutions(ticker.upper(), year, quarter)
+
+# Write-behind queue: rows are coalesced by conflict key and flushed in bulk by a background
+# thread once `flush_size` rows are pending or `flush_interval` seconds have passed.
+class WriteBehindQueue:
+    TABLES = {"earnings_files": FILES_CONFLICT, "guidance_resolved": RESOLVED_CONFLICT}
+
+    def __init__(self, flush_size: int = 200, flush_interval: float = 2.0):
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.pending: Dict[str, Dict[Tuple, Dict[str, Any]]] = {t: {} for t in self.TABLES}
+        self.errors: List[Exception] = []
+        self.cond = threading.Condition()
+        self.closed = False
+        self.thread = threading.Thread(target=self._run, name="write-behind", daemon=True)
+        self.thread.start()
+
+    def _put(self, table: str, row: Dict[str, Any]):
+        key = tuple(row.get(c) for c in self.TABLES[table].split(","))
+        with self.cond:
+            if self.closed:
+                raise RuntimeError("write-behind queue is closed")
+            self.pending[table][key] = row
+            if self.size() >= self.flush_size:
+                self.cond.notify()
+
+    def put_row(self, row: Dict[str, Any]):
+        self._put("earnings_files", row)
+
+    def put_resolution(self, row: Dict[str, Any]):
+        self._put("guidance_resolved", row)
+
+    def size(self) -> int:
+        return sum(len(p) for p in self.pending.values())
+
+    def flush(self):
+        with self.cond:
+            batches = {t: list(p.values()) for t, p in self.pending.items() if p}
+            self.pending = {t: {} for t in self.TABLES}
+        for table, rows in batches.items():
+            try:
+                _bulk_upsert(table, rows, self.TABLES[table])
+            except Exception as e:
+                print(f"[write-behind] {table}: {len(rows)} row(s) failed: {e}")
+                self.errors.append(e)
+
+    def _run(self):
+        while True:
+            with self.cond:
+                if not self.closed and self.size() < self.flush_size:
+                    self.cond.wait(self.flush_interval)
+                closed = self.closed
+            self.flush()
+            if closed:
+                return
+
+    def close(self) -> List[Exception]:
+        # Flushes what is pending and returns the errors of failed flushes without raising them, so a
+        # caller closing the queue in `finally` does not replace the exception already propagating.
+        with self.cond:
+            self.closed = True
+            self.cond.notify()
+        self.thread.join()
+        return self.errors
+
+    def check(self):
+        if self.errors:
+            raise RuntimeError(f"{len(self.errors)} write-behind flush(es) failed; first: {self.errors[0]}")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc):
+        self.close()
+        if exc_type is None:
+            self.check()
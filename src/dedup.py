@@ -0,0 +1,96 @@
+import os
+import re
+import hashlib
+import unicodedata
+from typing import Dict, Any, List, Optional, Tuple
+
+# Candidate deduplication for request planning. Press releases, presentations and transcripts of one
+# quarter often repeat a guidance paragraph verbatim, and boilerplate carries over between quarters.
+# Exact mode keys candidates on their normalized text; minhash mode additionally merges candidates whose
+# context is a near-duplicate (one-permutation MinHash over word shingles, banded LSH) as long as the
+# value, period and metric the model would validate are identical.
+
+EXTRACT_DEDUP = os.getenv("EXTRACT_DEDUP", "exact")  # exact | minhash | off
+DEDUP_THRESHOLD = float(os.getenv("DEDUP_THRESHOLD", "0.9"))
+SHINGLE = 5
+BINS = 64
+BAND = 4
+
+_PUNCT = str.maketrans({"‘": "'", "’": "'", "“": '"', "”": '"', "–": "-", "—": "-", " ": " "})
+_WORD = re.compile(r"\w+")
+
+def normalize_text(s: Optional[str]) -> str:
+    if not s:
+        return ""
+    return " ".join(unicodedata.normalize("NFKC", s).translate(_PUNCT).casefold().split())
+
+def _digest(*parts: str) -> str:
+    return hashlib.blake2b("\x00".join(parts).encode("utf-8"), digest_size=16).hexdigest()
+
+def value_key(c: Dict[str, Any]) -> str:
+    # What the model validates; near-duplicates must agree on all of it.
+    return _digest(normalize_text(c.get("metric")), normalize_text(c.get("guidance_value_text")), normalize_text(c.get("period")))
+
+def candidate_key(c: Dict[str, Any]) -> str:
+    return _digest(value_key(c), normalize_text(c.get("context")))
+
+def minhash(text: str) -> Tuple[Optional[int], ...]:
+    # One hash per shingle; the hash's low bits pick one of BINS bins and each bin keeps its minimum.
+    words = _WORD.findall(normalize_text(text))
+    shingles = {" ".join(words[i:i + SHINGLE]) for i in range(max(1, len(words) - SHINGLE + 1))}
+    sig: List[Optional[int]] = [None] * BINS
+    for sh in shingles:
+        h = int.from_bytes(hashlib.blake2b(sh.encode("utf-8"), digest_size=8).digest(), "little")
+        b, v = h % BINS, h // BINS
+        if sig[b] is None or v < sig[b]:
+            sig[b] = v
+    return tuple(sig)
+
+def similarity(a: Tuple[Optional[int], ...], b: Tuple[Optional[int], ...]) -> float:
+    both = [(x, y) for x, y in zip(a, b) if x is not None or y is not None]
+    if not both:
+        return 1.0
+    return sum(1 for x, y in both if x == y) / len(both)
+
+class CandidateIndex:
+    # Maps candidates to the first equivalent one added; `ref` is whatever the caller needs to find it again.
+    def __init__(self, mode: Optional[str] = None, threshold: Optional[float] = None):
+        self.mode = mode or EXTRACT_DEDUP
+        self.threshold = DEDUP_THRESHOLD if threshold is None else threshold
+        self.exact: Dict[str, Any] = {}
+        self.bands: Dict[Tuple, List[Tuple[Tuple, Any]]] = {}
+        self.hits = 0
+
+    def find(self, c: Dict[str, Any]):
+        if self.mode == "off":
+            return None
+        ref = self.exact.get(candidate_key(c))
+        if ref is None and self.mode == "minhash":
+            ref = self._near(c)
+        if ref is not None:
+            self.hits += 1
+        return ref
+
+    def _band_keys(self, c: Dict[str, Any], sig: Tuple[Optional[int], ...]):
+        vk = value_key(c)
+        return [(vk, i, sig[i:i + BAND]) for i in range(0, BINS, BAND)]
+
+    def _near(self, c: Dict[str, Any]):
+        sig = minhash(c.get("context") or "")
+        seen = set()
+        for key in self._band_keys(c, sig):
+            for other, ref in self.bands.get(key, ()):
+                if id(other) not in seen:
+                    seen.add(id(other))
+                    if similarity(sig, other) >= self.threshold:
+                        return ref
+        return None
+
+    def add(self, c: Dict[str, Any], ref: Any):
+        if self.mode == "off":
+            return
+        self.exact.setdefault(candidate_key(c), ref)
+        if self.mode == "minhash":
+            sig = minhash(c.get("context") or "")
+            for key in self._band_keys(c, sig):
+                self.bands.setdefault(key, []).append((sig, ref))
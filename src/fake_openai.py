@@ -0,0 +1,260 @@
+# Local stand-in for the parts of the OpenAI API this repo uses: chat completions, file upload and
+# download, and the Batch API. Extraction answers are derived from the candidates themselves, so runs
+# are deterministic and free. Point the SDK at it with OPENAI_BASE_URL, e.g.
+#   python -m src.fake_openai --port 8765
+#   OPENAI_BASE_URL=http://127.0.0.1:8765/v1 OPENAI_API_KEY=test python -m src.batch_extract run --tickers AAPL ...
+import re
+import sys
+import json
+import time
+import uuid
+import argparse
+import threading
+from email.parser import BytesParser
+from email.policy import HTTP
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import parse_qs, urlsplit
+from typing import List, Dict, Any, Optional, Tuple
+
+FULL_YEAR_RGX = re.compile(r"\b(fy|full[- ]year|fiscal|year|annual)\b", re.I)
+
+def fake_items(messages: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    # Echoes every candidate that carries a value as a guidance object, the way the real model answers SYSTEM.
+    try:
+        payload = json.loads(messages[-1]["content"])
+    except Exception:
+        return []
+    items = []
+    for c in payload.get("candidates") or []:
+        if not c.get("guidance_value_text"):
+            continue
+        it = {
+            "metric": c.get("metric") or "Unknown",
+            "guidance_value_text": c["guidance_value_text"],
+            "period": c.get("period") or "",
+            "period_type": "full year" if FULL_YEAR_RGX.search(c.get("period") or "") else "quarter",
+            "low_end": c.get("low_end"),
+            "high_end": c.get("high_end"),
+            "units": c.get("units"),
+            "filing_date": None,
+        }
+        if "id" in c:
+            it["id"] = c["id"]
+        items.append(it)
+    return items
+
+def completion(body: Dict[str, Any]) -> Dict[str, Any]:
+    messages = body.get("messages") or []
+    content = json.dumps({"items": fake_items(messages)})
+    prompt = sum(len(m.get("content") or "") for m in messages) // 4 + 1
+    return {
+        "id": f"chatcmpl-{uuid.uuid4().hex[:24]}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": body.get("model") or "fake",
+        "choices": [{"index": 0, "finish_reason": "stop", "logprobs": None,
+                     "message": {"role": "assistant", "content": content}}],
+        "usage": {"prompt_tokens": prompt, "completion_tokens": len(content) // 4 + 1,
+                  "total_tokens": prompt + len(content) // 4 + 1},
+    }
+
+class FakeOpenAI:
+    # In-memory state shared by all handler threads.
+    #   latency    seconds slept per chat completion (simulates the network + model)
+    #   fail_every every n-th chat completion / batch line fails with a 500 (0 = never)
+    #   batch_polls retrieves a batch needs before it completes (simulates a long-running batch)
+    def __init__(self, latency: float = 0.0, fail_every: int = 0, batch_polls: int = 1):
+        self.latency = latency
+        self.fail_every = fail_every
+        self.batch_polls = batch_polls
+        self.files: Dict[str, Dict[str, Any]] = {}
+        self.contents: Dict[str, bytes] = {}
+        self.batches: Dict[str, Dict[str, Any]] = {}
+        self.polls: Dict[str, int] = {}
+        self.calls = 0
+        self.lock = threading.Lock()
+
+    def _fails(self) -> bool:
+        with self.lock:
+            self.calls += 1
+            return bool(self.fail_every) and self.calls % self.fail_every == 0
+
+    def chat(self, body: Dict[str, Any]) -> Tuple[int, Dict[str, Any]]:
+        if self.latency:
+            time.sleep(self.latency)
+        if self._fails():
+            return 500, {"error": {"message": "injected failure", "type": "server_error"}}
+        return 200, completion(body)
+
+    def add_file(self, filename: str, purpose: str, data: bytes) -> Dict[str, Any]:
+        fid = f"file-{uuid.uuid4().hex[:24]}"
+        obj = {"id": fid, "object": "file", "bytes": len(data), "created_at": int(time.time()),
+               "filename": filename, "purpose": purpose, "status": "processed"}
+        with self.lock:
+            self.files[fid] = obj
+            self.contents[fid] = data
+        return obj
+
+    def create_batch(self, body: Dict[str, Any]) -> Tuple[int, Dict[str, Any]]:
+        if body.get("input_file_id") not in self.files:
+            return 404, {"error": {"message": "input file not found", "type": "invalid_request_error"}}
+        bid = f"batch_{uuid.uuid4().hex[:24]}"
+        batch = {
+            "id": bid, "object": "batch", "endpoint": body.get("endpoint"), "errors": None,
+            "input_file_id": body["input_file_id"], "completion_window": body.get("completion_window", "24h"),
+            "status": "validating", "output_file_id": None, "error_file_id": None,
+            "created_at": int(time.time()), "completed_at": None,
+            "request_counts": {"total": 0, "completed": 0, "failed": 0},
+            "metadata": body.get("metadata"),
+        }
+        with self.lock:
+            self.batches[bid] = batch
+            self.polls[bid] = 0
+        return 200, batch
+
+    def retrieve_batch(self, bid: str) -> Optional[Dict[str, Any]]:
+        with self.lock:
+            batch = self.batches.get(bid)
+            if batch is None:
+                return None
+            self.polls[bid] += 1
+            ready = batch["status"] in ("validating", "in_progress") and self.polls[bid] >= self.batch_polls
+            if batch["status"] == "validating":
+                batch["status"] = "in_progress"
+        if ready:
+            self._run_batch(batch)
+        return batch
+
+    def _run_batch(self, batch: Dict[str, Any]):
+        out, err = [], []
+        for line in self.contents[batch["input_file_id"]].decode("utf-8").splitlines():
+            if not line.strip():
+                continue
+            req = json.loads(line)
+            rid = f"batch_req_{uuid.uuid4().hex[:24]}"
+            if self._fails():
+                err.append({"id": rid, "custom_id": req["custom_id"], "response": None,
+                            "error": {"code": "server_error", "message": "injected failure"}})
+                continue
+            out.append({"id": rid, "custom_id": req["custom_id"], "error": None,
+                        "response": {"status_code": 200, "request_id": rid, "body": completion(req["body"])}})
+        dump = lambda rows: "".join(json.dumps(r) + "\n" for r in rows).encode("utf-8")
+        output = self.add_file("batch_output.jsonl", "batch_output", dump(out))
+        error = self.add_file("batch_errors.jsonl", "batch_output", dump(err)) if err else None
+        with self.lock:
+            batch.update(status="completed", completed_at=int(time.time()), output_file_id=output["id"],
+                         error_file_id=error["id"] if error else None,
+                         request_counts={"total": len(out) + len(err), "completed": len(out), "failed": len(err)})
+
+    def list_batches(self, query: Dict[str, List[str]]) -> Dict[str, Any]:
+        # Newest first, paginated with the same `after` cursor as the real endpoint.
+        with self.lock:
+            data = list(reversed(self.batches.values()))
+        after = (query.get("after") or [None])[0]
+        if after:
+            ids = [b["id"] for b in data]
+            data = data[ids.index(after) + 1:] if after in ids else []
+        limit = int((query.get("limit") or ["20"])[0])
+        return {"object": "list", "data": data[:limit], "has_more": len(data) > limit,
+                "first_id": data[0]["id"] if data else None, "last_id": data[:limit][-1]["id"] if data else None}
+
+    def cancel_batch(self, bid: str) -> Optional[Dict[str, Any]]:
+        with self.lock:
+            batch = self.batches.get(bid)
+            if batch and batch["status"] in ("validating", "in_progress"):
+                batch["status"] = "cancelled"
+            return batch
+
+def _multipart(content_type: str, body: bytes) -> Dict[str, Tuple[Optional[str], bytes]]:
+    msg = BytesParser(policy=HTTP).parsebytes(f"Content-Type: {content_type}\r\n\r\n".encode("latin-1") + body)
+    fields = {}
+    for part in msg.iter_parts():
+        name = part.get_param("name", header="content-disposition")
+        fields[name] = (part.get_filename(), part.get_payload(decode=True) or b"")
+    return fields
+
+def make_handler(api: FakeOpenAI):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):
+            pass
+
+        def _send(self, status: int, obj=None, raw: Optional[bytes] = None):
+            data = raw if raw is not None else json.dumps(obj).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/octet-stream" if raw is not None else "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def _not_found(self):
+            self._send(404, {"error": {"message": f"unknown route {self.path}", "type": "invalid_request_error"}})
+
+        def _body(self) -> bytes:
+            return self.rfile.read(int(self.headers.get("Content-Length") or 0))
+
+        def do_POST(self):
+            path = self.path.split("?")[0].rstrip("/")
+            body = self._body()
+            if path.endswith("/chat/completions"):
+                self._send(*api.chat(json.loads(body)))
+            elif path.endswith("/files"):
+                fields = _multipart(self.headers.get("Content-Type", ""), body)
+                filename, data = fields.get("file", (None, b""))
+                purpose = (fields.get("purpose") or (None, b""))[1].decode("utf-8")
+                self._send(200, api.add_file(filename or "upload.jsonl", purpose, data))
+            elif path.endswith("/batches"):
+                self._send(*api.create_batch(json.loads(body)))
+            elif path.endswith("/cancel") and "/batches/" in path:
+                batch = api.cancel_batch(path.split("/")[-2])
+                self._send(200, batch) if batch else self._not_found()
+            else:
+                self._not_found()
+
+        def do_GET(self):
+            path = self.path.split("?")[0].rstrip("/")
+            parts = path.split("/")
+            if path.endswith("/content") and "/files/" in path:
+                fid = parts[-2]
+                self._send(200, raw=api.contents[fid]) if fid in api.contents else self._not_found()
+            elif "/files/" in path:
+                obj = api.files.get(parts[-1])
+                self._send(200, obj) if obj else self._not_found()
+            elif path.endswith("/batches"):
+                self._send(200, api.list_batches(parse_qs(urlsplit(self.path).query)))
+            elif "/batches/" in path:
+                batch = api.retrieve_batch(parts[-1])
+                self._send(200, batch) if batch else self._not_found()
+            else:
+                self._not_found()
+
+    return Handler
+
+def serve(port: int = 0, host: str = "127.0.0.1", **options) -> Tuple[ThreadingHTTPServer, str]:
+    # Starts the server on a daemon thread; returns it with the base URL to use as OPENAI_BASE_URL.
+    server = ThreadingHTTPServer((host, port), make_handler(FakeOpenAI(**options)))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}/v1"
+
+def main(argv: Optional[List[str]] = None):
+    ap = argparse.ArgumentParser(prog="python -m src.fake_openai", description="Local stand-in OpenAI server for offline runs.")
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=8765)
+    ap.add_argument("--latency", type=float, default=0.0, help="Seconds per chat completion")
+    ap.add_argument("--fail-every", type=int, default=0, help="Fail every n-th request (0 = never)")
+    ap.add_argument("--batch-polls", type=int, default=1, help="Retrieves before a batch completes")
+    args = ap.parse_args(argv)
+    server, url = serve(args.port, args.host, latency=args.latency, fail_every=args.fail_every, batch_polls=args.batch_polls)
+    print(f"[fake_openai] OPENAI_BASE_URL={url}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.shutdown()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
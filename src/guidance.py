@@ -1,10 +1,14 @@
-import os, json, re
-from typing import Optional
+import os, json, time, asyncio, hashlib
+from typing import Optional, Dict, Any
 from dotenv import load_dotenv
-from openai import OpenAI
 from tenacity import retry, wait_exponential, stop_after_attempt
-from .cloud_store import fetch_rows, upsert_row
-from .prefilter import mine_candidates
+from .cloud_store import fetch_rows, upsert_row, content_hash, STORE_FORMAT
+from .prefilter import mine_candidates, try_iso_date_from_text, PREFILTER_VERSION
+from .merge import row_items
+from .llm_cache import get_cache, cache_key, CacheStats
+from .batching import plan_requests, plan_stats, candidate_tokens, DocCollector
+from .http_pool import http_client, async_http_client
+from .telemetry import span, count
 
 load_dotenv()
 
@@ -22,79 +26,415 @@ emit a validated guidance object with keys:
 - units (string or null: 'USD' | 'percent' | 'EPS' | etc.)
 - filing_date (YYYY-MM-DD or null)
 Discard any candidate that is not forward-looking guidance. Use the short 'context' string if needed to confirm.
+Each candidate has an 'id'; copy it unchanged into the 'id' key of every object you emit for that candidate.
 """
 
-def try_iso_date_from_text(text: str) -> Optional[str]:
-    m = re.search(r'(January|February|March|April|May|June|July|August|September|October|November|December)\s+([12]?\d|3[01]),\s+(20\d{2})', text)
-    if not m:
-        return None
-    month_map = {m: i for i, m in enumerate([
-        "January","February","March","April","May","June",
-        "July","August","September","October","November","December"
-    ], start=1)}
-    month = month_map[m.group(1)]
-    day = int(m.group(2))
-    year = int(m.group(3))
-    return f"{year:04d}-{month:02d}-{day:02d}"
-
-@retry(wait=wait_exponential(multiplier=1, min=2, max=30), stop=stop_after_attempt(5))
+_client = None
+
+def openai_client():
+    # The SDK is imported and the client built on first use (after Streamlit secrets reach the
+    # environment), then reused; its requests go through the shared pool of src/http_pool.py.
+    global _client
+    if _client is None:
+        from openai import OpenAI
+        kwargs = {"api_key": OPENAI_API_KEY} if OPENAI_API_KEY else {}
+        _client = OpenAI(http_client=http_client(), **kwargs)
+    return _client
+
+def _count_retry(retry_state):
+    count("openai.retries")
+
+def _count_usage(resp):
+    count("openai.requests")
+    if getattr(resp, "usage", None):
+        count("openai.tokens_in", resp.usage.prompt_tokens or 0)
+        count("openai.tokens_out", resp.usage.completion_tokens or 0)
+
+@retry(wait=wait_exponential(multiplier=1, min=2, max=30), stop=stop_after_attempt(5), before_sleep=_count_retry)
 def call_openai(messages, model: str):
-    client = OpenAI(api_key=OPENAI_API_KEY) if OPENAI_API_KEY else OpenAI()
-    resp = client.chat.completions.create(
-        model=model,
-        temperature=0,
-        messages=messages,
-        response_format={"type": "json_object"},
-    )
-    txt = resp.choices[0].message.content.strip()
-    data = json.loads(txt)
+    with span("openai.call", model=model):
+        resp = openai_client().chat.completions.create(
+            model=model,
+            temperature=0,
+            messages=messages,
+            response_format={"type": "json_object"},
+        )
+    _count_usage(resp)
+    return parse_items(resp.choices[0].message.content)
+
+QMAP = {'Q1':1,'Q2':2,'Q3':3,'Q4':4}
+SOURCES = ["press_release", "presentation", "transcript"]
+DOC_COLUMNS = "year,quarter,source_url,content_hash,text_content"
+# Compact storage format: candidates mined when the text was stored, instead of the text itself.
+MINED_COLUMNS = "year,quarter,source_url,content_hash,candidates"
+EXTRACT_CONCURRENCY = int(os.getenv("EXTRACT_CONCURRENCY", "8"))
+OPENAI_TPM = int(os.getenv("OPENAI_TPM", "0"))
+
+def build_messages(candidates):
+    return [
+        {"role": "system", "content": SYSTEM},
+        {"role": "user", "content": json.dumps({"candidates": candidates})},
+    ]
+
+def estimate_tokens(messages) -> int:
+    return sum(len(m.get("content") or "") for m in messages) // 4 + 1
+
+def candidate_keys(model: str, candidates) -> Dict[str, str]:
+    # Cache key per candidate id of one request.
+    return {c["id"]: cache_key(model, SYSTEM, c) for c in candidates}
+
+def _cache_lookup(cache, keys: Dict[str, str], stats) -> Dict[str, list]:
+    # Cached items per candidate id, tagged with that id so they are routed like the model's own.
+    try:
+        hits = cache.get_many(sorted(set(keys.values())))
+    except Exception:
+        hits = {}
+    found = {cid: [dict(it, id=cid) for it in hits[key]["items"]] for cid, key in keys.items() if key in hits}
+    stats.hit(sum(hits[key]["tokens"] for cid, key in keys.items() if cid in found), len(found))
+    stats.miss(len(keys) - len(found))
+    count("llm_cache.hits", len(found))
+    count("llm_cache.misses", len(keys) - len(found))
+    return found
+
+def _cache_store(cache, model: str, keys: Dict[str, str], candidates, items):
+    # Files the model's items under the candidate they name. An item without a known id cannot be
+    # attributed to one candidate, so a response holding any is not cached.
+    by_id = {c["id"]: [] for c in candidates}
+    for it in items:
+        cid = str(it.get("id", "")) if isinstance(it, dict) else ""
+        if cid not in by_id:
+            return
+        by_id[cid].append({k: v for k, v in it.items() if k != "id"})
+    try:
+        cache.put_many(model, [(keys[c["id"]], by_id[c["id"]], candidate_tokens(c) + len(json.dumps(by_id[c["id"]])) // 4)
+                               for c in candidates])
+    except Exception:
+        pass
+
+def extract_items(candidates, model: str, stats: CacheStats):
+    # Only the candidates missing from the cache are sent; the items come back in one list either way.
+    cache = get_cache()
+    if not cache:
+        return call_openai(build_messages(candidates), model=model)
+    keys = candidate_keys(model, candidates)
+    found = _cache_lookup(cache, keys, stats)
+    items = [it for its in found.values() for it in its]
+    todo = [c for c in candidates if c["id"] not in found]
+    if todo:
+        fresh = call_openai(build_messages(todo), model=model)
+        _cache_store(cache, model, keys, todo, fresh)
+        items += fresh
+    return items
+
+def parse_items(txt: str):
+    data = json.loads(txt.strip())
     if isinstance(data, dict) and "items" in data:
         return data["items"]
     if isinstance(data, list):
         return data
     return []
 
-QMAP = {'Q1':1,'Q2':2,'Q3':3,'Q4':4}
+def extraction_version(model: str) -> str:
+    return hashlib.sha256(f"{model}\n{SYSTEM}".encode("utf-8")).hexdigest()[:16]
 
-def extract_for_ticker(ticker: str, model: Optional[str] = None, start_year: Optional[int] = None, end_year: Optional[int] = None, start_q: str = 'Q1', end_q: str = 'Q4'):
-    model = model or DEFAULT_MODEL
-    sources = ["press_release", "presentation", "transcript"]
-    for src in sources:
-        rows = fetch_rows(ticker, file_type=src, file_format="text")
-        # Filter rows to selected year/quarter window if provided
-        if start_year is not None and end_year is not None:
-            frows = []
+def parse_fingerprint(raw) -> Dict[str, Any]:
+    try:
+        fp = json.loads(raw) if raw else {}
+    except Exception:
+        fp = {}
+    return {"version": fp.get("version"), "sources": fp.get("sources") or {}}
+
+def load_fingerprints(ticker: str, start_year: Optional[int] = None, end_year: Optional[int] = None, start_q: str = 'Q1', end_q: str = 'Q4'):
+    rows = fetch_rows(ticker, file_type="guidance_json", file_format="json", columns="year,quarter,fingerprint,text_content",
+                      start_year=start_year, end_year=end_year, start_q=start_q, end_q=end_q)
+    existing = {}
+    for r in rows:
+        fp = parse_fingerprint(r.get("fingerprint"))
+        fp["items"] = row_items(r)
+        existing[(r["year"], r["quarter"])] = fp
+    return existing
+
+def _unchanged(prev, version, src, h) -> bool:
+    return bool(prev) and prev["version"] == version and prev["sources"].get(src) == h
+
+def collect_documents(ticker: str, start_year: Optional[int] = None, end_year: Optional[int] = None, start_q: str = 'Q1', end_q: str = 'Q4',
+                      version: Optional[str] = None, existing: Optional[Dict] = None):
+    # With `existing` fingerprints, documents whose text and extraction version are unchanged are skipped;
+    # only the bodies of new or changed documents are downloaded.
+    # In the compact format, stored candidates of the current prefilter are used as they are and only
+    # rows without them (not yet migrated, or mined by an older prefilter) download their text.
+    docs = []
+    window = dict(start_year=start_year, end_year=end_year, start_q=start_q, end_q=end_q)
+    columns = MINED_COLUMNS if STORE_FORMAT == "compact" else DOC_COLUMNS
+    for src in SOURCES:
+        if existing is None:
+            rows = fetch_rows(ticker, file_type=src, file_format="text", columns=columns, **window)
+        else:
+            meta = fetch_rows(ticker, file_type=src, file_format="text", columns="year,quarter,content_hash", **window)
+            stale = [(r["year"], r["quarter"]) for r in meta
+                     if not _unchanged(existing.get((r["year"], r["quarter"])), version, src, r.get("content_hash"))]
+            rows = fetch_rows(ticker, file_type=src, file_format="text", columns=columns, periods=stale)
+        if columns == MINED_COLUMNS:
+            unmined = []
             for r in rows:
-                y = r.get('year')
-                q = r.get('quarter')
-                if y is None or not q:
-                    continue
-                qn = QMAP.get(str(q).upper(), 0)
-                qn_start = QMAP[start_q] if y == start_year else 1
-                qn_end = QMAP[end_q] if y == end_year else 4
-                if start_year < y < end_year or (y == start_year and qn >= qn_start) or (y == end_year and qn <= qn_end):
-                    frows.append(r)
-            rows = frows
-        if not rows:
-            continue
+                mined = r.get("candidates")
+                if not mined or mined.get("version") != PREFILTER_VERSION:
+                    unmined.append((r["year"], r["quarter"]))
+                elif not mined.get("blank"):
+                    docs.append(mined_doc(ticker, r["year"], r["quarter"], src, r.get("source_url"), r["content_hash"], mined))
+            rows = fetch_rows(ticker, file_type=src, file_format="text", columns=DOC_COLUMNS, periods=unmined)
         for r in rows:
             text = r.get("text_content") or ""
             if not text.strip():
                 continue
-            year = r["year"]
-            quarter = r["quarter"]
-            url = r.get("source_url")
-            filing_date = try_iso_date_from_text(text[:2000])
-            candidates = mine_candidates(text)
-            if not candidates:
+            h = r.get("content_hash") or content_hash(text)
+            if existing is not None and _unchanged(existing.get((r["year"], r["quarter"])), version, src, h):
                 continue
-            messages = [
-                {"role": "system", "content": SYSTEM},
-                {"role": "user", "content": json.dumps({"candidates": candidates})},
-            ]
-            items = call_openai(messages, model=model)
+            docs.append(make_document(ticker, r["year"], r["quarter"], src, r.get("source_url"), text, h))
+    return docs
+
+def make_document(ticker: str, year: int, quarter: str, source: str, url: Optional[str], text: str, h: Optional[str] = None):
+    return {
+        "ticker": ticker.upper(),
+        "year": year,
+        "quarter": quarter,
+        "source": source,
+        "url": url,
+        "filing_date": try_iso_date_from_text(text[:2000]),
+        "content_hash": h or content_hash(text),
+        "candidates": mine_candidates(text),
+    }
+
+def mined_doc(ticker: str, year: int, quarter: str, source: str, url: Optional[str], h: str, mined: Dict[str, Any]):
+    return {
+        "ticker": ticker.upper(),
+        "year": year,
+        "quarter": quarter,
+        "source": source,
+        "url": url,
+        "filing_date": mined.get("filing_date"),
+        "content_hash": h,
+        "candidates": mined.get("candidates") or [],
+    }
+
+# Collects per-document results and writes one guidance_json row per (ticker, year, quarter),
+# holding the items of every source, once all documents of that quarter have been extracted.
+# The row's fingerprint records the extraction version and the content hash of each source text;
+# in incremental runs the items of sources that were not re-extracted are carried over.
+# A quarter with a failed document is not written: its stored row stays as it was and the next run retries it.
+class QuarterWriter:
+    def __init__(self, docs, version: str, existing: Optional[Dict] = None):
+        self.version = version
+        self.pending = {}
+        self.items = {}
+        self.sources = {}
+        self.urls = {}
+        self.failed = set()
+        self.written = 0
+        self.skipped = 0
+        for d in docs:
+            k = (d["ticker"], d["year"], d["quarter"])
+            self.pending[k] = self.pending.get(k, 0) + 1
+            self.items.setdefault(k, [])
+            self.sources.setdefault(k, {})
+            if d.get("url") and k not in self.urls:
+                self.urls[k] = d["url"]
+        for k in self.pending:
+            prev = (existing or {}).get(k)
+            if not prev or prev["version"] != version:
+                continue
+            redone = {d["source"] for d in docs if (d["ticker"], d["year"], d["quarter"]) == k}
+            self.items[k] = [it for it in prev["items"] if it.get("source") not in redone]
+            self.sources[k] = {s: h for s, h in prev["sources"].items() if s not in redone}
+
+    def add(self, doc, items, ok: bool = True):
+        # Returns the quarter's key once its last document is in and the quarter can be written.
+        k = (doc["ticker"], doc["year"], doc["quarter"])
+        src = doc["source"]
+        if ok:
             for it in items:
                 it.setdefault("source", src)
-                it.setdefault("filing_date", filing_date)
-            blob = json.dumps(items, ensure_ascii=False)
-            upsert_row(ticker, year, quarter, "guidance_json", "json", None, url, blob)
+                it.setdefault("filing_date", doc["filing_date"])
+            self.items[k].extend(items)
+            self.sources[k][src] = doc["content_hash"]
+        else:
+            self.failed.add(k)
+        self.pending[k] -= 1
+        if self.pending[k]:
+            return None
+        if k in self.failed:
+            del self.items[k], self.sources[k]
+            self.skipped += 1
+            return None
+        return k
+
+    def write(self, k):
+        ticker, year, quarter = k
+        blob = json.dumps(self.items.pop(k), ensure_ascii=False)
+        fingerprint = json.dumps({"version": self.version, "sources": self.sources.pop(k)}, sort_keys=True)
+        upsert_row(ticker, year, quarter, "guidance_json", "json", None, self.urls.get(k), blob, fingerprint=fingerprint)
+        self.written += 1
+
+def _prepare(ticker, model, start_year, end_year, start_q, end_q, incremental):
+    version = extraction_version(model)
+    with span("guidance.collect_documents", ticker=ticker):
+        existing = load_fingerprints(ticker, start_year, end_year, start_q, end_q) if incremental else None
+        docs = collect_documents(ticker, start_year, end_year, start_q, end_q, version, existing)
+    count("guidance.documents", len(docs))
+    count("guidance.candidates", sum(len(d["candidates"]) for d in docs))
+    return docs, version, {(ticker.upper(),) + k: v for k, v in (existing or {}).items()}
+
+def _request_docs(request, docs):
+    return [docs[i] for i in sorted({i for idxs in request["owners"].values() for i in idxs})]
+
+def extract_for_ticker(ticker: str, model: Optional[str] = None, start_year: Optional[int] = None, end_year: Optional[int] = None, start_q: str = 'Q1', end_q: str = 'Q4',
+                       incremental: bool = False, token_budget: Optional[int] = None):
+    model = model or DEFAULT_MODEL
+    docs, version, existing = _prepare(ticker, model, start_year, end_year, start_q, end_q, incremental)
+    docs.sort(key=lambda d: (d["year"], d["quarter"]))
+    writer = QuarterWriter(docs, version, existing)
+    requests = plan_requests(docs, token_budget)
+    collector = DocCollector(requests)
+    stats = CacheStats()
+    for doc in docs:
+        if not doc["candidates"]:
+            done = writer.add(doc, [])
+            if done:
+                writer.write(done)
+    for req in requests:
+        items = extract_items(req["candidates"], model, stats)
+        for i, its, ok in collector.add(req, items):
+            done = writer.add(docs[i], its, ok)
+            if done:
+                writer.write(done)
+    plan = plan_stats(docs, requests)
+    print(f"[{ticker.upper()}] {len(requests)} request(s) for {len(docs)} document(s); "
+          f"{plan['sent']}/{plan['candidates']} unique candidate(s) sent; {stats}")
+    return {"documents": len(docs), "requests": len(requests), "quarters": writer.written,
+            "unrouted": collector.unrouted, "plan": plan, "cache": stats.as_dict()}
+
+# Async extraction: documents from every source, quarter and ticker are in flight at once,
+# bounded by a semaphore and an optional tokens-per-minute budget.
+
+class TokenRateLimiter:
+    def __init__(self, tokens_per_minute: int):
+        self.rate = tokens_per_minute / 60.0
+        self.capacity = float(tokens_per_minute)
+        self.available = float(tokens_per_minute)
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self, tokens: int):
+        tokens = min(float(tokens), self.capacity)
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.available = min(self.capacity, self.available + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.available >= tokens:
+                    self.available -= tokens
+                    return
+                await asyncio.sleep((tokens - self.available) / self.rate)
+
+@retry(wait=wait_exponential(multiplier=1, min=2, max=30), stop=stop_after_attempt(5), before_sleep=_count_retry)
+async def acall_openai(client, messages, model: str):
+    with span("openai.call", model=model):
+        resp = await client.chat.completions.create(
+            model=model,
+            temperature=0,
+            messages=messages,
+            response_format={"type": "json_object"},
+        )
+    _count_usage(resp)
+    return parse_items(resp.choices[0].message.content)
+
+class AsyncExtractor:
+    # Everything the requests of one async run share: the OpenAI client, the concurrency and
+    # tokens-per-minute limits, the LLM cache and its stats.
+    def __init__(self, model: str, concurrency: int, tokens_per_minute: Optional[int] = None):
+        self.model = model
+        self.sem = asyncio.Semaphore(max(1, concurrency))
+        self.limiter = TokenRateLimiter(tokens_per_minute) if tokens_per_minute else None
+        # Async clients are bound to the event loop they first run on, so each run builds its own,
+        # with a keep-alive pool as wide as the request concurrency.
+        from openai import AsyncOpenAI
+        kwargs = {"api_key": OPENAI_API_KEY} if OPENAI_API_KEY else {}
+        self.client = AsyncOpenAI(http_client=async_http_client(max(1, concurrency)), **kwargs)
+        self.cache = get_cache()
+        self.stats = CacheStats()
+
+    async def items(self, candidates):
+        items, todo = [], candidates
+        if self.cache:
+            keys = candidate_keys(self.model, candidates)
+            found = await asyncio.to_thread(_cache_lookup, self.cache, keys, self.stats)
+            items = [it for its in found.values() for it in its]
+            todo = [c for c in candidates if c["id"] not in found]
+            if not todo:
+                return items
+        messages = build_messages(todo)
+        async with self.sem:
+            if self.limiter:
+                await self.limiter.acquire(estimate_tokens(messages))
+            fresh = await acall_openai(self.client, messages, self.model)
+        if self.cache:
+            await asyncio.to_thread(_cache_store, self.cache, self.model, keys, todo, fresh)
+        return items + fresh
+
+    async def close(self):
+        await self.client.close()
+
+async def extract_documents(docs, requests, writer: QuarterWriter, extractor: AsyncExtractor, failed: list) -> DocCollector:
+    # Runs the planned requests for `docs` concurrently; each quarter's row is written by `writer`
+    # as soon as its last document is in. Failed documents are appended to `failed`.
+    collector = DocCollector(requests)
+
+    async def finish(i, items, ok):
+        done = writer.add(docs[i], items, ok)
+        if done:
+            await asyncio.to_thread(writer.write, done)
+
+    async def run(req):
+        try:
+            items = await extractor.items(req["candidates"])
+        except Exception as e:
+            failed.extend((d["ticker"], d["year"], d["quarter"], d["source"], str(e)) for d in _request_docs(req, docs))
+            items = None
+        for i, its, ok in collector.add(req, items):
+            await finish(i, its, ok)
+
+    for i, d in enumerate(docs):
+        if not d["candidates"]:
+            await finish(i, [], True)
+    await asyncio.gather(*[run(r) for r in requests])
+    return collector
+
+async def _extract_async(tickers, model, start_year, end_year, start_q, end_q, concurrency, tokens_per_minute, incremental, token_budget):
+    prepared = await asyncio.gather(*[
+        asyncio.to_thread(_prepare, t, model, start_year, end_year, start_q, end_q, incremental) for t in tickers
+    ])
+    docs = [d for lst, _v, _e in prepared for d in lst]
+    docs.sort(key=lambda d: (d["ticker"], d["year"], d["quarter"]))
+    existing = {k: v for _d, _v, ex in prepared for k, v in ex.items()}
+    writer = QuarterWriter(docs, extraction_version(model), existing)
+    requests = plan_requests(docs, token_budget)
+    extractor = AsyncExtractor(model, concurrency, tokens_per_minute)
+    failed = []
+    try:
+        collector = await extract_documents(docs, requests, writer, extractor, failed)
+    finally:
+        await extractor.close()
+    plan = plan_stats(docs, requests)
+    print(f"{len(requests)} request(s) for {len(docs)} document(s); "
+          f"{plan['sent']}/{plan['candidates']} unique candidate(s) sent; {extractor.stats}")
+    return {"documents": len(docs), "requests": len(requests), "quarters": writer.written, "quarters_skipped": writer.skipped,
+            "unrouted": collector.unrouted, "failed": failed, "plan": plan, "cache": extractor.stats.as_dict()}
+
+def extract_async(tickers, model: Optional[str] = None, start_year: Optional[int] = None, end_year: Optional[int] = None,
+                  start_q: str = 'Q1', end_q: str = 'Q4', concurrency: Optional[int] = None, tokens_per_minute: Optional[int] = None,
+                  incremental: bool = False, token_budget: Optional[int] = None):
+    tickers = [tickers] if isinstance(tickers, str) else list(tickers)
+    return asyncio.run(_extract_async(
+        [t.upper() for t in tickers], model or DEFAULT_MODEL, start_year, end_year, start_q, end_q,
+        concurrency or EXTRACT_CONCURRENCY, OPENAI_TPM if tokens_per_minute is None else tokens_per_minute, incremental, token_budget,
+    ))
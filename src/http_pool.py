@@ -0,0 +1,63 @@
+import os
+import threading
+from typing import Optional, Dict, Union
+import httpx
+
+# Connection layer shared by the OpenAI and Supabase clients. One HTTP/2 transport per process holds the
+# keep-alive pool, so extraction and storage calls reuse TLS connections instead of opening one per call;
+# each client built here has its own base URL, headers and timeout on top of that pool.
+
+HTTP2 = os.getenv("HTTP2", "1") == "1"
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", "64"))
+HTTP_MAX_KEEPALIVE = int(os.getenv("HTTP_MAX_KEEPALIVE", "32"))
+HTTP_KEEPALIVE_EXPIRY = float(os.getenv("HTTP_KEEPALIVE_EXPIRY", "60"))
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "10"))
+HTTP_TIMEOUT = float(os.getenv("HTTP_TIMEOUT", "120"))
+
+def _http2() -> bool:
+    # HTTP/2 needs the h2 package (httpx[http2]); without it connections fall back to HTTP/1.1 keep-alive.
+    if not HTTP2:
+        return False
+    try:
+        import h2  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+def limits(max_connections: Optional[int] = None) -> httpx.Limits:
+    size = max(max_connections or HTTP_MAX_CONNECTIONS, 1)
+    return httpx.Limits(max_connections=size, max_keepalive_connections=min(HTTP_MAX_KEEPALIVE, size),
+                        keepalive_expiry=HTTP_KEEPALIVE_EXPIRY)
+
+def timeout(seconds: Union[int, float, httpx.Timeout, None] = None) -> httpx.Timeout:
+    if isinstance(seconds, httpx.Timeout):
+        return seconds
+    return httpx.Timeout(HTTP_TIMEOUT if seconds is None else seconds, connect=HTTP_CONNECT_TIMEOUT)
+
+def _proxy() -> Optional[httpx.Proxy]:
+    # A custom transport skips httpx's environment proxy lookup, so HTTPS_PROXY is applied here.
+    url = os.getenv("HTTPS_PROXY") or os.getenv("https_proxy")
+    return httpx.Proxy(url) if url else None
+
+_transport: Optional[httpx.HTTPTransport] = None
+_lock = threading.Lock()
+
+def shared_transport() -> httpx.HTTPTransport:
+    global _transport
+    if _transport is None:
+        with _lock:
+            if _transport is None:
+                _transport = httpx.HTTPTransport(http2=_http2(), limits=limits(), proxy=_proxy())
+    return _transport
+
+def http_client(base_url: str = "", headers: Optional[Dict[str, str]] = None,
+                timeout_seconds: Union[int, float, httpx.Timeout, None] = None) -> httpx.Client:
+    # Closing a client built here would close the shared pool; they live as long as the process.
+    return httpx.Client(base_url=base_url, headers=headers, timeout=timeout(timeout_seconds),
+                        transport=shared_transport(), follow_redirects=True)
+
+def async_http_client(max_connections: Optional[int] = None,
+                      timeout_seconds: Union[int, float, httpx.Timeout, None] = None) -> httpx.AsyncClient:
+    # Async pools belong to one event loop, so each run gets its own, sized to its concurrency.
+    transport = httpx.AsyncHTTPTransport(http2=_http2(), limits=limits(max_connections), proxy=_proxy())
+    return httpx.AsyncClient(timeout=timeout(timeout_seconds), transport=transport, follow_redirects=True)
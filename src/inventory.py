@@ -0,0 +1,54 @@
+import threading
+from typing import Dict, Set, Tuple
+from .cloud_store import fetch_rows, list_files
+
+# Per-run index of what is already stored for a ticker: one metadata query for earnings_files
+# and one listing of the ticker's storage folder. Quarter folders that exist in storage but have
+# no pdf row are listed lazily, once. Callers mark uploads so the index stays current.
+
+class Inventory:
+    def __init__(self, ticker: str):
+        self.ticker = ticker.upper()
+        self.rows: Set[Tuple[int, str, str, str]] = set()
+        self.folders: Set[str] = set()
+        self.files: Dict[str, Set[str]] = {}
+        self.lock = threading.Lock()
+
+    def load(self) -> "Inventory":
+        rows = fetch_rows(self.ticker, columns="year,quarter,file_type,file_format")
+        self.rows = {(r["year"], r["quarter"], r["file_type"], r["file_format"]) for r in rows}
+        try:
+            entries = list_files(f"pdfs/{self.ticker}")
+        except Exception:
+            entries = []
+        self.folders = {e.get("name") for e in entries if e.get("name")}
+        return self
+
+    def _folder_files(self, folder: str) -> Set[str]:
+        with self.lock:
+            if folder in self.files:
+                return self.files[folder]
+        try:
+            names = {e.get("name") for e in list_files(f"pdfs/{self.ticker}/{folder}")}
+        except Exception:
+            names = set()
+        with self.lock:
+            return self.files.setdefault(folder, names)
+
+    def has_pdf(self, year: int, quarter: str, file_type: str) -> bool:
+        if (year, quarter, file_type, "pdf") in self.rows:
+            return True
+        folder = f"{year}-{quarter}"
+        if folder not in self.folders:
+            return False
+        return f"{file_type}.pdf" in self._folder_files(folder)
+
+    def has_text(self, year: int, quarter: str, file_type: str) -> bool:
+        return (year, quarter, file_type, "text") in self.rows
+
+    def mark(self, year: int, quarter: str, file_type: str, file_format: str):
+        with self.lock:
+            self.rows.add((year, quarter, file_type, file_format))
+            if file_format == "pdf":
+                self.folders.add(f"{year}-{quarter}")
+                self.files.setdefault(f"{year}-{quarter}", set()).add(f"{file_type}.pdf")
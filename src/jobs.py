@@ -0,0 +1,498 @@
+# Durable backfill jobs. A job is a set of ticker × quarter × document-type tasks kept in a queue table
+# (local SQLite by default, or Supabase with JOBS_BACKEND=supabase) with status, attempts and a lease.
+# A separate worker process claims the tasks of one quarter at a time, scrapes them and records the
+# outcome per task; Streamlit only enqueues and polls. Crashed workers, browser crashes and Quartr
+# timeouts cost at most the quarters in flight: expired leases are reclaimed and failed tasks are retried
+# with backoff until JOB_MAX_ATTEMPTS. Usage:
+#   python -m src.jobs enqueue --tickers AAPL,MSFT --start-year 2015 --end-year 2024
+#   python -m src.jobs worker [--pages 4] [--forever]
+#   python -m src.jobs status [JOB_ID]
+#   python -m src.jobs retry JOB_ID | cancel JOB_ID
+import os
+import sys
+import json
+import time
+import socket
+import sqlite3
+import asyncio
+import argparse
+import threading
+import subprocess
+from typing import List, Dict, Any, Optional, Tuple
+from dotenv import load_dotenv
+from .cloud_store import PAGE_SIZE
+from .inventory import Inventory
+from .quartr_loader import HEADLESS, SLOW_MO_MS, LABELS, SCRAPE_FAST, is_cloud_headless, iter_quarters
+from .backfill import BACKFILL_WORKERS, block_resources, login, save_download, scrape_quarter
+from . import telemetry
+
+load_dotenv()
+
+JOBS_BACKEND = os.getenv("JOBS_BACKEND", "sqlite")  # sqlite | supabase
+JOBS_PATH = os.getenv("JOBS_PATH", os.path.join(".cache", "jobs.sqlite"))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+# A claimed quarter must finish within the lease; the worker renews it while the quarter is in flight,
+# so an expired lease means the worker is gone.
+JOB_LEASE_SECONDS = float(os.getenv("JOB_LEASE_SECONDS", "300"))
+JOB_RETRY_SECONDS = float(os.getenv("JOB_RETRY_SECONDS", "60"))  # doubled per attempt
+JOB_POLL_SECONDS = float(os.getenv("JOB_POLL_SECONDS", "5"))
+JOBS_PIDFILE = os.getenv("JOBS_PIDFILE", os.path.join(".cache", "jobs-worker.pid"))
+JOBS_LOG = os.getenv("JOBS_LOG", os.path.join(".cache", "jobs-worker.log"))
+
+STATUSES = ["pending", "running", "done", "missing", "failed", "cancelled"]
+OPEN = ("pending", "running")
+
+def retry_at(attempts: int, now: Optional[float] = None) -> float:
+    return (now or time.time()) + JOB_RETRY_SECONDS * 2 ** max(attempts - 1, 0)
+
+def job_tasks(tickers: List[str], start_year: int, end_year: int, start_q: str = 'Q1', end_q: str = 'Q4',
+              file_types: Optional[List[str]] = None) -> List[Tuple[str, int, str, str]]:
+    types = file_types or [ftype for _label, ftype in LABELS]
+    return [(t.strip().upper(), year, quarter, ftype)
+            for t in tickers if t.strip()
+            for year, quarter in iter_quarters(start_year, end_year, start_q, end_q)
+            for ftype in types]
+
+class SQLiteQueue:
+    def __init__(self, path: str = JOBS_PATH):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.lock = threading.Lock()
+        # Autocommit; claims take the write lock explicitly. WAL lets the app read while a worker writes.
+        self.conn = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute("pragma journal_mode=wal")
+        self.conn.executescript(
+            "create table if not exists backfill_jobs ("
+            " id integer primary key autoincrement, params text not null, created_at real not null);"
+            "create table if not exists backfill_tasks ("
+            " id integer primary key autoincrement, job_id int not null, ticker text not null, year int not null,"
+            " quarter text not null, file_type text not null, status text not null default 'pending',"
+            " attempts int not null default 0, max_attempts int not null, not_before real not null default 0,"
+            " lease_until real, worker text, last_error text, updated_at real);"
+            "create index if not exists ix_tasks_status on backfill_tasks(status, not_before);"
+            "create index if not exists ix_tasks_job on backfill_tasks(job_id, status);"
+        )
+
+    def create_job(self, params: Dict[str, Any], tasks: List[Tuple[str, int, str, str]]) -> Tuple[int, int]:
+        # Tasks already open in another job are not queued twice.
+        now = time.time()
+        with self.lock:
+            c = self.conn
+            c.execute("begin immediate")
+            try:
+                open_now = {tuple(r) for r in c.execute(
+                    "select ticker, year, quarter, file_type from backfill_tasks where status in ('pending', 'running')")}
+                job_id = c.execute("insert into backfill_jobs (params, created_at) values (?, ?)",
+                                   (json.dumps(params), now)).lastrowid
+                new = [t for t in tasks if t not in open_now]
+                c.executemany("insert into backfill_tasks (job_id, ticker, year, quarter, file_type, max_attempts, updated_at)"
+                              " values (?, ?, ?, ?, ?, ?, ?)", [(job_id, *t, JOB_MAX_ATTEMPTS, now) for t in new])
+                c.execute("commit")
+            except BaseException:
+                c.execute("rollback")
+                raise
+        return job_id, len(new)
+
+    def claim(self, worker: str) -> List[Dict[str, Any]]:
+        # All claimable tasks of the oldest claimable quarter, so the worker navigates to it once.
+        now = time.time()
+        with self.lock:
+            c = self.conn
+            c.execute("begin immediate")
+            try:
+                c.execute("update backfill_tasks set status = 'failed', last_error = coalesce(last_error, 'lease expired'),"
+                          " updated_at = ? where status = 'running' and lease_until < ? and attempts >= max_attempts", (now, now))
+                claimable = "((status = 'pending' and not_before <= ?) or (status = 'running' and lease_until < ?))"
+                first = c.execute(f"select job_id, ticker, year, quarter from backfill_tasks where {claimable}"
+                                  " order by id limit 1", (now, now)).fetchone()
+                ids = []
+                if first:
+                    ids = [r[0] for r in c.execute(
+                        f"select id from backfill_tasks where job_id = ? and ticker = ? and year = ? and quarter = ? and {claimable}",
+                        (*first, now, now))]
+                    marks = ",".join("?" * len(ids))
+                    c.execute(f"update backfill_tasks set status = 'running', attempts = attempts + 1, worker = ?,"
+                              f" lease_until = ?, updated_at = ? where id in ({marks})", (worker, now + JOB_LEASE_SECONDS, now, *ids))
+                c.execute("commit")
+            except BaseException:
+                c.execute("rollback")
+                raise
+            if not ids:
+                return []
+            rows = c.execute(f"select * from backfill_tasks where id in ({marks}) order by id", ids).fetchall()
+        return [dict(r) for r in rows]
+
+    def renew(self, ids: List[int], worker: str):
+        if not ids:
+            return
+        marks = ",".join("?" * len(ids))
+        with self.lock:
+            self.conn.execute(f"update backfill_tasks set lease_until = ? where worker = ? and status = 'running' and id in ({marks})",
+                              (time.time() + JOB_LEASE_SECONDS, worker, *ids))
+
+    def finish(self, task: Dict[str, Any], worker: str, status: str, error: Optional[str] = None):
+        with self.lock:
+            self.conn.execute("update backfill_tasks set status = ?, last_error = ?, lease_until = null, updated_at = ?"
+                              " where id = ? and worker = ? and status = 'running'",
+                              (status, error, time.time(), task["id"], worker))
+
+    def fail(self, task: Dict[str, Any], worker: str, error: str):
+        if task["attempts"] >= task["max_attempts"]:
+            return self.finish(task, worker, "failed", error)
+        with self.lock:
+            self.conn.execute("update backfill_tasks set status = 'pending', not_before = ?, last_error = ?, lease_until = null,"
+                              " updated_at = ? where id = ? and worker = ? and status = 'running'",
+                              (retry_at(task["attempts"]), error, time.time(), task["id"], worker))
+
+    def jobs(self, limit: int = 20) -> List[Dict[str, Any]]:
+        with self.lock:
+            jobs = [dict(r) for r in self.conn.execute("select * from backfill_jobs order by id desc limit ?", (limit,))]
+            counts = self.conn.execute(
+                f"select job_id, status, count(*) from backfill_tasks where job_id in ({','.join('?' * len(jobs))})"
+                " group by job_id, status", [j["id"] for j in jobs]).fetchall() if jobs else []
+        for j in jobs:
+            j["params"] = json.loads(j["params"])
+            j["counts"] = {s: 0 for s in STATUSES}
+        by_id = {j["id"]: j for j in jobs}
+        for job_id, status, n in counts:
+            by_id[job_id]["counts"][status] = n
+        return jobs
+
+    def tasks(self, job_id: int, statuses: Optional[List[str]] = None) -> List[Dict[str, Any]]:
+        sql, args = "select * from backfill_tasks where job_id = ?", [job_id]
+        if statuses:
+            sql += f" and status in ({','.join('?' * len(statuses))})"
+            args += statuses
+        with self.lock:
+            return [dict(r) for r in self.conn.execute(sql + " order by id", args)]
+
+    def open_count(self) -> int:
+        with self.lock:
+            return self.conn.execute("select count(*) from backfill_tasks where status in ('pending', 'running')").fetchone()[0]
+
+    def retry(self, job_id: int) -> int:
+        with self.lock:
+            return self.conn.execute("update backfill_tasks set status = 'pending', attempts = 0, not_before = 0, updated_at = ?"
+                                     " where job_id = ? and status in ('failed', 'cancelled')", (time.time(), job_id)).rowcount
+
+    def cancel(self, job_id: int) -> int:
+        # Quarters already in flight finish; nothing new is claimed.
+        with self.lock:
+            return self.conn.execute("update backfill_tasks set status = 'cancelled', updated_at = ?"
+                                     " where job_id = ? and status = 'pending'", (time.time(), job_id)).rowcount
+
+class SupabaseQueue:
+    # Same tables in Postgres (see SETUP_INSTRUCTIONS.txt). PostgREST has no transactions, so a claim is a
+    # compare-and-set on updated_at per task: a task another worker claimed first is simply not returned.
+    def __init__(self):
+        from .stores import supabase_client
+        self.sb = supabase_client()
+
+    def _t(self):
+        return self.sb.table("backfill_tasks")
+
+    def create_job(self, params: Dict[str, Any], tasks: List[Tuple[str, int, str, str]]) -> Tuple[int, int]:
+        now = time.time()
+        open_now = set()
+        for t in sorted({t[0] for t in tasks}):
+            rows = self._t().select("ticker,year,quarter,file_type").eq("ticker", t).in_("status", list(OPEN)).execute().data
+            open_now |= {(r["ticker"], r["year"], r["quarter"], r["file_type"]) for r in rows}
+        job_id = self.sb.table("backfill_jobs").insert({"params": json.dumps(params), "created_at": now}).execute().data[0]["id"]
+        new = [t for t in tasks if t not in open_now]
+        rows = [{"job_id": job_id, "ticker": t[0], "year": t[1], "quarter": t[2], "file_type": t[3], "status": "pending",
+                 "attempts": 0, "max_attempts": JOB_MAX_ATTEMPTS, "not_before": 0, "updated_at": now} for t in new]
+        for i in range(0, len(rows), 500):
+            self._t().insert(rows[i:i + 500]).execute()
+        return job_id, len(new)
+
+    def _claimable(self, query, now: float):
+        return query.or_(f"and(status.eq.pending,not_before.lte.{now}),and(status.eq.running,lease_until.lt.{now})")
+
+    def claim(self, worker: str) -> List[Dict[str, Any]]:
+        now = time.time()
+        first = self._claimable(self._t().select("job_id,ticker,year,quarter"), now).order("id").limit(1).execute().data
+        if not first:
+            return []
+        f = first[0]
+        group = self._claimable(self._t().select("*").eq("job_id", f["job_id"]).eq("ticker", f["ticker"])
+                                .eq("year", f["year"]).eq("quarter", f["quarter"]), now).order("id").execute().data
+        claimed = []
+        for task in group:
+            if task["status"] == "running" and task["attempts"] >= task["max_attempts"]:
+                self._t().update({"status": "failed", "last_error": task.get("last_error") or "lease expired", "updated_at": now}) \
+                    .eq("id", task["id"]).eq("updated_at", task["updated_at"]).execute()
+                continue
+            won = self._t().update({"status": "running", "attempts": task["attempts"] + 1, "worker": worker,
+                                    "lease_until": now + JOB_LEASE_SECONDS, "updated_at": now}) \
+                .eq("id", task["id"]).eq("updated_at", task["updated_at"]).execute().data
+            claimed += won
+        return claimed
+
+    def renew(self, ids: List[int], worker: str):
+        if ids:
+            self._t().update({"lease_until": time.time() + JOB_LEASE_SECONDS}).in_("id", ids).eq("worker", worker) \
+                .eq("status", "running").execute()
+
+    def finish(self, task: Dict[str, Any], worker: str, status: str, error: Optional[str] = None):
+        self._t().update({"status": status, "last_error": error, "lease_until": None, "updated_at": time.time()}) \
+            .eq("id", task["id"]).eq("worker", worker).eq("status", "running").execute()
+
+    def fail(self, task: Dict[str, Any], worker: str, error: str):
+        if task["attempts"] >= task["max_attempts"]:
+            return self.finish(task, worker, "failed", error)
+        self._t().update({"status": "pending", "not_before": retry_at(task["attempts"]), "last_error": error,
+                          "lease_until": None, "updated_at": time.time()}) \
+            .eq("id", task["id"]).eq("worker", worker).eq("status", "running").execute()
+
+    def jobs(self, limit: int = 20) -> List[Dict[str, Any]]:
+        # The panel polls this every few seconds: one query for the jobs and one for their per-status task
+        # counts, grouped by Postgres in the backfill_job_counts view (see SETUP_INSTRUCTIONS.txt).
+        jobs = self.sb.table("backfill_jobs").select("*").order("id", desc=True).limit(limit).execute().data
+        for j in jobs:
+            j["params"] = json.loads(j["params"])
+            j["counts"] = {s: 0 for s in STATUSES}
+        by_id = {j["id"]: j for j in jobs}
+        if by_id:
+            for r in self.sb.table("backfill_job_counts").select("job_id,status,n").in_("job_id", list(by_id)).execute().data:
+                by_id[r["job_id"]]["counts"][r["status"]] = r["n"]
+        return jobs
+
+    def tasks(self, job_id: int, statuses: Optional[List[str]] = None) -> List[Dict[str, Any]]:
+        # Paged like fetch_rows: PostgREST cuts a single response off at its max-rows limit.
+        rows: List[Dict[str, Any]] = []
+        offset = 0
+        while True:
+            q = self._t().select("*").eq("job_id", job_id)
+            if statuses:
+                q = q.in_("status", statuses)
+            page = q.order("id").range(offset, offset + PAGE_SIZE - 1).execute().data
+            rows.extend(page)
+            if len(page) < PAGE_SIZE:
+                return rows
+            offset += PAGE_SIZE
+
+    def open_count(self) -> int:
+        return self._t().select("id", count="exact").in_("status", list(OPEN)).limit(1).execute().count or 0
+
+    def retry(self, job_id: int) -> int:
+        return len(self._t().update({"status": "pending", "attempts": 0, "not_before": 0, "updated_at": time.time()})
+                   .eq("job_id", job_id).in_("status", ["failed", "cancelled"]).execute().data)
+
+    def cancel(self, job_id: int) -> int:
+        return len(self._t().update({"status": "cancelled", "updated_at": time.time()})
+                   .eq("job_id", job_id).eq("status", "pending").execute().data)
+
+_queue = None
+
+def get_queue():
+    global _queue
+    if _queue is None:
+        _queue = SupabaseQueue() if JOBS_BACKEND == "supabase" else SQLiteQueue()
+    return _queue
+
+def enqueue(tickers: List[str], start_year: int, end_year: int, start_q: str = 'Q1', end_q: str = 'Q4') -> Tuple[int, int]:
+    params = {"tickers": [t.strip().upper() for t in tickers if t.strip()], "start_year": start_year, "end_year": end_year,
+              "start_q": start_q, "end_q": end_q}
+    return get_queue().create_job(params, job_tasks(tickers, start_year, end_year, start_q, end_q))
+
+# ---- worker ----------------------------------------------------------------------------------------------
+
+def worker_pid() -> Optional[int]:
+    # PID of a live worker started on this machine, if any.
+    try:
+        with open(JOBS_PIDFILE) as fh:
+            pid = int(fh.read().strip())
+        os.kill(pid, 0)
+        return pid
+    except (OSError, ValueError):
+        return None
+
+def start_worker(pages: Optional[int] = None) -> int:
+    # Detached from the caller (its own session), so it outlives a Streamlit rerun or disconnect.
+    pid = worker_pid()
+    if pid:
+        return pid
+    if os.path.dirname(JOBS_LOG):
+        os.makedirs(os.path.dirname(JOBS_LOG), exist_ok=True)
+    cmd = [sys.executable, "-u", "-m", "src.jobs", "worker"] + (["--pages", str(pages)] if pages else [])
+    with open(JOBS_LOG, "a") as log:
+        proc = subprocess.Popen(cmd, cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                stdout=log, stderr=subprocess.STDOUT, stdin=subprocess.DEVNULL, start_new_session=True)
+    return proc.pid
+
+class BrowserGone(Exception):
+    pass
+
+async def _renew_leases(queue, worker: str, inflight: Dict[int, Dict[str, Any]]):
+    while True:
+        await asyncio.sleep(JOB_LEASE_SECONDS / 3)
+        try:
+            await asyncio.to_thread(queue.renew, list(inflight), worker)
+        except Exception as e:
+            print(f"[jobs] lease renewal failed: {e}")
+
+async def _run_quarter(page, queue, worker: str, tasks: List[Dict[str, Any]], inventory: Inventory, state: Dict[str, Any],
+                       inflight: Dict[int, Dict[str, Any]]):
+    ticker, year, quarter = tasks[0]["ticker"], tasks[0]["year"], tasks[0]["quarter"]
+    by_type = {task["file_type"]: task for task in tasks}
+
+    async def finish(ftype: str, status: str, error: Optional[str] = None):
+        await asyncio.to_thread(queue.finish, by_type[ftype], worker, status, error)
+        inflight.pop(by_type[ftype]["id"], None)
+
+    async def save(ftype, label, data, url):
+        # Written through (no write-behind): a task is only marked done once its rows are stored.
+        await save_download(ticker, year, quarter, ftype, data, url, inventory)
+        await finish(ftype, "done")
+        print(f"[{ticker}] Saved {label} PDF & TEXT ({quarter} {year})")
+
+    result = await scrape_quarter(page, state, inventory, ticker, year, quarter, save, list(by_type))
+    for ftype in result["stored"]:
+        await finish(ftype, "done")
+    for ftype in result["missing"]:
+        await finish(ftype, "missing", "not available" if result["opened"] else "quarter not listed")
+
+async def _page_loop(browser, login_state, queue, worker: str, inventories: Dict[str, Inventory],
+                     inflight: Dict[int, Dict[str, Any]], forever: bool):
+    ctx = await browser.new_context(accept_downloads=True, storage_state=login_state)
+    if SCRAPE_FAST:
+        await block_resources(ctx)
+    page = await ctx.new_page()
+    state: Dict[str, Any] = {}
+    try:
+        while True:
+            if not browser.is_connected():
+                return
+            tasks = await asyncio.to_thread(queue.claim, worker)
+            if not tasks:
+                if not forever and not await asyncio.to_thread(queue.open_count):
+                    return
+                await asyncio.sleep(JOB_POLL_SECONDS)
+                continue
+            for task in tasks:
+                inflight[task["id"]] = task
+            ticker = tasks[0]["ticker"]
+            try:
+                if ticker not in inventories:
+                    inventories[ticker] = await asyncio.to_thread(lambda: Inventory(ticker).load())
+                await _run_quarter(page, queue, worker, tasks, inventories[ticker], state, inflight)
+            except Exception as e:
+                # The page may be in any state now; reopen the company for the next quarter.
+                state.clear()
+                for task in tasks:
+                    if inflight.pop(task["id"], None) is not None:
+                        await asyncio.to_thread(queue.fail, task, worker, f"{type(e).__name__}: {e}"[:500])
+                print(f"[{ticker}] {tasks[0]['quarter']} {tasks[0]['year']} failed (attempt {tasks[0]['attempts']}): {e}")
+    finally:
+        try:
+            await ctx.close()
+        except Exception:
+            pass
+
+async def _session(queue, worker: str, pages: int, forever: bool):
+    # One browser and one login; a crashed browser or expired Quartr session ends the session and the
+    # caller starts a new one.
+    from playwright.async_api import async_playwright
+    inflight: Dict[int, Dict[str, Any]] = {}
+    async with async_playwright() as p:
+        args = ["--no-sandbox", "--disable-dev-shm-usage"]
+        headless_flag = True if is_cloud_headless() else HEADLESS
+        browser = await p.chromium.launch(headless=headless_flag, slow_mo=SLOW_MO_MS, args=args)
+        renew = asyncio.create_task(_renew_leases(queue, worker, inflight))
+        try:
+            login_ctx = await browser.new_context()
+            if SCRAPE_FAST:
+                await block_resources(login_ctx)
+            await login(await login_ctx.new_page())
+            login_state = await login_ctx.storage_state()
+            await login_ctx.close()
+            inventories: Dict[str, Inventory] = {}
+            await asyncio.gather(*[_page_loop(browser, login_state, queue, worker, inventories, inflight, forever)
+                                   for _ in range(max(1, pages))])
+            if not browser.is_connected():
+                raise BrowserGone("browser disconnected")
+        finally:
+            renew.cancel()
+            # Tasks still in flight go back to the queue now instead of waiting for their lease to expire.
+            for task in list(inflight.values()):
+                await asyncio.to_thread(queue.fail, task, worker, "worker session ended")
+            try:
+                await browser.close()
+            except Exception:
+                pass
+
+def run_worker(pages: Optional[int] = None, forever: bool = False):
+    queue = get_queue()
+    worker = f"{socket.gethostname()}:{os.getpid()}"
+    if os.path.dirname(JOBS_PIDFILE):
+        os.makedirs(os.path.dirname(JOBS_PIDFILE), exist_ok=True)
+    with open(JOBS_PIDFILE, "w") as fh:
+        fh.write(str(os.getpid()))
+    print(f"[jobs] worker {worker} started ({JOBS_BACKEND} queue, {pages or BACKFILL_WORKERS} page(s))")
+    failures = 0
+    try:
+        with telemetry.run("jobs.worker") as trace:
+            while forever or queue.open_count():
+                started = time.time()
+                try:
+                    asyncio.run(_session(queue, worker, pages or BACKFILL_WORKERS, forever))
+                    failures = 0
+                except Exception as e:
+                    # Login failures, browser launch errors, crashes: back off and start a fresh browser.
+                    failures = 0 if time.time() - started > JOB_LEASE_SECONDS else failures + 1
+                    wait = min(JOB_RETRY_SECONDS * 2 ** min(failures, 5), 1800)
+                    print(f"[jobs] session ended: {type(e).__name__}: {e}; restarting in {wait:.0f}s")
+                    time.sleep(wait)
+    finally:
+        if worker_pid() == os.getpid():
+            os.remove(JOBS_PIDFILE)
+    print(f"[jobs] worker {worker} stopped: no open tasks")
+    print(telemetry.format_summary(trace.summary()))
+
+def format_job(job: Dict[str, Any]) -> str:
+    p, c = job["params"], job["counts"]
+    return (f"#{job['id']} {','.join(p['tickers'])} {p['start_q']} {p['start_year']}–{p['end_q']} {p['end_year']}: "
+            + ", ".join(f"{c[s]} {s}" for s in STATUSES if c.get(s)))
+
+def main(argv: Optional[List[str]] = None):
+    ap = argparse.ArgumentParser(prog="python -m src.jobs", description="Durable backfill job queue and worker.")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    e = sub.add_parser("enqueue", help="Queue a backfill job")
+    e.add_argument("--tickers", required=True)
+    e.add_argument("--start-year", type=int, required=True)
+    e.add_argument("--end-year", type=int, required=True)
+    e.add_argument("--start-q", default="Q1")
+    e.add_argument("--end-q", default="Q4")
+    w = sub.add_parser("worker", help="Process queued tasks")
+    w.add_argument("--pages", type=int, help="Concurrent browser pages (default BACKFILL_WORKERS)")
+    w.add_argument("--forever", action="store_true", help="Keep polling when the queue is empty")
+    s = sub.add_parser("status", help="Show jobs, or one job's unfinished and failed tasks")
+    s.add_argument("job_id", type=int, nargs="?")
+    r = sub.add_parser("retry", help="Requeue a job's failed and cancelled tasks")
+    r.add_argument("job_id", type=int)
+    c = sub.add_parser("cancel", help="Cancel a job's pending tasks")
+    c.add_argument("job_id", type=int)
+    args = ap.parse_args(argv)
+
+    queue = get_queue()
+    if args.cmd == "enqueue":
+        job_id, n = enqueue(args.tickers.split(","), args.start_year, args.end_year, args.start_q, args.end_q)
+        print(f"[jobs] job #{job_id}: {n} task(s) queued")
+    elif args.cmd == "worker":
+        run_worker(args.pages, args.forever)
+    elif args.cmd == "status":
+        if args.job_id is None:
+            for job in queue.jobs():
+                print(format_job(job))
+        else:
+            for t in queue.tasks(args.job_id, ["pending", "running", "failed"]):
+                print(f"{t['ticker']} {t['quarter']} {t['year']} {t['file_type']}: {t['status']} "
+                      f"(attempt {t['attempts']}/{t['max_attempts']}) {t['last_error'] or ''}")
+    elif args.cmd == "retry":
+        print(f"[jobs] {queue.retry(args.job_id)} task(s) requeued")
+    elif args.cmd == "cancel":
+        print(f"[jobs] {queue.cancel(args.job_id)} task(s) cancelled")
+
+if __name__ == "__main__":
+    main()
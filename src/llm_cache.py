@@ -0,0 +1,102 @@
+import os
+import json
+import hashlib
+import sqlite3
+import threading
+from typing import List, Dict, Any, Tuple
+
+# Content-addressed cache of LLM extraction results, per candidate. The key is a hash of the model,
+# the SYSTEM prompt and one candidate's payload without its request-local "id", so a candidate extracted
+# once is reused however requests are packed later (token budget, dedup, incremental runs); a change to
+# the prompt or to the candidate misses.
+
+LLM_CACHE_BACKEND = os.getenv("LLM_CACHE_BACKEND", "sqlite")  # sqlite | supabase | off
+LLM_CACHE_PATH = os.getenv("LLM_CACHE_PATH", os.path.join(".cache", "llm_cache.sqlite"))
+LLM_CACHE_TABLE = os.getenv("LLM_CACHE_TABLE", "llm_cache")
+
+def cache_key(model: str, system: str, candidate: Dict[str, Any]) -> str:
+    payload = {k: v for k, v in candidate.items() if k != "id"}
+    raw = json.dumps({"model": model, "system": system, "candidate": payload}, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+class SQLiteCache:
+    def __init__(self, path: str = LLM_CACHE_PATH):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute(
+            "create table if not exists llm_cache ("
+            " key text primary key, model text, items_json text not null, tokens int,"
+            " created_at timestamp default current_timestamp)"
+        )
+        self.conn.commit()
+
+    def get_many(self, keys: List[str]) -> Dict[str, Dict[str, Any]]:
+        if not keys:
+            return {}
+        with self.lock:
+            rows = self.conn.execute(f"select key, items_json, tokens from llm_cache where key in ({','.join('?' * len(keys))})",
+                                     keys).fetchall()
+        return {r[0]: {"items": json.loads(r[1]), "tokens": r[2] or 0} for r in rows}
+
+    def put_many(self, model: str, entries: List[Tuple[str, List[Dict[str, Any]], int]]):
+        # `entries` are (key, items, tokens).
+        with self.lock:
+            self.conn.executemany(
+                "insert or replace into llm_cache (key, model, items_json, tokens) values (?, ?, ?, ?)",
+                [(key, model, json.dumps(items, ensure_ascii=False), tokens) for key, items, tokens in entries],
+            )
+            self.conn.commit()
+
+class SupabaseCache:
+    def __init__(self, table: str = LLM_CACHE_TABLE):
+        from .stores import supabase_client
+        self.sb = supabase_client()
+        self.table = table
+
+    def get_many(self, keys: List[str]) -> Dict[str, Dict[str, Any]]:
+        if not keys:
+            return {}
+        data = self.sb.table(self.table).select("key,items_json,tokens").in_("key", keys).execute().data
+        return {r["key"]: {"items": json.loads(r["items_json"]), "tokens": r.get("tokens") or 0} for r in data}
+
+    def put_many(self, model: str, entries: List[Tuple[str, List[Dict[str, Any]], int]]):
+        if not entries:
+            return
+        self.sb.table(self.table).upsert([{
+            "key": key,
+            "model": model,
+            "items_json": json.dumps(items, ensure_ascii=False),
+            "tokens": tokens,
+        } for key, items, tokens in entries], on_conflict="key").execute()
+
+class CacheStats:
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.tokens_saved = 0
+        self.lock = threading.Lock()
+
+    def hit(self, tokens: int, n: int = 1):
+        with self.lock:
+            self.hits += n
+            self.tokens_saved += tokens or 0
+
+    def miss(self, n: int = 1):
+        with self.lock:
+            self.misses += n
+
+    def as_dict(self) -> Dict[str, int]:
+        return {"hits": self.hits, "misses": self.misses, "tokens_saved": self.tokens_saved}
+
+    def __str__(self):
+        return f"LLM cache: {self.hits} candidate hit(s), {self.misses} miss(es), ~{self.tokens_saved} tokens saved"
+
+_cache = None
+
+def get_cache():
+    global _cache
+    if _cache is None and LLM_CACHE_BACKEND != "off":
+        _cache = SupabaseCache() if LLM_CACHE_BACKEND == "supabase" else SQLiteCache()
+    return _cache
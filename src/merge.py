@@ -1,5 +1,10 @@
 import re
+import json
+import math
+import bisect
+from functools import lru_cache
 from typing import Dict, Any, List, Tuple, Optional
+from .telemetry import traced, count
 
 METRIC_MAP = {
     "revenue": ["revenue", "sales", "top line"],
@@ -12,6 +17,10 @@ METRIC_MAP = {
     "arr": ["annual recurring revenue", "arr"],
 }
 
+# canon_* are pure and see the same few hundred metric / period / unit strings over and over,
+# so their results are memoized.
+
+@lru_cache(maxsize=65536)
 def canon_metric(s: str) -> str:
     if not s:
         return ""
@@ -21,6 +30,7 @@ def canon_metric(s: str) -> str:
             return k
     return t
 
+@lru_cache(maxsize=65536)
 def canon_period(period: str) -> Tuple[str, Optional[str], Optional[str]]:
     p = (period or "").strip()
     l = p.lower()
@@ -41,6 +51,7 @@ def canon_period(period: str) -> Tuple[str, Optional[str], Optional[str]]:
         period_type = "full year"
     return period_type, fy, q
 
+@lru_cache(maxsize=65536)
 def canon_units(units: Optional[str]) -> str:
     if not units:
         return ""
@@ -69,7 +80,9 @@ def close_enough(a: Optional[float], b: Optional[float], units: str) -> bool:
     denom = max(1.0, abs((a + b) / 2.0))
     return abs(a - b) / denom <= 0.01
 
-def merge_items(items_by_source: Dict[str, List[Dict[str, Any]]]) -> List[Dict[str, Any]]:
+def merge_items_pairwise(items_by_source: Dict[str, List[Dict[str, Any]]]) -> List[Dict[str, Any]]:
+    # Reference implementation: compares every candidate with every kept item of its bucket.
+    # merge_items returns exactly the same result; keep this one to check that.
     source_rank = {"press_release": 3, "presentation": 2, "transcript": 1}
     buckets: Dict[Tuple, List[Tuple[str, Dict[str, Any]]]] = {}
 
@@ -140,31 +153,217 @@ def merge_items(items_by_source: Dict[str, List[Dict[str, Any]]]) -> List[Dict[s
             it["period_type"] = pt
     return merged
 
+SOURCE_RANK = {"press_release": 3, "presentation": 2, "transcript": 1}
+PERIOD_TYPES = ("quarter", "full year")
+
+@lru_cache(maxsize=65536)
+def bucket_key(metric: Optional[str], period: Optional[str], period_type: Optional[str]) -> Tuple:
+    # (metric, period type, fiscal year, quarter) — the key items are merged under.
+    ptype = (period_type or "").lower().strip()
+    ptype2, fy, q = canon_period(period or "")
+    if ptype not in PERIOD_TYPES:
+        ptype = ptype2
+    return canon_metric(metric), ptype, fy, q
+
+def item_key(it: Dict[str, Any]) -> Tuple:
+    return bucket_key(it.get("metric", ""), it.get("period") or "", it.get("period_type"))
+
+def canon_values(it: Dict[str, Any]) -> Tuple[str, Optional[float], Optional[float]]:
+    units = canon_units(it.get("units"))
+    low = to_base(it.get("low_end"), units)
+    high = to_base(it.get("high_end"), units)
+    if low is None and high is not None:
+        low = high
+    if high is None and low is not None:
+        high = low
+    return units, low, high
+
+def _window(x: float, units: str) -> float:
+    # Generous bound on |a - b| for close_enough(a, b, units); candidates inside it are checked exactly.
+    if units == "percent":
+        return 0.2
+    if units == "eps":
+        return 0.02
+    return 0.03 * max(1.0, abs(x))
+
+def cluster_values(values: List[Tuple[str, Optional[float], Optional[float]]]) -> List[int]:
+    # `values` are one bucket's (units, low, high) in source-rank order. Returns, for every position, the
+    # position of the kept item it merges into (itself when kept): the first kept item, in kept order,
+    # with the same units and close lows and highs. Kept lows are indexed per unit in a sorted list, so
+    # each lookup bisects to the few kept items whose low can be close instead of scanning all of them.
+    index: Dict[str, Tuple[List[float], List[int]]] = {}
+    targets = []
+    for i, (units, low, high) in enumerate(values):
+        target = i
+        # None, NaN and infinite lows never compare close_enough, so they are never indexed or matched.
+        if low is not None and math.isfinite(low):
+            lows, ids = index.setdefault(units, ([], []))
+            w = _window(low, units)
+            best = None
+            for j in range(bisect.bisect_left(lows, low - w), bisect.bisect_right(lows, low + w)):
+                k = ids[j]
+                if (best is None or k < best) and close_enough(low, values[k][1], units) and close_enough(high, values[k][2], units):
+                    best = k
+            if best is None:
+                j = bisect.bisect_right(lows, low)
+                lows.insert(j, low)
+                ids.insert(j, i)
+            else:
+                target = best
+        targets.append(target)
+    return targets
+
+def _finish(it: Dict[str, Any]):
+    low = it.get("low_end")
+    high = it.get("high_end")
+    avg = None
+    if isinstance(low, (int, float)) and isinstance(high, (int, float)):
+        avg = (low + high) / 2.0
+    it["average"] = avg
+    if it.get("period_type") not in PERIOD_TYPES:
+        it["period_type"] = canon_period(it.get("period") or "")[0]
+
+@traced("merge.merge_items")
+def merge_items(items_by_source: Dict[str, List[Dict[str, Any]]]) -> List[Dict[str, Any]]:
+    # Same result as merge_items_pairwise: every item is canonicalized once and clustered through
+    # cluster_values. Candidates are ordered by source rank, so a kept item always outranks the items
+    # merged into it and keeps its own text and filing date.
+    buckets: Dict[Tuple, List[Tuple[str, Dict[str, Any]]]] = {}
+    for src, lst in items_by_source.items():
+        for it in (lst or []):
+            buckets.setdefault(item_key(it), []).append((src, it))
+
+    merged: List[Dict[str, Any]] = []
+    for candidates in buckets.values():
+        candidates.sort(key=lambda x: SOURCE_RANK.get(x[0], 0), reverse=True)
+        values = [canon_values(it) for _src, it in candidates]
+        kept: Dict[int, Dict[str, Any]] = {}
+        for i, ((src, it), (units, low, high), target) in enumerate(zip(candidates, values, cluster_values(values))):
+            if target != i:
+                kitem = kept[target]
+                kitem["provenance"] = sorted(set(kitem.get("provenance") or []) | set(it.get("provenance") or []))
+                continue
+            it = dict(it)
+            it["units"] = units
+            it["low_end"] = low
+            it["high_end"] = high
+            it.setdefault("provenance", [])
+            it["provenance"] = list(set(it["provenance"]))
+            it["source"] = src
+            kept[i] = it
+        if len(kept) > 1:
+            for it in kept.values():
+                it["note"] = "conflict"
+        merged.extend(kept.values())
+
+    for it in merged:
+        _finish(it)
+    return merged
+
+def row_items(row: Dict[str, Any]) -> List[Dict[str, Any]]:
+    # Items of a guidance_json row: already parsed in "items" (compact storage format) or a JSON string
+    # in text_content (plain format).
+    items = row.get("items")
+    if items is not None:
+        return items
+    try:
+        return json.loads(row.get("text_content") or "[]")
+    except Exception:
+        return []
+
+@traced("merge.merge_rows")
+def merge_rows(rows: List[Dict[str, Any]], ticker: Optional[str] = None) -> List[Dict[str, Any]]:
+    # Merges the items of guidance_json rows. Items keep their source (transcript when missing) and get
+    # the row's source_url appended to their provenance; `ticker` is stamped on every merged item.
+    by_src: Dict[str, List[Dict[str, Any]]] = {"press_release": [], "presentation": [], "transcript": []}
+    for r in rows:
+        for it in row_items(r):
+            src = it.get("source") or "transcript"
+            it.setdefault("provenance", [])
+            it["provenance"].append(r.get("source_url"))
+            by_src.setdefault(src, []).append(it)
+    count("merge.items_in", sum(len(v) for v in by_src.values()))
+    merged = merge_items(by_src)
+    if ticker:
+        for m in merged:
+            m["ticker"] = ticker
+    return merged
+
+def merge_frame(df, by=("ticker",)):
+    # Columnar merge of a long frame of guidance items (one row per item, with a "source" column and the
+    # item fields as columns). Rows are merged within each `by` group exactly as merge_items merges
+    # {source: items} built from the group's rows in frame order, NaN standing for a missing value.
+    # Returns the merged items as a frame in merge_items order, with the `by` columns carried along.
+    import numpy as np
+    import pandas as pd
+
+    def cell(v):
+        # NaN / NA are how frames spell a missing value; items spell it None.
+        return None if v is None or v is pd.NA or (isinstance(v, float) and v != v) else v
+
+    by = [c for c in by if c in df.columns]
+    df = df.reset_index(drop=True)
+    col = {c: [cell(v) for v in df[c]] for c in df.columns}
+    for c in ("metric", "period", "period_type", "units", "low_end", "high_end", "provenance", "note"):
+        col.setdefault(c, [None] * len(df))
+    if df.empty:
+        return pd.DataFrame({c: [] for c in list(col) + ["average"]})
+    group = df.groupby(by, sort=False, dropna=False).ngroup().to_numpy() if by else np.zeros(len(df), dtype=int)
+    src_order = df.groupby(by + ["source"], sort=False, dropna=False).ngroup().to_numpy()
+    keys = [bucket_key(m if m is not None else "", p or "", t) for m, p, t in zip(col["metric"], col["period"], col["period_type"])]
+    # Rows in {source: items} iteration order, then buckets numbered by first appearance in that order
+    # and ordered by source rank inside each bucket (both sorts are stable).
+    order = np.lexsort((np.arange(len(df)), src_order, group))
+    bucket_codes, _ = pd.factorize(pd.Series([(group[i],) + keys[i] for i in order], dtype=object))
+    bucket = np.empty(len(df), dtype=int)
+    bucket[order] = bucket_codes
+    rank = np.array([SOURCE_RANK.get(s, 0) for s in col["source"]], dtype=int)
+    order = order[np.lexsort((-rank[order], bucket[order]))]
+
+    units = [canon_units(u) for u in col["units"]]
+    low = [None if v is None else float(v) for v in col["low_end"]]
+    high = [None if v is None else float(v) for v in col["high_end"]]
+    for i in range(len(df)):
+        if low[i] is None and high[i] is not None:
+            low[i] = high[i]
+        if high[i] is None and low[i] is not None:
+            high[i] = low[i]
+
+    kept_rows: List[int] = []
+    provenance: Dict[int, List[Any]] = {}
+    note = list(col["note"])
+    starts = np.flatnonzero(np.r_[True, np.diff(bucket[order]) != 0])
+    for start, end in zip(starts, np.r_[starts[1:], len(order)]):
+        rows = order[start:end].tolist()
+        targets = cluster_values([(units[r], low[r], high[r]) for r in rows])
+        kept = []
+        for n, r in enumerate(rows):
+            if targets[n] == n:
+                provenance[r] = list(set(col["provenance"][r] or []))
+                kept.append(r)
+            else:
+                k = rows[targets[n]]
+                provenance[k] = sorted(set(provenance[k]) | set(col["provenance"][r] or []))
+        if len(kept) > 1:
+            for r in kept:
+                note[r] = "conflict"
+        kept_rows.extend(kept)
+
+    col.update(units=units, low_end=low, high_end=high, note=note)
+    col["provenance"] = [provenance.get(r) for r in range(len(df))]
+    col["period_type"] = [pt if pt in PERIOD_TYPES else canon_period(p or "")[0] for pt, p in zip(col["period_type"], col["period"])]
+    col["average"] = [(lo + hi) / 2.0 if lo is not None and hi is not None else None for lo, hi in zip(low, high)]
+    return pd.DataFrame({c: [v[r] for r in kept_rows] for c, v in col.items()})
+
 def bucketize(items_by_source: Dict[str, List[Dict[str, Any]]]) -> Dict[Tuple, List[Dict[str, Any]]]:
     buckets: Dict[Tuple, List[Dict[str, Any]]] = {}
     for src, lst in items_by_source.items():
         for it in (lst or []):
-            metric = canon_metric(it.get("metric", ""))
-            period = it.get("period") or ""
-            ptype = (it.get("period_type") or "").lower().strip()
-            if ptype not in ("quarter", "full year"):
-                ptype, fy, q = canon_period(period)
-            else:
-                ptype2, fy, q = canon_period(period)
-                if not it.get("period_type"):
-                    ptype = ptype2
-            units = canon_units(it.get("units"))
-            low = to_base(it.get("low_end"), units)
-            high = to_base(it.get("high_end"), units)
-            if low is None and high is not None:
-                low = high
-            if high is None and low is not None:
-                high = low
+            units, low, high = canon_values(it)
             item = dict(it)
             item["source"] = it.get("source") or src
             item["units"] = units
             item["low_end"] = low
             item["high_end"] = high
-            key = (metric, ptype, fy, q)
-            buckets.setdefault(key, []).append(item)
+            buckets.setdefault(item_key(it), []).append(item)
     return buckets
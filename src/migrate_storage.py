@@ -0,0 +1,85 @@
+# Rewrites earnings_files bodies into the plain or compact storage format (see STORE_FORMAT in
+# src/cloud_store.py), ticker by ticker. With STORE_FORMAT=compact readers handle rows in either format,
+# so switch to compact first (after adding the columns), then migrate; going back, migrate to plain
+# first, then switch. Compact rows whose candidates were mined by an older prefilter are re-mined. Usage:
+#   python -m src.migrate_storage --to compact [--tickers AAPL,MSFT] [--dry-run]
+#   python -m src.migrate_storage --to plain
+import sys
+import json
+import argparse
+from typing import List, Dict, Any, Optional
+from dotenv import load_dotenv
+
+load_dotenv()
+
+from .cloud_store import fetch_rows, upsert_rows, compact_body, plain_body, decompress_text, now_iso, FILES_CONFLICT  # noqa: E402
+from .prefilter import PREFILTER_VERSION  # noqa: E402
+from .retext import list_tickers  # noqa: E402
+
+KEYS = FILES_CONFLICT.split(",")
+
+def _size(row: Dict[str, Any]) -> int:
+    return sum(len(v) if isinstance(v, str) else len(json.dumps(v)) for c in ("text_content", "text_zip", "items", "candidates")
+               if (v := row.get(c)) is not None)
+
+def convert(row: Dict[str, Any], target: str) -> Optional[Dict[str, Any]]:
+    # Columns to write for `row` in the `target` format, or None if it is already there.
+    if target == "plain":
+        body = plain_body(row)
+    elif row.get("text_content") is not None:
+        body = compact_body(row["file_format"], row["text_content"])
+    elif row.get("text_zip") and (row.get("candidates") or {}).get("version") != PREFILTER_VERSION:
+        body = compact_body(row["file_format"], decompress_text(row["text_zip"]))
+    else:
+        body = {}
+    if not body:
+        return None
+    return {**{k: row[k] for k in KEYS}, **body, "updated_at": now_iso()}
+
+def migrate_ticker(ticker: str, target: str, dry_run: bool = False, batch: int = 200) -> Dict[str, Any]:
+    summary = {"rows": 0, "converted": 0, "bytes_before": 0, "bytes_after": 0, "failed": []}
+    for fmt in ("text", "json"):
+        rows = fetch_rows(ticker, file_format=fmt, columns="*")
+        out = []
+        for r in rows:
+            summary["rows"] += 1
+            try:
+                new = convert(r, target)
+            except Exception as e:
+                summary["failed"].append((ticker, r["year"], r["quarter"], r["file_type"], str(e)))
+                continue
+            if new is None:
+                continue
+            summary["converted"] += 1
+            summary["bytes_before"] += _size(r)
+            summary["bytes_after"] += _size({**r, **new})
+            out.append(new)
+        if not dry_run:
+            for i in range(0, len(out), batch):
+                upsert_rows(out[i:i + batch])
+    return summary
+
+def main(argv: Optional[List[str]] = None):
+    ap = argparse.ArgumentParser(prog="python -m src.migrate_storage", description="Convert stored text and guidance bodies between storage formats.")
+    ap.add_argument("--to", required=True, choices=["compact", "plain"], dest="target")
+    ap.add_argument("--tickers", help="Comma-separated tickers (default: every ticker folder in the bucket)")
+    ap.add_argument("--batch", type=int, default=200, help="Rows per bulk upsert")
+    ap.add_argument("--dry-run", action="store_true", help="Only report what would change")
+    args = ap.parse_args(argv)
+
+    tickers = [t.strip().upper() for t in args.tickers.split(",") if t.strip()] if args.tickers else list_tickers()
+    total = {"rows": 0, "converted": 0, "bytes_before": 0, "bytes_after": 0, "failed": []}
+    for t in tickers:
+        s = migrate_ticker(t, args.target, args.dry_run, args.batch)
+        for k in total:
+            total[k] += s[k]
+        print(f"[migrate] {t}: {s['converted']}/{s['rows']} row(s) {'to convert' if args.dry_run else 'converted'}, "
+              f"{s['bytes_before'] / 2 ** 20:.1f} MB -> {s['bytes_after'] / 2 ** 20:.1f} MB")
+    print(f"[migrate] {len(tickers)} ticker(s): {total['converted']}/{total['rows']} row(s), "
+          f"{total['bytes_before'] / 2 ** 20:.1f} MB -> {total['bytes_after'] / 2 ** 20:.1f} MB")
+    for ticker, year, quarter, ftype, err in total["failed"]:
+        print(f"[migrate] failed {ticker} {quarter} {year} {ftype}: {err}")
+    return 1 if total["failed"] else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,41 @@
+import os
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterable, Iterator, List, Dict, Any, Optional
+from .prefilter import iter_paragraphs, candidates_from_paragraphs
+
+PDF_WORKERS = int(os.getenv("PDF_WORKERS", "0")) or (os.cpu_count() or 1)
+
+def iter_pdf_pages(pdf_bytes: bytes) -> Iterator[str]:
+    # One page is decoded at a time; nothing holds the whole document's text.
+    import fitz  # PyMuPDF, imported on first use so importing this module stays cheap
+    with fitz.open(stream=pdf_bytes, filetype="pdf") as doc:
+        for page in doc:
+            yield page.get_text()
+
+def pdf_bytes_to_text(pdf_bytes: bytes) -> str:
+    return "\n".join(iter_pdf_pages(pdf_bytes)).strip()
+
+def iter_pdf_paragraphs(pdf_bytes: bytes) -> Iterator[str]:
+    return iter_paragraphs(iter_pdf_pages(pdf_bytes))
+
+def mine_pdf(pdf_bytes: bytes) -> List[Dict[str, Any]]:
+    return candidates_from_paragraphs(iter_pdf_paragraphs(pdf_bytes))
+
+_pool: Optional[ProcessPoolExecutor] = None
+
+def get_pdf_pool() -> ProcessPoolExecutor:
+    # Spawned workers: the parent runs threads (write-behind queue, Streamlit) that must not be forked.
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(max_workers=PDF_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+    return _pool
+
+def pdfs_to_texts(blobs: Iterable[bytes], processes: Optional[int] = None) -> List[str]:
+    blobs = list(blobs)
+    if (processes or PDF_WORKERS) <= 1 or len(blobs) <= 1:
+        return [pdf_bytes_to_text(b) for b in blobs]
+    if processes and processes != PDF_WORKERS:
+        with ProcessPoolExecutor(max_workers=processes, mp_context=multiprocessing.get_context("spawn")) as pool:
+            return list(pool.map(pdf_bytes_to_text, blobs))
+    return list(get_pdf_pool().map(pdf_bytes_to_text, blobs))
@@ -0,0 +1,334 @@
+# Streaming ingest → extract: backfill and extraction as one run whose stages overlap. Each quarter flows
+#   scrape (browser pages) → text (PDF parsing in the process pool, candidate mining) → extract (LLM requests)
+# through bounded queues, so the browser is already on the next quarter while the previous one is with the
+# model, and a slow stage holds the others back instead of piling up documents in memory. The text of a
+# freshly downloaded PDF goes straight to extraction instead of being read back from storage; PDF uploads
+# and earnings_files rows are written in the background (write-behind), guidance_json rows as each quarter
+# completes. Time to guidance for new tickers is then close to the slowest stage, not the sum. Usage:
+#   python -m src.pipeline --tickers AAPL,MSFT --start-year 2022 --end-year 2024 [--model gpt-4o-mini]
+import os
+import sys
+import time
+import asyncio
+import argparse
+from typing import List, Dict, Any, Optional, Tuple
+from .cloud_store import WriteBehindQueue, fetch_rows
+from .inventory import Inventory
+from .pdf_text import pdf_bytes_to_text, get_pdf_pool
+from .telemetry import span, count
+from .quartr_loader import (
+    HEADLESS,
+    SLOW_MO_MS,
+    LABELS,
+    SCRAPE_FAST,
+    latency_stats,
+    format_latency,
+    is_cloud_headless,
+    save_document,
+    ensure_text_row_from_existing_pdf,
+)
+from .backfill import BACKFILL_WORKERS, block_resources, login, scrape_quarter, work_units
+from .guidance import (
+    DEFAULT_MODEL,
+    EXTRACT_CONCURRENCY,
+    OPENAI_TPM,
+    QuarterWriter,
+    AsyncExtractor,
+    extract_documents,
+    extraction_version,
+    load_fingerprints,
+    make_document,
+    _unchanged,
+)
+from .batching import plan_requests
+
+# Quarters buffered between two stages; bounds memory when one stage is slower than the one feeding it.
+PIPELINE_QUEUE = int(os.getenv("PIPELINE_QUEUE", "4"))
+PIPELINE_TEXT_WORKERS = int(os.getenv("PIPELINE_TEXT_WORKERS", "2"))
+
+def _stored_texts(ticker: str, year: int, quarter: str, ftypes: List[str], prev: Optional[Dict[str, Any]],
+                  version: str) -> List[Dict[str, Any]]:
+    # Hashes first; bodies only for the file types whose text differs from the quarter's stored fingerprint
+    # `prev`, so incremental runs over quarters that are already extracted download no text.
+    meta = fetch_rows(ticker, file_format="text", periods=[(year, quarter)], columns="file_type,content_hash")
+    stale = sorted({r["file_type"] for r in meta if r["file_type"] in ftypes
+                    and not (r.get("content_hash") and _unchanged(prev, version, r["file_type"], r["content_hash"]))})
+    return [r for ftype in stale
+            for r in fetch_rows(ticker, file_type=ftype, file_format="text", periods=[(year, quarter)],
+                                columns="file_type,source_url,content_hash,text_content")]
+
+def format_time_to_guidance(stats: Dict[str, Any]) -> str:
+    if not stats.get("quarters"):
+        return "no guidance written"
+    return (f"{stats['quarters']} quarter(s) to guidance, mean {stats['mean']:.1f}s, "
+            f"p50 {stats['p50']:.1f}s, p90 {stats['p90']:.1f}s")
+
+class Pipeline:
+    def __init__(self, units: List[Tuple[str, int, str]], model: str, workers: int, concurrency: int,
+                 tokens_per_minute: Optional[int], incremental: bool, token_budget: Optional[int]):
+        self.units = units
+        self.model = model
+        self.version = extraction_version(model)
+        self.workers = workers
+        self.concurrency = concurrency
+        self.tokens_per_minute = tokens_per_minute
+        self.incremental = incremental
+        self.token_budget = token_budget
+        self.inventories: Dict[str, Inventory] = {}
+        self.existing: Dict[Tuple[str, int, str], Dict[str, Any]] = {}
+        self.summary: Dict[str, Any] = {"units": len(units), "unopened": 0, "saved": 0, "skipped": 0, "missing": 0, "failed": [],
+                                        "documents": 0, "requests": 0, "quarters": 0, "extract_failed": [],
+                                        "scrape_seconds": [], "guidance_seconds": [], "first_guidance": None}
+        self.started = time.perf_counter()
+        self.background: set = set()
+
+    async def _load(self, ticker: str, window: Dict[str, Any]):
+        inventory = await asyncio.to_thread(lambda: Inventory(ticker).load())
+        self.inventories[ticker] = inventory
+        if self.incremental:
+            existing = await asyncio.to_thread(load_fingerprints, ticker, **window)
+            self.existing.update({(ticker,) + k: v for k, v in existing.items()})
+
+    # ---- stage 1: scrape ----------------------------------------------------------------------------
+
+    async def _stored_pdfs(self, ticker: str, year: int, quarter: str) -> List[str]:
+        inv = self.inventories[ticker]
+        return [ftype for _label, ftype in LABELS if await asyncio.to_thread(inv.has_pdf, year, quarter, ftype)]
+
+    async def _feed_stored(self, units, out: asyncio.Queue):
+        # Quarters whose PDFs are all stored already need no browser; their stored text is extracted.
+        for ticker, year, quarter in units:
+            await out.put({"ticker": ticker, "year": year, "quarter": quarter, "started": time.perf_counter(),
+                           "pdfs": [], "stored": [ftype for _label, ftype in LABELS]})
+            self.summary["skipped"] += len(LABELS)
+
+    async def _scrape_quarter(self, page, ticker: str, year: int, quarter: str, state: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        bundle = {"ticker": ticker, "year": year, "quarter": quarter, "started": time.perf_counter(), "pdfs": []}
+
+        async def keep(ftype, label, data, url):
+            # Parsed and stored by the text stage.
+            bundle["pdfs"].append((ftype, data, url))
+
+        result = await scrape_quarter(page, state, self.inventories[ticker], ticker, year, quarter, keep)
+        bundle["stored"] = result["stored"]
+        self.summary["skipped"] += len(result["stored"])
+        if not result["opened"]:
+            self.summary["unopened"] += 1
+            return bundle if result["stored"] else None
+        self.summary["missing"] += len(result["missing"])
+        self.summary["scrape_seconds"].append(result["seconds"])
+        return bundle
+
+    async def _scrape_worker(self, browser, login_state, units: asyncio.Queue, out: asyncio.Queue):
+        ctx = await browser.new_context(accept_downloads=True, storage_state=login_state)
+        if SCRAPE_FAST:
+            await block_resources(ctx)
+        page = await ctx.new_page()
+        state: Dict[str, Any] = {}
+        try:
+            while True:
+                try:
+                    ticker, year, quarter = units.get_nowait()
+                except asyncio.QueueEmpty:
+                    return
+                try:
+                    bundle = await self._scrape_quarter(page, ticker, year, quarter, state)
+                except Exception as e:
+                    state.clear()
+                    self.summary["failed"].append((ticker, year, quarter, str(e)))
+                    print(f"[{ticker}] {quarter} {year} failed: {e}")
+                    continue
+                if bundle:
+                    # Blocks while the text stage is QUEUE quarters behind.
+                    await out.put(bundle)
+        finally:
+            await ctx.close()
+
+    async def _scrape(self, units, out: asyncio.Queue):
+        if not units:
+            return
+        from playwright.async_api import async_playwright
+        queue: asyncio.Queue = asyncio.Queue()
+        for u in units:
+            queue.put_nowait(u)
+        async with async_playwright() as p:
+            args = ["--no-sandbox", "--disable-dev-shm-usage"]
+            headless_flag = True if is_cloud_headless() else HEADLESS
+            browser = await p.chromium.launch(headless=headless_flag, slow_mo=SLOW_MO_MS, args=args)
+            try:
+                login_ctx = await browser.new_context()
+                if SCRAPE_FAST:
+                    await block_resources(login_ctx)
+                await login(await login_ctx.new_page())
+                login_state = await login_ctx.storage_state()
+                await login_ctx.close()
+                n = max(1, min(self.workers, len(units)))
+                await asyncio.gather(*[self._scrape_worker(browser, login_state, queue, out) for _ in range(n)])
+            finally:
+                await browser.close()
+
+    # ---- stage 2: text ------------------------------------------------------------------------------
+
+    async def _store(self, ticker, year, quarter, ftype, data, url, text, candidates, writer):
+        try:
+            await asyncio.to_thread(save_document, ticker, year, quarter, ftype, data, url,
+                                    self.inventories[ticker], writer, text, candidates)
+            self.summary["saved"] += 1
+        except Exception as e:
+            self.summary["failed"].append((ticker, year, quarter, f"{ftype}: storing failed: {e}"))
+
+    def _background(self, coro):
+        task = asyncio.create_task(coro)
+        self.background.add(task)
+        task.add_done_callback(self.background.discard)
+
+    async def _documents(self, bundle: Dict[str, Any], writer: WriteBehindQueue) -> List[Dict[str, Any]]:
+        ticker, year, quarter = bundle["ticker"], bundle["year"], bundle["quarter"]
+        docs = []
+        for ftype, data, url in bundle.pop("pdfs"):
+            # PyMuPDF parsing runs in the process pool so large decks neither block the event loop nor hold the GIL.
+            with span("pdf.to_text"):
+                text = await asyncio.get_running_loop().run_in_executor(get_pdf_pool(), pdf_bytes_to_text, data)
+            doc = await asyncio.to_thread(make_document, ticker, year, quarter, ftype, url, text)
+            # Storing overlaps with extraction; the text goes on from memory.
+            self._background(self._store(ticker, year, quarter, ftype, data, url, text, doc["candidates"], writer))
+            print(f"[{ticker}] Downloaded {ftype} ({quarter} {year})")
+            if text.strip():
+                docs.append(doc)
+        prev = self.existing.get((ticker, year, quarter))
+        if bundle["stored"]:
+            inv = self.inventories[ticker]
+            for ftype in bundle["stored"]:
+                await asyncio.to_thread(ensure_text_row_from_existing_pdf, ticker, year, quarter, ftype, inv)
+            for r in await asyncio.to_thread(_stored_texts, ticker, year, quarter, bundle["stored"], prev, self.version):
+                text = r.get("text_content") or ""
+                if text.strip():
+                    docs.append(await asyncio.to_thread(make_document, ticker, year, quarter, r["file_type"],
+                                                        r.get("source_url"), text, r.get("content_hash")))
+        return [d for d in docs if not _unchanged(prev, self.version, d["source"], d["content_hash"])]
+
+    async def _text_worker(self, inp: asyncio.Queue, out: asyncio.Queue, writer: WriteBehindQueue):
+        while True:
+            bundle = await inp.get()
+            if bundle is None:
+                return
+            try:
+                docs = await self._documents(bundle, writer)
+            except Exception as e:
+                self.summary["failed"].append((bundle["ticker"], bundle["year"], bundle["quarter"], f"text: {e}"))
+                continue
+            if docs:
+                await out.put((bundle, docs))
+
+    # ---- stage 3: extract ---------------------------------------------------------------------------
+
+    async def _extract_quarter(self, bundle, docs, extractor: AsyncExtractor, slots: asyncio.Semaphore):
+        try:
+            docs.sort(key=lambda d: d["source"])
+            writer = QuarterWriter(docs, self.version, self.existing)
+            requests = plan_requests(docs, self.token_budget)
+            await extract_documents(docs, requests, writer, extractor, self.summary["extract_failed"])
+            self.summary["documents"] += len(docs)
+            self.summary["requests"] += len(requests)
+            if writer.written:
+                self.summary["quarters"] += writer.written
+                self.summary["guidance_seconds"].append(time.perf_counter() - bundle["started"])
+                if self.summary["first_guidance"] is None:
+                    self.summary["first_guidance"] = time.perf_counter() - self.started
+                print(f"[{bundle['ticker']}] Guidance written ({bundle['quarter']} {bundle['year']})")
+        finally:
+            slots.release()
+
+    async def _extract(self, inp: asyncio.Queue):
+        extractor = AsyncExtractor(self.model, self.concurrency, self.tokens_per_minute)
+        # Quarters in extraction at once; their requests share the extractor's concurrency limit.
+        slots = asyncio.Semaphore(max(1, PIPELINE_QUEUE))
+        running = []
+        try:
+            while True:
+                item = await inp.get()
+                if item is None:
+                    break
+                await slots.acquire()
+                running.append(asyncio.create_task(self._extract_quarter(*item, extractor, slots)))
+            await asyncio.gather(*running)
+        finally:
+            await extractor.close()
+        count("guidance.documents", self.summary["documents"])
+
+    # ---- run ----------------------------------------------------------------------------------------
+
+    async def run(self, window: Dict[str, Any]) -> Dict[str, Any]:
+        tickers = sorted({u[0] for u in self.units})
+        await asyncio.gather(*[self._load(t, window) for t in tickers])
+        stored, to_scrape = [], []
+        for ticker, year, quarter in self.units:
+            full = len(await self._stored_pdfs(ticker, year, quarter)) == len(LABELS)
+            (stored if full else to_scrape).append((ticker, year, quarter))
+        texts: asyncio.Queue = asyncio.Queue(maxsize=max(1, PIPELINE_QUEUE))
+        extracts: asyncio.Queue = asyncio.Queue(maxsize=max(1, PIPELINE_QUEUE))
+        n_text = max(1, PIPELINE_TEXT_WORKERS)
+        writer = WriteBehindQueue()
+
+        async def produce():
+            try:
+                await asyncio.gather(self._feed_stored(stored, texts), self._scrape(to_scrape, texts))
+            finally:
+                for _ in range(n_text):
+                    await texts.put(None)
+
+        async def transform():
+            try:
+                await asyncio.gather(*[self._text_worker(texts, extracts, writer) for _ in range(n_text)])
+            finally:
+                await extracts.put(None)
+
+        try:
+            await asyncio.gather(produce(), transform(), self._extract(extracts))
+        finally:
+            if self.background:
+                await asyncio.gather(*list(self.background))
+            await asyncio.to_thread(writer.close)
+        # Only reached when nothing else failed; flush errors must not mask an exception from the run itself.
+        writer.check()
+        return self.summary
+
+def run_pipeline(tickers: List[str], start_year: int, end_year: int, start_q: str = 'Q1', end_q: str = 'Q4',
+                 model: Optional[str] = None, workers: Optional[int] = None, concurrency: Optional[int] = None,
+                 tokens_per_minute: Optional[int] = None, incremental: bool = True,
+                 token_budget: Optional[int] = None) -> Dict[str, Any]:
+    # With `incremental`, documents whose guidance is already stored for this model are not re-extracted.
+    units = work_units(tickers, start_year, end_year, start_q, end_q)
+    pipeline = Pipeline(units, model or DEFAULT_MODEL, workers or BACKFILL_WORKERS, concurrency or EXTRACT_CONCURRENCY,
+                        OPENAI_TPM if tokens_per_minute is None else tokens_per_minute, incremental, token_budget)
+    window = dict(start_year=start_year, end_year=end_year, start_q=start_q, end_q=end_q)
+    summary = asyncio.run(pipeline.run(window))
+    summary["latency"] = latency_stats(summary.pop("scrape_seconds"))
+    summary["time_to_guidance"] = latency_stats(summary.pop("guidance_seconds"))
+    summary["seconds"] = time.perf_counter() - pipeline.started
+    print(f"[pipeline] {format_latency(summary['latency'])}; {format_time_to_guidance(summary['time_to_guidance'])}")
+    return summary
+
+def main(argv: Optional[List[str]] = None):
+    ap = argparse.ArgumentParser(prog="python -m src.pipeline", description="Backfill from Quartr and extract guidance in one streaming run.")
+    ap.add_argument("--tickers", required=True)
+    ap.add_argument("--start-year", type=int, required=True)
+    ap.add_argument("--end-year", type=int, required=True)
+    ap.add_argument("--start-q", default="Q1")
+    ap.add_argument("--end-q", default="Q4")
+    ap.add_argument("--model", default=DEFAULT_MODEL)
+    ap.add_argument("--workers", type=int, help="Concurrent browser pages (default BACKFILL_WORKERS)")
+    ap.add_argument("--concurrency", type=int, help="Concurrent OpenAI requests (default EXTRACT_CONCURRENCY)")
+    ap.add_argument("--full", action="store_true", help="Re-extract documents whose guidance is already stored")
+    args = ap.parse_args(argv)
+    tickers = [t.strip().upper() for t in args.tickers.split(",") if t.strip()]
+    summary = run_pipeline(tickers, args.start_year, args.end_year, args.start_q, args.end_q, args.model,
+                           args.workers, args.concurrency, incremental=not args.full)
+    for ticker, year, quarter, err in summary["failed"]:
+        print(f"[{ticker}] {quarter} {year} failed: {err}")
+    for ticker, year, quarter, src, err in summary["extract_failed"]:
+        print(f"[{ticker}] {quarter} {year} {src}: extraction failed: {err}")
+    return 1 if summary["failed"] or summary["extract_failed"] else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
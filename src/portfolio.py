@@ -0,0 +1,134 @@
+# Portfolio (cross-ticker) merged guidance: one paged query for every ticker's guidance_json rows,
+# blob parsing and merging per ticker in a process pool, one combined table. Usage:
+#   python -m src.portfolio --tickers AAPL,MSFT,NVDA --start-year 2022 --end-year 2024 --out sector.parquet
+#   python -m src.portfolio --watchlist semis.txt --start-year 2022 --end-year 2024 --out semis.csv
+import io
+import os
+import re
+import sys
+import argparse
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Dict, Any, Optional
+import pandas as pd
+from .cloud_store import fetch_rows
+from .merge import merge_rows
+
+PORTFOLIO_WORKERS = int(os.getenv("PORTFOLIO_WORKERS", "0")) or (os.cpu_count() or 1)
+# Spawning workers costs about a second; below this much JSON the merge runs in-process.
+POOL_MIN_BYTES = int(os.getenv("PORTFOLIO_POOL_MIN_BYTES", str(16 * 1024 * 1024)))
+COLUMNS = ["Ticker", "Metric", "Value of guide", "Period", "Period type", "Low end of guidance",
+           "High end of guidance", "Average", "Filing date", "Source", "Conflict"]
+
+def parse_tickers(text: str) -> List[str]:
+    # Accepts commas, whitespace or one ticker per line; '#' starts a comment. Order kept, duplicates dropped.
+    out: List[str] = []
+    for line in (text or "").splitlines():
+        for t in re.split(r"[,\s;]+", line.split("#", 1)[0]):
+            t = t.strip().upper()
+            if t and t not in out:
+                out.append(t)
+    return out
+
+def load_watchlist(path: str) -> List[str]:
+    with open(path, encoding="utf-8") as fh:
+        return parse_tickers(fh.read())
+
+def fetch_guidance(tickers: List[str], start_year: Optional[int] = None, end_year: Optional[int] = None,
+                   start_q: str = 'Q1', end_q: str = 'Q4') -> Dict[str, List[Dict[str, Any]]]:
+    rows = fetch_rows(tickers, file_type="guidance_json", file_format="json",
+                      columns="ticker,year,quarter,source_url,text_content",
+                      start_year=start_year, end_year=end_year, start_q=start_q, end_q=end_q)
+    by_ticker: Dict[str, List[Dict[str, Any]]] = {t.upper(): [] for t in tickers}
+    for r in rows:
+        by_ticker.setdefault(r["ticker"], []).append(r)
+    return by_ticker
+
+_pool: Optional[ProcessPoolExecutor] = None
+
+def get_merge_pool() -> ProcessPoolExecutor:
+    # Kept for the life of the process, so Streamlit reruns do not pay the spawn again.
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(max_workers=PORTFOLIO_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+    return _pool
+
+def merge_portfolio(tickers: List[str], start_year: Optional[int] = None, end_year: Optional[int] = None,
+                    start_q: str = 'Q1', end_q: str = 'Q4', processes: Optional[int] = None) -> List[Dict[str, Any]]:
+    # Returns merged items of every ticker (each with a "ticker" key), in the order the tickers were given.
+    by_ticker = fetch_guidance(tickers, start_year, end_year, start_q, end_q)
+    work = [(t, rows) for t, rows in by_ticker.items() if rows]
+    # Compact-format rows arrive parsed; their items count at roughly 200 bytes each.
+    size = sum(len(r.get("text_content") or "") or 200 * len(r.get("items") or []) for _, rows in work for r in rows)
+    processes = min(processes or PORTFOLIO_WORKERS, len(work))
+    if processes <= 1 or size < POOL_MIN_BYTES:
+        results = [merge_rows(rows, t) for t, rows in work]
+    elif processes == PORTFOLIO_WORKERS:
+        # JSON parsing and merging are pure-Python CPU work; workers receive the raw blobs.
+        results = list(get_merge_pool().map(merge_rows, [rows for _, rows in work], [t for t, _ in work]))
+    else:
+        with ProcessPoolExecutor(max_workers=processes, mp_context=multiprocessing.get_context("spawn")) as pool:
+            results = list(pool.map(merge_rows, [rows for _, rows in work], [t for t, _ in work]))
+    return [m for merged in results for m in merged]
+
+def to_frame(merged: List[Dict[str, Any]]) -> pd.DataFrame:
+    return pd.DataFrame([{
+        "Ticker": m.get("ticker"),
+        "Metric": m.get("metric"),
+        "Value of guide": m.get("guidance_value_text"),
+        "Period": m.get("period"),
+        "Period type": m.get("period_type"),
+        "Low end of guidance": m.get("low_end"),
+        "High end of guidance": m.get("high_end"),
+        "Average": m.get("average"),
+        "Filing date": m.get("filing_date"),
+        "Source": m.get("source"),
+        "Conflict": m.get("note") == "conflict",
+    } for m in merged], columns=COLUMNS)
+
+def to_csv_bytes(df: pd.DataFrame) -> bytes:
+    return df.to_csv(index=False).encode("utf-8")
+
+def to_parquet_bytes(df: pd.DataFrame) -> Optional[bytes]:
+    # Parquet needs pyarrow (installed with streamlit); None when it is unavailable.
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        return None
+    buf = io.BytesIO()
+    df.to_parquet(buf, index=False)
+    return buf.getvalue()
+
+def main(argv: Optional[List[str]] = None):
+    ap = argparse.ArgumentParser(prog="python -m src.portfolio", description="Merged guidance table across many tickers.")
+    ap.add_argument("--tickers", help="Comma-separated tickers")
+    ap.add_argument("--watchlist", help="File with tickers (commas, spaces or one per line)")
+    ap.add_argument("--start-year", type=int)
+    ap.add_argument("--end-year", type=int)
+    ap.add_argument("--start-q", default="Q1", choices=["Q1", "Q2", "Q3", "Q4"])
+    ap.add_argument("--end-q", default="Q4", choices=["Q1", "Q2", "Q3", "Q4"])
+    ap.add_argument("--processes", type=int, default=PORTFOLIO_WORKERS, help="Merge processes")
+    ap.add_argument("--out", required=True, help="Output file (.csv or .parquet)")
+    args = ap.parse_args(argv)
+
+    if (args.start_year is None) != (args.end_year is None):
+        ap.error("--start-year and --end-year go together")
+    tickers = parse_tickers(args.tickers or "") + (load_watchlist(args.watchlist) if args.watchlist else [])
+    tickers = list(dict.fromkeys(tickers))
+    if not tickers:
+        ap.error("give --tickers and/or --watchlist")
+    df = to_frame(merge_portfolio(tickers, args.start_year, args.end_year, args.start_q, args.end_q, args.processes))
+    if args.out.endswith(".parquet"):
+        data = to_parquet_bytes(df)
+        if data is None:
+            print("[portfolio] Parquet export needs pyarrow; install it or write a .csv")
+            return 1
+    else:
+        data = to_csv_bytes(df)
+    with open(args.out, "wb") as fh:
+        fh.write(data)
+    print(f"[portfolio] {len(df)} row(s) for {df['Ticker'].nunique()} ticker(s) -> {args.out}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,5 +1,10 @@
 import re
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Iterable, Iterator, Optional
+from .telemetry import traced
+
+# Stored candidates (compact storage format) are reused while they carry this version. Bump it whenever
+# a change makes mine_candidates or try_iso_date_from_text return something different.
+PREFILTER_VERSION = "1"
 
 GUIDANCE_RGX = re.compile(
     r"(guidance|outlook|forecast|expect|expects|we\s+expect|we\s+forecast|full\s+year|FY\d{2,4}|Q[1-4]\s*(?:FY)?\d{2,4}|quarterly\s+outlook)",
@@ -25,13 +30,37 @@ METRIC_DICT = {
     "arr": ["arr", "annual recurring revenue"],
 }
 
-def guess_metric(text: str) -> str:
-    t = text.lower()
-    for k, alts in METRIC_DICT.items():
-        if any(a in t for a in alts):
-            return k
+# Case-sensitive twins of the patterns above, for lower-cased text. On ASCII paragraphs they match
+# exactly the same spans as the re.I originals, and are far cheaper to run (no case folding per char).
+GUIDANCE_LC = re.compile(
+    r"(guidance|outlook|forecast|expect|expects|we\s+expect|we\s+forecast|full\s+year|fy\d{2,4}|q[1-4]\s*(?:fy)?\d{2,4}|quarterly\s+outlook)"
+)
+NUMBER_LC = re.compile(
+    r"(\$?\s?\d[\d,]*(?:\.\d+)?\s*(?:billion|bn|million|m|percent|%|bps|basis points|eps|dollars)?)"
+)
+PERIOD_LC = re.compile(
+    r"(q[1-4]\s*(?:fy)?\d{2,4}|fy\s?\d{2,4}|fy\d{2}|full\s+year\s+\d{4}|full\s+year)"
+)
+SAFE_HARBOR = ("safe harbor", "forward-looking statements")
+
+# Alias lookup on already lower-cased text. A combined alternation (or a lookahead automaton) over
+# the vocabulary measured slower in `re` than C substring search over these few aliases.
+_METRIC_ALIASES = tuple((k, tuple(alts)) for k, alts in METRIC_DICT.items())
+
+def metric_from_lower(t: str) -> str:
+    for k, alts in _METRIC_ALIASES:
+        for a in alts:
+            if a in t:
+                return k
     return ""
 
+def guess_metric(text: str) -> str:
+    return metric_from_lower(text.lower())
+
+RANGE_SPLIT = re.compile(r"\s*(?:to|-|–|—|~)\s*")
+NON_NUMERIC = re.compile(r"[^\d.]")
+M_WORD = re.compile(r"\bm\b")
+
 def normalize_value_span(s: str):
     t = s.lower().replace(",", "").strip()
     units = None
@@ -41,11 +70,11 @@ def normalize_value_span(s: str):
         units = "USD"
     elif "%" in t or "percent" in t:
         units = "percent"
-    rng = re.split(r"\s*(?:to|-|–|—|~)\s*", t)
+    rng = RANGE_SPLIT.split(t)
     def as_num(x):
         x = x.replace("about", "").replace("approx", "").replace("$", "").strip()
         mult = 1.0
-        x_clean = re.sub(r"[^\d.]", "", x)
+        x_clean = NON_NUMERIC.sub("", x)
         return float(x_clean) if x_clean else None
     if len(rng) == 2:
         low, high = as_num(rng[0]), as_num(rng[1])
@@ -57,44 +86,98 @@ def normalize_value_span(s: str):
             low *= 1e9
         if high is not None and ("billion" in t or "bn" in t):
             high *= 1e9
-        if low is not None and ("million" in t or re.search(r"\bm\b", t)):
+        if low is not None and ("million" in t or M_WORD.search(t)):
             low *= 1e6
-        if high is not None and ("million" in t or re.search(r"\bm\b", t)):
+        if high is not None and ("million" in t or M_WORD.search(t)):
             high *= 1e6
     return units, low, high
 
+PARA_BREAK = re.compile(r"\n{2,}")
+
+# " ".join(p.split()) is re.sub(r"\s+", " ", p).strip(): str.split() and \s use the same whitespace set.
 def split_paragraphs(text: str) -> List[str]:
-    parts = re.split(r"\n{2,}", text)
-    return [re.sub(r"\s+", " ", p).strip() for p in parts if p.strip()]
+    parts = PARA_BREAK.split(text)
+    return [" ".join(p.split()) for p in parts if p.strip()]
 
-def prefilter(text: str) -> List[str]:
-    paras = split_paragraphs(text)
-    kept = []
+def iter_paragraphs(chunks: Iterable[str]) -> Iterator[str]:
+    # Streaming split_paragraphs over "\n".join(chunks) (e.g. PDF pages): yields the same paragraphs
+    # while holding only the unfinished tail of the text.
+    tail = None
+    for chunk in chunks:
+        tail = chunk if tail is None else tail + "\n" + chunk
+        parts = PARA_BREAK.split(tail)
+        tail = parts.pop()
+        for p in parts:
+            if p.strip():
+                yield " ".join(p.split())
+    if tail and tail.strip():
+        yield " ".join(tail.split())
+
+def scan_paragraph(p: str):
+    # Single pass over one paragraph: lower-cases it once and runs each pattern at most once.
+    # Returns None when prefilter would drop the paragraph, else (lowered text, number span, period span).
+    if p.isascii():
+        t = p.lower()
+        num_m = NUMBER_LC.search(t)
+        if not num_m and not GUIDANCE_LC.search(t):
+            return None
+        if SAFE_HARBOR[0] in t or SAFE_HARBOR[1] in t:
+            return None
+        period_m = PERIOD_LC.search(t)
+    else:
+        # Unicode case folding can change lengths and matches; keep the re.I patterns on the raw text.
+        num_m = NUMBER_SPAN.search(p)
+        if not num_m and not GUIDANCE_RGX.search(p):
+            return None
+        t = p.lower()
+        if SAFE_HARBOR[0] in t or SAFE_HARBOR[1] in t:
+            return None
+        period_m = PERIOD_RGX.search(p)
+    return t, (num_m.span(1) if num_m else None), (period_m.span(0) if period_m else None)
+
+def filter_paragraphs(paras: Iterable[str]) -> Iterator[str]:
     for p in paras:
-        if GUIDANCE_RGX.search(p) or NUMBER_SPAN.search(p):
-            if "safe harbor" in p.lower() or "forward-looking statements" in p.lower():
-                continue
-            kept.append(p)
-    return kept
+        if scan_paragraph(p) is not None:
+            yield p
 
-def mine_candidates(text: str) -> List[Dict[str, Any]]:
-    kept = prefilter(text)
+def prefilter(text: str) -> List[str]:
+    return list(filter_paragraphs(split_paragraphs(text)))
+
+def candidates_from_paragraphs(paras: Iterable[str]) -> List[Dict[str, Any]]:
     cands = []
-    for p in kept:
-        metric = guess_metric(p)
-        period_m = PERIOD_RGX.search(p)
-        num_m = NUMBER_SPAN.search(p)
-        if not (period_m or num_m):
+    for p in paras:
+        scan = scan_paragraph(p)
+        if scan is None:
+            continue
+        t, num_span, period_span = scan
+        if not (period_span or num_span):
             continue
-        guidance_value_text = num_m.group(1) if num_m else ""
+        guidance_value_text = p[num_span[0]:num_span[1]] if num_span else ""
         units, low, high = normalize_value_span(guidance_value_text) if guidance_value_text else (None, None, None)
         cands.append({
-            "metric": metric,
+            "metric": metric_from_lower(t),
             "guidance_value_text": guidance_value_text.strip(),
             "low_end": low,
             "high_end": high,
             "units": units,
-            "period": period_m.group(0) if period_m else "",
+            "period": p[period_span[0]:period_span[1]] if period_span else "",
             "context": p[:800],
         })
     return cands
+
+@traced("prefilter.mine_candidates")
+def mine_candidates(text: str) -> List[Dict[str, Any]]:
+    return candidates_from_paragraphs(split_paragraphs(text))
+
+def try_iso_date_from_text(text: str) -> Optional[str]:
+    m = re.search(r'(January|February|March|April|May|June|July|August|September|October|November|December)\s+([12]?\d|3[01]),\s+(20\d{2})', text)
+    if not m:
+        return None
+    month_map = {m: i for i, m in enumerate([
+        "January","February","March","April","May","June",
+        "July","August","September","October","November","December"
+    ], start=1)}
+    month = month_map[m.group(1)]
+    day = int(m.group(2))
+    year = int(m.group(3))
+    return f"{year:04d}-{month:02d}-{day:02d}"
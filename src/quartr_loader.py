@@ -1,8 +1,13 @@
 import os
+import re
+import math
+from typing import List, Dict, Any
+from urllib.parse import urlsplit
 from dotenv import load_dotenv
-from playwright.sync_api import sync_playwright, TimeoutError as PWTimeoutError
-import fitz  # PyMuPDF
-from .cloud_store import path_for, file_exists, upload_pdf, upsert_row, fetch_rows, download_pdf
+from .cloud_store import path_for, upload_pdf, upsert_row, upsert_rows, file_row, download_pdf
+from .inventory import Inventory
+from .pdf_text import pdf_bytes_to_text
+from .telemetry import span
 
 load_dotenv()
 
@@ -10,6 +15,22 @@ EMAIL = os.getenv("QUARTR_EMAIL")
 PASSWORD = os.getenv("QUARTR_PASSWORD")
 HEADLESS = os.getenv("HEADLESS", "1") == "1"
 SLOW_MO_MS = int(os.getenv("SLOW_MO_MS", "0"))
+# Fast navigation: wait for the element or API response a step depends on instead of fixed sleeps and
+# networkidle, and block images, fonts, media and analytics. SCRAPE_FAST=0 restores the old waits.
+SCRAPE_FAST = os.getenv("SCRAPE_FAST", "1") == "1"
+SCRAPE_TIMEOUT_MS = int(os.getenv("SCRAPE_TIMEOUT_MS", "15000"))
+# Upper bound for waits that may legitimately see nothing, e.g. a quarter without documents.
+SCRAPE_SETTLE_MS = int(os.getenv("SCRAPE_SETTLE_MS", "3000"))
+BLOCK_RESOURCES = {t.strip() for t in os.getenv("SCRAPE_BLOCK", "image,font,media").split(",") if t.strip()}
+BLOCK_HOSTS = (
+    "google-analytics.com", "googletagmanager.com", "doubleclick.net", "segment.io", "segment.com",
+    "hotjar.com", "intercom.io", "intercomcdn.com", "sentry.io", "mixpanel.com", "amplitude.com",
+    "facebook.net", "hs-scripts.com", "hubspot.com", "clarity.ms",
+)
+# URL path of the API call that loads a quarter's documents; other XHR/fetch traffic (analytics, polling)
+# does not count as the quarter having loaded.
+SCRAPE_DOCS_API = re.compile(os.getenv("SCRAPE_DOCS_API", r"/(?:events?|documents?)(?:[/?]|$)"), re.I)
+LOGIN_URL = "https://quartr.com/login"
 
 def is_cloud_headless():
     # If no X server (no DISPLAY), force headless to avoid runtime crash on Streamlit Cloud
@@ -24,94 +45,81 @@ LABELS = [
     ("Presentation", "presentation"),
 ]
 
-def pdf_bytes_to_text(pdf_bytes: bytes) -> str:
-    with fitz.open(stream=pdf_bytes, filetype="pdf") as doc:
-        return "\n".join(page.get_text() for page in doc).strip()
-
-def login(page):
-    page.goto("https://quartr.com/login", wait_until="networkidle")
-    page.wait_for_timeout(500)
-    page.get_by_placeholder("Email").fill(EMAIL)
-    page.get_by_placeholder("Password").fill(PASSWORD)
-    page.get_by_role("button", name="Log in").click()
-    page.wait_for_load_state("networkidle")
-
-def open_company(page, ticker: str):
-    page.get_by_placeholder("Search").click()
-    page.get_by_placeholder("Search").fill(ticker)
-    page.keyboard.press("Enter")
-    page.wait_for_timeout(1200)
-    page.get_by_text(ticker.upper(), exact=False).first.click()
-    page.wait_for_load_state("networkidle")
-
-def open_quarter(page, year: int, quarter: str) -> bool:
-    patterns = [f"{quarter} {year}", f"{quarter} FY{year}", f"{quarter} {str(year)[-2:]}"]
-    for pat in patterns:
-        loc = page.get_by_text(pat, exact=False)
-        if loc.count():
-            loc.first.click()
-            page.wait_for_load_state("networkidle")
-            page.wait_for_timeout(600)
-            return True
-    return False
-
-def download_label(page, label_text: str):
-    locator = page.get_by_text(label_text, exact=False).first
-    if not locator or not locator.count():
-        return None, None
-    try:
-        with page.expect_download() as dl_info:
-            locator.click()
-        dl = dl_info.value
-        return dl.read(), dl.url
-    except PWTimeoutError:
-        return None, None
-
-def ensure_text_row_from_existing_pdf(ticker: str, year: int, quarter: str, ftype: str):
-    rows = fetch_rows(ticker, file_type=ftype, file_format="text")
-    has_text = any(r["year"] == year and r["quarter"] == quarter for r in rows)
-    if has_text:
+QUARTER_RGX = re.compile(r"\bQ[1-4]\b")
+LABEL_RGX = re.compile("|".join(re.escape(label) for label, _ in LABELS))
+
+def should_block(resource_type: str, url: str) -> bool:
+    host = urlsplit(url).hostname or ""
+    return resource_type in BLOCK_RESOURCES or any(host == h or host.endswith("." + h) for h in BLOCK_HOSTS)
+
+def is_documents_response(response) -> bool:
+    host = urlsplit(response.url).hostname or ""
+    return (response.request.resource_type in ("xhr", "fetch") and (host == "quartr.com" or host.endswith(".quartr.com"))
+            and bool(SCRAPE_DOCS_API.search(urlsplit(response.url).path)))
+
+def latency_stats(samples: List[float]) -> Dict[str, Any]:
+    if not samples:
+        return {"quarters": 0}
+    s = sorted(samples)
+    pick = lambda q: s[max(0, math.ceil(q * len(s)) - 1)]
+    return {"quarters": len(s), "mean": sum(s) / len(s), "p50": pick(0.5), "p90": pick(0.9), "max": s[-1]}
+
+def format_latency(stats: Dict[str, Any]) -> str:
+    if not stats.get("quarters"):
+        return "no quarters scraped"
+    return (f"{stats['quarters']} quarter(s) scraped, mean {stats['mean']:.1f}s, "
+            f"p50 {stats['p50']:.1f}s, p90 {stats['p90']:.1f}s")
+
+def iter_quarters(start_year: int, end_year: int, start_q: str = 'Q1', end_q: str = 'Q4'):
+    for year in range(start_year, end_year + 1):
+        q_start = QMAP[start_q] if year == start_year else 1
+        q_end = QMAP[end_q] if year == end_year else 4
+        for qi in range(q_start, q_end + 1):
+            yield year, f"Q{qi}"
+
+def ensure_text_row_from_existing_pdf(ticker: str, year: int, quarter: str, ftype: str, inventory: Inventory):
+    if inventory.has_text(year, quarter, ftype):
         return
     key = path_for(ticker, year, quarter, ftype)
-    if file_exists(key):
+    if inventory.has_pdf(year, quarter, ftype):
         pdf_bytes = download_pdf(key)
         if pdf_bytes:
-            text = pdf_bytes_to_text(pdf_bytes)
+            with span("pdf.to_text"):
+                text = pdf_bytes_to_text(pdf_bytes)
             upsert_row(ticker, year, quarter, ftype, "text", None, None, text)
+            inventory.mark(year, quarter, ftype, "text")
+
+def save_document(ticker: str, year: int, quarter: str, ftype: str, pdf_bytes: bytes, url: str = None,
+                  inventory: Inventory = None, writer=None, text: str = None, candidates=None) -> str:
+    # With a WriteBehindQueue as `writer`, the two rows are queued instead of upserted inline.
+    # `text` may be precomputed (e.g. in the PDF process pool), and so may its mined `candidates`.
+    key = upload_pdf(ticker, year, quarter, ftype, pdf_bytes)
+    if text is None:
+        with span("pdf.to_text"):
+            text = pdf_bytes_to_text(pdf_bytes)
+    rows = [
+        file_row(ticker, year, quarter, ftype, "pdf", key, url or None, None),
+        file_row(ticker, year, quarter, ftype, "text", None, url or None, text, candidates=candidates),
+    ]
+    if writer is not None:
+        for r in rows:
+            writer.put_row(r)
+    else:
+        upsert_rows(rows)
+    if inventory is not None:
+        inventory.mark(year, quarter, ftype, "pdf")
+        inventory.mark(year, quarter, ftype, "text")
+    return key
+
+def stored_quarter(inventory: Inventory, year: int, quarter: str) -> bool:
+    # Every document of the quarter is already stored: no need to navigate to it at all.
+    if not all(inventory.has_pdf(year, quarter, ftype) for _label, ftype in LABELS):
+        return False
+    for _label, ftype in LABELS:
+        ensure_text_row_from_existing_pdf(inventory.ticker, year, quarter, ftype, inventory)
+    return True
 
 def load_company_years(ticker: str, start_year: int, end_year: int, start_q: str = 'Q1', end_q: str = 'Q4'):
-    with sync_playwright() as p:
-        args = ["--no-sandbox", "--disable-dev-shm-usage"]
-        headless_flag = True if is_cloud_headless() else HEADLESS
-        browser = p.chromium.launch(headless=headless_flag, slow_mo=SLOW_MO_MS, args=args)
-        ctx = browser.new_context(accept_downloads=True)
-        page = ctx.new_page()
-        login(page)
-        open_company(page, ticker)
-
-        for year in range(start_year, end_year + 1):
-            q_start = QMAP[start_q] if year == start_year else 1
-            q_end = QMAP[end_q] if year == end_year else 4
-            for qi in range(q_start, q_end + 1):
-                quarter = f"Q{qi}"
-                if not open_quarter(page, year, quarter):
-                    print(f"[{ticker}] Skip: could not open {quarter} {year}")
-                    continue
-                for label, ftype in LABELS:
-                    storage_path = path_for(ticker, year, quarter, ftype)
-                    if file_exists(storage_path):
-                        print(f"[{ticker}] {quarter} {year} — {label}: already exists, skipping download")
-                        ensure_text_row_from_existing_pdf(ticker, year, quarter, ftype)
-                        continue
-                    b, url = download_label(page, label)
-                    if not b:
-                        print(f"[{ticker}] {quarter} {year} — {label}: not available")
-                        continue
-                    key = upload_pdf(ticker, year, quarter, ftype, b)
-                    text = pdf_bytes_to_text(b)
-                    upsert_row(ticker, year, quarter, ftype, "pdf", key, url or None, None)
-                    upsert_row(ticker, year, quarter, ftype, "text", None, url or None, text)
-                    print(f"[{ticker}] Saved {label} PDF & TEXT ({quarter} {year})")
-
-        ctx.close()
-        browser.close()
+    # Single-ticker backfill; the browser steps (login, company, quarter, download) live in src/backfill.py.
+    from .backfill import backfill
+    return backfill([ticker], start_year, end_year, start_q, end_q, workers=1)
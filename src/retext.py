@@ -0,0 +1,117 @@
+# Headless re-text of stored PDFs: rebuilds `text` rows from pdfs/{TICKER}/{YEAR}-{Q}/*.pdf
+# without a browser or Quartr login. Usage:
+#   python -m src.retext --tickers AAPL,MSFT --start-year 2020 --end-year 2024 --workers 16
+import re
+import sys
+import argparse
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from typing import List, Dict, Any, Optional, Tuple
+from dotenv import load_dotenv
+
+load_dotenv()
+
+from .cloud_store import list_files, download_pdf, fetch_rows, file_row, upsert_rows, in_window  # noqa: E402
+from .pdf_text import pdf_bytes_to_text, PDF_WORKERS  # noqa: E402
+
+FILE_TYPES = ["transcript", "press_release", "presentation"]
+FOLDER_RGX = re.compile(r"^(\d{4})-(Q[1-4])$")
+
+Doc = Tuple[str, int, str, str, str]  # (ticker, year, quarter, file_type, storage_path)
+
+def list_tickers() -> List[str]:
+    return sorted(e["name"] for e in list_files("pdfs") if e.get("name") and not e.get("id"))
+
+def list_ticker_documents(ticker: str, start_year: Optional[int] = None, end_year: Optional[int] = None,
+                          start_q: str = 'Q1', end_q: str = 'Q4', file_types: Optional[List[str]] = None) -> List[Doc]:
+    docs = []
+    for folder in list_files(f"pdfs/{ticker}"):
+        m = FOLDER_RGX.match(folder.get("name") or "")
+        if not m:
+            continue
+        year, quarter = int(m.group(1)), m.group(2)
+        # Same window as fetch_rows: a single-year window covers only start_q..end_q of that year.
+        if start_year is not None and end_year is not None and not in_window(year, quarter, start_year, end_year, start_q, end_q):
+            continue
+        for f in list_files(f"pdfs/{ticker}/{folder['name']}"):
+            name = f.get("name") or ""
+            ftype = name[:-4] if name.endswith(".pdf") else None
+            if ftype in (file_types or FILE_TYPES):
+                docs.append((ticker, year, quarter, ftype, f"pdfs/{ticker}/{folder['name']}/{name}"))
+    return docs
+
+def _source_urls(ticker: str, periods: List[Tuple[int, str]]) -> Dict[Tuple[int, str, str], Optional[str]]:
+    # Re-texting must not clear the source_url the loader stored with the text row.
+    rows = fetch_rows(ticker, file_format="text", columns="year,quarter,file_type,source_url", periods=periods)
+    return {(r["year"], r["quarter"], r["file_type"]): r.get("source_url") for r in rows}
+
+def retext(docs: List[Doc], workers: int = 16, processes: int = PDF_WORKERS, batch: int = 64) -> Dict[str, Any]:
+    # Downloads of the next batch overlap with PDF parsing of the current one; each batch is one bulk upsert.
+    summary: Dict[str, Any] = {"documents": len(docs), "written": 0, "failed": []}
+    urls: Dict[str, Dict] = {}
+    periods: Dict[str, set] = {}
+    for d in docs:
+        periods.setdefault(d[0], set()).add((d[1], d[2]))
+    batches = [docs[i:i + batch] for i in range(0, len(docs), batch)]
+    with ThreadPoolExecutor(max_workers=workers) as dl, \
+            ProcessPoolExecutor(max_workers=max(1, processes), mp_context=multiprocessing.get_context("spawn")) as pp:
+        pending = [dl.submit(download_pdf, d[4]) for d in batches[0]] if batches else []
+        for i, chunk in enumerate(batches):
+            downloads = pending
+            pending = [dl.submit(download_pdf, d[4]) for d in batches[i + 1]] if i + 1 < len(batches) else []
+            parsed = []
+            for doc, fut in zip(chunk, downloads):
+                b = fut.result()
+                if not b:
+                    summary["failed"].append((doc[4], "download failed"))
+                    continue
+                parsed.append((doc, pp.submit(pdf_bytes_to_text, b)))
+            rows = []
+            for (ticker, year, quarter, ftype, path), fut in parsed:
+                try:
+                    text = fut.result()
+                except Exception as e:
+                    summary["failed"].append((path, str(e)))
+                    continue
+                if ticker not in urls:
+                    urls[ticker] = _source_urls(ticker, sorted(periods[ticker]))
+                url = urls[ticker].get((year, quarter, ftype))
+                rows.append(file_row(ticker, year, quarter, ftype, "text", None, url, text))
+            upsert_rows(rows)
+            summary["written"] += len(rows)
+            print(f"[retext] {summary['written']}/{len(docs)} text rows written")
+    return summary
+
+def main(argv: Optional[List[str]] = None):
+    ap = argparse.ArgumentParser(prog="python -m src.retext", description="Rebuild text rows from PDFs stored in the bucket.")
+    ap.add_argument("--tickers", help="Comma-separated tickers (default: every ticker folder in the bucket)")
+    ap.add_argument("--start-year", type=int)
+    ap.add_argument("--end-year", type=int)
+    ap.add_argument("--start-q", default="Q1", choices=["Q1", "Q2", "Q3", "Q4"])
+    ap.add_argument("--end-q", default="Q4", choices=["Q1", "Q2", "Q3", "Q4"])
+    ap.add_argument("--types", help=f"Comma-separated file types (default: {','.join(FILE_TYPES)})")
+    ap.add_argument("--workers", type=int, default=16, help="Concurrent downloads")
+    ap.add_argument("--processes", type=int, default=PDF_WORKERS, help="PDF parsing processes")
+    ap.add_argument("--batch", type=int, default=64, help="Documents per bulk upsert")
+    ap.add_argument("--dry-run", action="store_true", help="Only list the PDFs that would be re-texted")
+    args = ap.parse_args(argv)
+
+    if (args.start_year is None) != (args.end_year is None):
+        ap.error("--start-year and --end-year go together")
+    tickers = [t.strip().upper() for t in args.tickers.split(",") if t.strip()] if args.tickers else list_tickers()
+    file_types = [t.strip() for t in args.types.split(",") if t.strip()] if args.types else None
+    with ThreadPoolExecutor(max_workers=args.workers) as ex:
+        listed = ex.map(lambda t: list_ticker_documents(t, args.start_year, args.end_year, args.start_q, args.end_q, file_types), tickers)
+        docs = [d for lst in listed for d in lst]
+    print(f"[retext] {len(docs)} PDF(s) across {len(tickers)} ticker(s)")
+    if args.dry_run:
+        for d in docs:
+            print(d[4])
+        return 0
+    summary = retext(docs, workers=args.workers, processes=args.processes, batch=args.batch)
+    for path, err in summary["failed"]:
+        print(f"[retext] failed {path}: {err}")
+    return 1 if summary["failed"] else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,516 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from typing import Optional, List, Dict, Any, Tuple
+
+# Storage backends behind cloud_store. Every backend serves the two tables (earnings_files,
+# guidance_resolved) and the PDF bucket with the same methods:
+#   list_files(prefix, page_size)  storage entries under a folder; folders have no "id"
+#   exists(key) / upload(key, data) / download(key)
+#   upsert(table, rows, on_conflict)
+#   select_files(tickers, file_type, file_format, columns, window, periods, page_size)
+#   latest_update(tickers, file_type, file_format, window)
+#   select_resolutions(ticker, year, quarter)
+# `window` is None or (start_year, end_year, start_q, end_q); `periods` is None or [(year, quarter)].
+#
+# STORE_BACKEND picks one: "supabase" (default), "local" (SQLite + files under LOCAL_STORE_DIR, no
+# network), or "mirror" (Supabase, with rows and PDFs read through a size-bounded local LRU cache).
+
+STORE_BACKEND = os.getenv("STORE_BACKEND", "supabase")  # supabase | local | mirror
+LOCAL_STORE_DIR = os.getenv("LOCAL_STORE_DIR", os.path.join(".cache", "store"))
+MIRROR_DIR = os.getenv("MIRROR_DIR", os.path.join(".cache", "mirror"))
+MIRROR_MAX_BYTES = int(os.getenv("MIRROR_MAX_BYTES", str(2 * 1024 ** 3)))
+# Cached rows younger than this are served without asking Supabase whether they changed.
+MIRROR_TTL = float(os.getenv("MIRROR_TTL", "300"))
+
+PERIODS_PER_QUERY = 40
+TICKERS_PER_QUERY = 100
+
+_client = None
+_client_lock = threading.Lock()
+
+def _pooled_client_class():
+    # supabase-py builds a separate httpx client for PostgREST and for Storage; these subclasses hand
+    # both a client on the shared keep-alive pool of src/http_pool.py instead.
+    from supabase import Client
+    from postgrest import SyncPostgrestClient
+    from storage3 import SyncStorageClient
+    from .http_pool import http_client
+
+    class PooledPostgrest(SyncPostgrestClient):
+        def create_session(self, base_url, headers, timeout, verify=True):
+            return http_client(base_url, headers, timeout)
+
+    class PooledStorage(SyncStorageClient):
+        def _create_session(self, base_url, headers, timeout, verify=True):
+            return http_client(base_url, headers, timeout)
+
+    class PooledClient(Client):
+        @staticmethod
+        def _init_postgrest_client(rest_url, headers, schema, timeout=120):
+            return PooledPostgrest(rest_url, headers=headers, schema=schema, timeout=timeout)
+
+        @staticmethod
+        def _init_storage_client(storage_url, headers, storage_client_timeout=20):
+            return PooledStorage(storage_url, headers, storage_client_timeout)
+
+    return PooledClient
+
+def supabase_client():
+    # One Supabase client per process, created on first use rather than at import.
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                from supabase import ClientOptions
+                _client = _pooled_client_class().create(os.getenv("SUPABASE_URL"), os.getenv("SUPABASE_ANON_KEY"), ClientOptions())
+    return _client
+
+class SupabaseStore:
+    def __init__(self, client=None, bucket: Optional[str] = None):
+        self.client = client or supabase_client()
+        self.bucket = bucket or os.getenv("SUPABASE_BUCKET", "earnings")
+
+    def _storage(self):
+        return self.client.storage.from_(self.bucket)
+
+    def list_files(self, prefix: str, page_size: int = 1000) -> List[Dict[str, Any]]:
+        entries: List[Dict[str, Any]] = []
+        offset = 0
+        while True:
+            page = self._storage().list(path=prefix, options={"limit": page_size, "offset": offset})
+            entries.extend(page or [])
+            if not page or len(page) < page_size:
+                return entries
+            offset += page_size
+
+    def exists(self, key: str) -> bool:
+        parent, name = key.rsplit("/", 1)
+        try:
+            return any(e.get("name") == name for e in self._storage().list(path=parent))
+        except Exception:
+            return False
+
+    def upload(self, key: str, data: bytes):
+        self._storage().upload(key, data, {"content-type": "application/pdf", "upsert": True})
+
+    def download(self, key: str) -> Optional[bytes]:
+        try:
+            return self._storage().download(key)
+        except Exception:
+            return None
+
+    def upsert(self, table: str, rows: List[Dict[str, Any]], on_conflict: str):
+        self.client.table(table).upsert(rows, on_conflict=on_conflict).execute()
+
+    def _match(self, q, tickers: List[str], file_type: Optional[str], file_format: Optional[str]):
+        q = q.eq("ticker", tickers[0]) if len(tickers) == 1 else q.in_("ticker", tickers)
+        if file_type:
+            q = q.eq("file_type", file_type)
+        if file_format:
+            q = q.eq("file_format", file_format)
+        return q
+
+    def _window(self, q, window):
+        # Quarters are stored as 'Q1'..'Q4', so text comparison orders them correctly.
+        start_year, end_year, start_q, end_q = window
+        if start_year == end_year:
+            return q.eq("year", start_year).gte("quarter", start_q).lte("quarter", end_q)
+        return q.or_(
+            f"and(year.gt.{start_year},year.lt.{end_year}),"
+            f"and(year.eq.{start_year},quarter.gte.{start_q}),"
+            f"and(year.eq.{end_year},quarter.lte.{end_q})"
+        )
+
+    def select_files(self, tickers: List[str], file_type: Optional[str] = None, file_format: Optional[str] = None,
+                     columns: str = "*", window=None, periods=None, page_size: int = 500) -> List[Dict[str, Any]]:
+        # The window or period list and the column list are applied by PostgREST; results are paged so
+        # large tickers stay under the response-size limit.
+        def query(chunk, group):
+            q = self._match(self.client.table("earnings_files").select(columns), group, file_type, file_format)
+            if len(group) > 1:
+                q = q.order("ticker")
+            if chunk:
+                q = q.or_(",".join(f"and(year.eq.{y},quarter.eq.{qq})" for y, qq in chunk))
+            elif window:
+                q = self._window(q, window)
+            return q.order("year", desc=True).order("quarter", desc=True).order("id")
+
+        # Long period and ticker lists are split to keep the query string short.
+        pairs = sorted(set(periods or []), reverse=True)
+        chunks = [pairs[i:i + PERIODS_PER_QUERY] for i in range(0, len(pairs), PERIODS_PER_QUERY)] or [None]
+        groups = [tickers[i:i + TICKERS_PER_QUERY] for i in range(0, len(tickers), TICKERS_PER_QUERY)]
+        rows: List[Dict[str, Any]] = []
+        for group in groups:
+            for chunk in chunks:
+                offset = 0
+                while True:
+                    page = query(chunk, group).range(offset, offset + page_size - 1).execute().data
+                    rows.extend(page)
+                    if len(page) < page_size:
+                        break
+                    offset += page_size
+        return rows
+
+    def latest_update(self, tickers: List[str], file_type: Optional[str] = None, file_format: Optional[str] = None, window=None) -> str:
+        q = self._match(self.client.table("earnings_files").select("updated_at", count="exact"), tickers, file_type, file_format)
+        if window:
+            q = self._window(q, window)
+        res = q.order("updated_at", desc=True).limit(1).execute()
+        return f"{res.count or 0}:{res.data[0]['updated_at'] if res.data else ''}"
+
+    def select_resolutions(self, ticker: str, year: Optional[int] = None, quarter: Optional[str] = None) -> List[Dict[str, Any]]:
+        q = self.client.table("guidance_resolved").select("*").eq("ticker", ticker)
+        if year is not None:
+            q = q.eq("year", year)
+        if quarter is not None:
+            q = q.eq("quarter", quarter)
+        return q.execute().data
+
+# Same tables as SETUP_INSTRUCTIONS, in SQLite. JSONB columns are stored as JSON text.
+JSON_COLUMNS = {"items", "candidates"}
+LOCAL_SCHEMA = """
+create table if not exists earnings_files (
+  id integer primary key autoincrement,
+  ticker text not null,
+  year int not null,
+  quarter text not null,
+  file_type text not null,
+  file_format text not null,
+  storage_path text,
+  source_url text,
+  text_content text,
+  content_hash text,
+  fingerprint text,
+  text_zip text,
+  items text,
+  candidates text,
+  created_at text default (strftime('%Y-%m-%dT%H:%M:%f+00:00', 'now')),
+  updated_at text default (strftime('%Y-%m-%dT%H:%M:%f+00:00', 'now')),
+  unique (ticker, year, quarter, file_type, file_format)
+);
+create index if not exists ix_lookup on earnings_files(ticker, file_type, file_format, year desc, quarter);
+create table if not exists guidance_resolved (
+  id integer primary key autoincrement,
+  ticker text not null,
+  year int not null,
+  quarter text not null,
+  metric_key text not null,
+  chosen_json text not null,
+  created_at text default (strftime('%Y-%m-%dT%H:%M:%f+00:00', 'now')),
+  updated_at text default (strftime('%Y-%m-%dT%H:%M:%f+00:00', 'now')),
+  unique (ticker, year, quarter, metric_key)
+);
+create index if not exists ix_resolved on guidance_resolved(ticker, year desc, quarter);
+"""
+
+class LocalStore:
+    # SQLite database plus a folder that mirrors the bucket layout (pdfs/{TICKER}/{YEAR}-{Q}/{type}.pdf).
+    def __init__(self, root: Optional[str] = None):
+        self.root = root or LOCAL_STORE_DIR
+        self.files_dir = os.path.join(self.root, "bucket")
+        os.makedirs(self.files_dir, exist_ok=True)
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(os.path.join(self.root, "store.sqlite"), check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.executescript(LOCAL_SCHEMA)
+        have = {r[1] for r in self.conn.execute("pragma table_info(earnings_files)")}
+        for col in ("text_zip", "items", "candidates"):
+            if col not in have:
+                self.conn.execute(f"alter table earnings_files add column {col} text")
+        self.conn.commit()
+        self.columns = {t: [r[1] for r in self.conn.execute(f"pragma table_info({t})")] for t in ("earnings_files", "guidance_resolved")}
+
+    def _path(self, key: str) -> str:
+        path = os.path.normpath(os.path.join(self.files_dir, key))
+        if not path.startswith(os.path.normpath(self.files_dir) + os.sep):
+            raise ValueError(f"storage key outside the bucket: {key}")
+        return path
+
+    def list_files(self, prefix: str, page_size: int = 1000) -> List[Dict[str, Any]]:
+        folder = self._path(prefix) if prefix.strip("/") else self.files_dir
+        if not os.path.isdir(folder):
+            return []
+        entries = []
+        for name in sorted(os.listdir(folder)):
+            full = os.path.join(folder, name)
+            if os.path.isdir(full):
+                entries.append({"name": name, "id": None, "metadata": None})
+            elif not name.endswith(".tmp"):
+                entries.append({"name": name, "id": f"{prefix.strip('/')}/{name}", "metadata": {"size": os.path.getsize(full)}})
+        return entries
+
+    def exists(self, key: str) -> bool:
+        return os.path.isfile(self._path(key))
+
+    def upload(self, key: str, data: bytes):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path + ".tmp", "wb") as fh:
+            fh.write(data)
+        os.replace(path + ".tmp", path)
+
+    def download(self, key: str) -> Optional[bytes]:
+        try:
+            with open(self._path(key), "rb") as fh:
+                return fh.read()
+        except (OSError, ValueError):
+            return None
+
+    def upsert(self, table: str, rows: List[Dict[str, Any]], on_conflict: str):
+        # Like PostgREST: only the columns present in the payload are written.
+        known = set(self.columns[table])
+        with self.lock, self.conn:
+            for r in rows:
+                cols = [c for c in r if c in known and c != "id"]
+                updates = ", ".join(f"{c} = excluded.{c}" for c in cols if c not in on_conflict.split(","))
+                sql = (f"insert into {table} ({', '.join(cols)}) values ({', '.join('?' for _ in cols)}) "
+                       f"on conflict ({on_conflict}) do " + (f"update set {updates}" if updates else "nothing"))
+                self.conn.execute(sql, [json.dumps(r[c], ensure_ascii=False) if c in JSON_COLUMNS and r[c] is not None else r[c]
+                                        for c in cols])
+
+    def _where(self, tickers: List[str], file_type, file_format, window=None, periods=None) -> Tuple[str, List[Any]]:
+        clauses = [f"ticker in ({', '.join('?' for _ in tickers)})"]
+        args: List[Any] = list(tickers)
+        if file_type:
+            clauses.append("file_type = ?")
+            args.append(file_type)
+        if file_format:
+            clauses.append("file_format = ?")
+            args.append(file_format)
+        if periods:
+            clauses.append("(" + " or ".join("(year = ? and quarter = ?)" for _ in periods) + ")")
+            args.extend(v for p in periods for v in p)
+        elif window:
+            start_year, end_year, start_q, end_q = window
+            if start_year == end_year:
+                clauses.append("(year = ? and quarter >= ? and quarter <= ?)")
+                args.extend([start_year, start_q, end_q])
+            else:
+                clauses.append("((year > ? and year < ?) or (year = ? and quarter >= ?) or (year = ? and quarter <= ?))")
+                args.extend([start_year, end_year, start_year, start_q, end_year, end_q])
+        return " and ".join(clauses), args
+
+    def _columns(self, table: str, columns: str) -> str:
+        if columns.strip() == "*":
+            return "*"
+        cols = [c.strip() for c in columns.split(",") if c.strip()]
+        unknown = [c for c in cols if c not in self.columns[table]]
+        if unknown:
+            raise ValueError(f"unknown column(s) for {table}: {', '.join(unknown)}")
+        return ", ".join(cols)
+
+    def select_files(self, tickers: List[str], file_type: Optional[str] = None, file_format: Optional[str] = None,
+                     columns: str = "*", window=None, periods=None, page_size: int = 500) -> List[Dict[str, Any]]:
+        rows: List[Dict[str, Any]] = []
+        pairs = sorted(set(periods or []), reverse=True)
+        # SQLite caps bound parameters per statement, so long period lists are split like remote queries.
+        chunks = [pairs[i:i + PERIODS_PER_QUERY * 10] for i in range(0, len(pairs), PERIODS_PER_QUERY * 10)] or [None]
+        order = ("ticker, " if len(tickers) > 1 else "") + "year desc, quarter desc, id"
+        for chunk in chunks:
+            where, args = self._where(tickers, file_type, file_format, window, chunk)
+            with self.lock:
+                cur = self.conn.execute(f"select {self._columns('earnings_files', columns)} from earnings_files where {where} order by {order}", args)
+                rows.extend(dict(r) for r in cur.fetchall())
+        for r in rows:
+            for c in JSON_COLUMNS.intersection(r):
+                if r[c] is not None:
+                    r[c] = json.loads(r[c])
+        return rows
+
+    def latest_update(self, tickers: List[str], file_type: Optional[str] = None, file_format: Optional[str] = None, window=None) -> str:
+        where, args = self._where(tickers, file_type, file_format, window)
+        with self.lock:
+            count, latest = self.conn.execute(f"select count(*), max(updated_at) from earnings_files where {where}", args).fetchone()
+        return f"{count}:{latest or ''}"
+
+    def select_resolutions(self, ticker: str, year: Optional[int] = None, quarter: Optional[str] = None) -> List[Dict[str, Any]]:
+        sql, args = "select * from guidance_resolved where ticker = ?", [ticker]
+        if year is not None:
+            sql += " and year = ?"
+            args.append(year)
+        if quarter is not None:
+            sql += " and quarter = ?"
+            args.append(quarter)
+        with self.lock:
+            return [dict(r) for r in self.conn.execute(sql, args).fetchall()]
+
+class MirrorStore:
+    # Read-through cache in front of a remote store. PDFs are cached by storage key and query results by
+    # their arguments, all as files under MIRROR_DIR, evicted least-recently-used once they exceed
+    # MIRROR_MAX_BYTES. Cached rows are served for MIRROR_TTL seconds, then revalidated with the remote's
+    # latest_update stamp and refetched only if it moved. Writes go to the remote and drop the affected
+    # tickers' cached queries; uploaded PDFs are kept locally as written.
+    def __init__(self, remote, root: Optional[str] = None, max_bytes: Optional[int] = None, ttl: Optional[float] = None):
+        self.remote = remote
+        self.root = root or MIRROR_DIR
+        self.max_bytes = MIRROR_MAX_BYTES if max_bytes is None else max_bytes
+        self.ttl = MIRROR_TTL if ttl is None else ttl
+        self.blobs = os.path.join(self.root, "blobs")
+        os.makedirs(self.blobs, exist_ok=True)
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(os.path.join(self.root, "index.sqlite"), check_same_thread=False)
+        self.conn.execute(
+            "create table if not exists entries ("
+            " key text primary key, kind text not null, tags text, stamp text,"
+            " size int not null, fetched_at real not null, used_at real not null)"
+        )
+        self.conn.commit()
+
+    def _blob(self, key: str) -> str:
+        return os.path.join(self.blobs, hashlib.sha256(key.encode("utf-8")).hexdigest())
+
+    def _get(self, key: str) -> Optional[Tuple[bytes, str, float]]:
+        with self.lock:
+            row = self.conn.execute("select stamp, fetched_at from entries where key = ?", (key,)).fetchone()
+            if not row:
+                return None
+            self.conn.execute("update entries set used_at = ? where key = ?", (time.time(), key))
+            self.conn.commit()
+        try:
+            with open(self._blob(key), "rb") as fh:
+                return fh.read(), row[0], row[1]
+        except OSError:
+            self._drop([key])
+            return None
+
+    def _put(self, key: str, kind: str, data: bytes, tags: str = "", stamp: Optional[str] = None):
+        if len(data) > self.max_bytes:
+            return
+        path = self._blob(key)
+        with open(path + ".tmp", "wb") as fh:
+            fh.write(data)
+        os.replace(path + ".tmp", path)
+        now = time.time()
+        with self.lock:
+            self.conn.execute("insert or replace into entries values (?, ?, ?, ?, ?, ?, ?)", (key, kind, tags, stamp, len(data), now, now))
+            self.conn.commit()
+        self._evict()
+
+    def _drop(self, keys: List[str]):
+        with self.lock:
+            self.conn.executemany("delete from entries where key = ?", [(k,) for k in keys])
+            self.conn.commit()
+        for k in keys:
+            try:
+                os.remove(self._blob(k))
+            except OSError:
+                pass
+
+    def _evict(self):
+        with self.lock:
+            total = self.conn.execute("select coalesce(sum(size), 0) from entries").fetchone()[0]
+            if total <= self.max_bytes:
+                return
+            victims = []
+            for key, size in self.conn.execute("select key, size from entries order by used_at"):
+                if total <= self.max_bytes:
+                    break
+                victims.append(key)
+                total -= size
+        self._drop(victims)
+
+    def invalidate(self, tickers: List[str]):
+        # Query entries carry their tickers as ",T1,T2," tags.
+        with self.lock:
+            keys = [k for (k,) in self.conn.execute(
+                "select key from entries where kind = 'rows' and (" + " or ".join("tags like ?" for _ in tickers) + ")",
+                [f"%,{t},%" for t in tickers])] if tickers else []
+        self._drop(keys)
+
+    @staticmethod
+    def _tags(tickers: List[str]) -> str:
+        return "," + ",".join(tickers) + ","
+
+    def _cached_rows(self, key: str, tickers: List[str], fetch, revalidate=None):
+        hit = self._get(key)
+        if hit:
+            data, stamp, fetched_at = hit
+            if time.time() - fetched_at < self.ttl:
+                return json.loads(data)
+            if revalidate is not None and stamp is not None and revalidate() == stamp:
+                with self.lock:
+                    self.conn.execute("update entries set fetched_at = ? where key = ?", (time.time(), key))
+                    self.conn.commit()
+                return json.loads(data)
+        # The stamp is taken before the fetch, so a write racing the fetch is caught on revalidation.
+        stamp = revalidate() if revalidate is not None else None
+        rows = fetch()
+        self._put(key, "rows", json.dumps(rows, ensure_ascii=False).encode("utf-8"), self._tags(tickers), stamp)
+        return rows
+
+    def list_files(self, prefix: str, page_size: int = 1000) -> List[Dict[str, Any]]:
+        parts = prefix.strip("/").split("/")
+        tickers = [parts[1].upper()] if len(parts) > 1 and parts[0] == "pdfs" else ["*"]
+        return self._cached_rows(f"list:{prefix.strip('/')}", tickers, lambda: self.remote.list_files(prefix, page_size))
+
+    def exists(self, key: str) -> bool:
+        with self.lock:
+            cached = self.conn.execute("select 1 from entries where key = ?", (f"pdf:{key}",)).fetchone()
+        return bool(cached) or self.remote.exists(key)
+
+    def upload(self, key: str, data: bytes):
+        self.remote.upload(key, data)
+        self._put(f"pdf:{key}", "pdf", data)
+        parts = key.split("/")
+        self.invalidate(["*"] + ([parts[1].upper()] if len(parts) > 2 else []))
+
+    def download(self, key: str) -> Optional[bytes]:
+        hit = self._get(f"pdf:{key}")
+        if hit:
+            return hit[0]
+        data = self.remote.download(key)
+        if data:
+            self._put(f"pdf:{key}", "pdf", data)
+        return data
+
+    def upsert(self, table: str, rows: List[Dict[str, Any]], on_conflict: str):
+        self.remote.upsert(table, rows, on_conflict)
+        self.invalidate(sorted({r["ticker"] for r in rows if r.get("ticker")}))
+
+    def select_files(self, tickers: List[str], file_type: Optional[str] = None, file_format: Optional[str] = None,
+                     columns: str = "*", window=None, periods=None, page_size: int = 500) -> List[Dict[str, Any]]:
+        key = "files:" + json.dumps([tickers, file_type, file_format, columns, window, sorted(periods) if periods else periods])
+        return self._cached_rows(
+            key, tickers,
+            lambda: self.remote.select_files(tickers, file_type, file_format, columns, window, periods, page_size),
+            lambda: self.remote.latest_update(tickers, file_type, file_format),
+        )
+
+    def latest_update(self, tickers: List[str], file_type: Optional[str] = None, file_format: Optional[str] = None, window=None) -> str:
+        return self.remote.latest_update(tickers, file_type, file_format, window)
+
+    def select_resolutions(self, ticker: str, year: Optional[int] = None, quarter: Optional[str] = None) -> List[Dict[str, Any]]:
+        key = "resolved:" + json.dumps([ticker, year, quarter])
+        return self._cached_rows(key, [ticker], lambda: self.remote.select_resolutions(ticker, year, quarter))
+
+_store = None
+_store_lock = threading.Lock()
+
+def make_store(backend: Optional[str] = None):
+    backend = (backend or STORE_BACKEND).lower()
+    if backend == "local":
+        return LocalStore()
+    if backend == "mirror":
+        return MirrorStore(SupabaseStore())
+    if backend == "supabase":
+        return SupabaseStore()
+    raise ValueError(f"unknown STORE_BACKEND: {backend}")
+
+def get_store():
+    # Created on first use, so importing cloud_store opens no connection.
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = make_store()
+    return _store
+
+def set_store(store):
+    # Swap the process-wide backend, e.g. a LocalStore for tests and benchmarks.
+    global _store
+    _store = store
+    return store
@@ -0,0 +1,196 @@
+import os
+import json
+import time
+import uuid
+import atexit
+import inspect
+import functools
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Optional, List, Dict, Any
+
+# Pipeline instrumentation: timing spans per stage and counters (bytes, tokens, retries...).
+#   with span("openai.call", model=model): ...      time a block
+#   @traced("merge.merge_items")                     time every call of a function (sync or async)
+#   count("openai.tokens_in", usage.prompt_tokens)   add to a counter
+#   with run("extract") as r: ...; r.summary()       collect everything recorded inside into one report
+# Spans and counters always aggregate in memory (PROCESS holds totals since start). TELEMETRY_EXPORT adds
+# exporters: "jsonl" appends one line per span and per run summary to TELEMETRY_PATH; "otel" forwards
+# spans and counters to OpenTelemetry (needs opentelemetry-api; providers and exporters are configured
+# the usual OTel way, e.g. opentelemetry-instrument or OTEL_* settings). Both may be given: "jsonl,otel".
+
+TELEMETRY_EXPORT = {e.strip() for e in os.getenv("TELEMETRY_EXPORT", "").split(",") if e.strip()}
+TELEMETRY_PATH = os.getenv("TELEMETRY_PATH", os.path.join(".cache", "telemetry.jsonl"))
+
+class Run:
+    def __init__(self, name: str):
+        self.id = uuid.uuid4().hex[:12]
+        self.name = name
+        self.started = time.time()
+        self.ended: Optional[float] = None
+        self.stages: Dict[str, Dict[str, float]] = {}
+        self.counters: Dict[str, float] = {}
+        self.lock = threading.Lock()
+
+    def add_span(self, name: str, seconds: float, error: bool = False):
+        with self.lock:
+            s = self.stages.get(name)
+            if s is None:
+                s = self.stages[name] = {"count": 0, "seconds": 0.0, "max": 0.0, "errors": 0}
+            s["count"] += 1
+            s["seconds"] += seconds
+            s["max"] = max(s["max"], seconds)
+            s["errors"] += error
+
+    def add(self, name: str, value: float):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def summary(self) -> Dict[str, Any]:
+        # Stages sorted by total time. Nested stages overlap their parents and concurrent spans overlap
+        # each other, so totals can exceed the run's wall time.
+        with self.lock:
+            stages = [{"stage": k, "count": v["count"], "seconds": round(v["seconds"], 3),
+                       "mean_ms": round(1000 * v["seconds"] / v["count"], 1), "max_ms": round(1000 * v["max"], 1),
+                       "errors": v["errors"]} for k, v in self.stages.items()]
+            counters = dict(sorted(self.counters.items()))
+        stages.sort(key=lambda s: -s["seconds"])
+        return {"run": self.name, "id": self.id, "seconds": round((self.ended or time.time()) - self.started, 3),
+                "stages": stages, "counters": counters}
+
+PROCESS = Run("process")
+_run_var: ContextVar[Optional[Run]] = ContextVar("telemetry_run", default=None)
+_span_var: ContextVar[Optional[str]] = ContextVar("telemetry_span", default=None)
+# Runs open in this process; threads started without a copied context report to the newest one.
+_active: List[Run] = []
+_active_lock = threading.Lock()
+
+def _targets() -> List[Run]:
+    r = _run_var.get()
+    if r is None and _active:
+        r = _active[-1]
+    return [PROCESS, r] if r is not None else [PROCESS]
+
+class _JsonlExporter:
+    def __init__(self, path: str):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.fh = open(path, "a", encoding="utf-8")
+        self.lock = threading.Lock()
+        atexit.register(self.fh.close)
+
+    def write(self, record: Dict[str, Any]):
+        line = json.dumps(record, ensure_ascii=False, default=str) + "\n"
+        with self.lock:
+            self.fh.write(line)
+            self.fh.flush()
+
+_jsonl: Optional[_JsonlExporter] = None
+_otel = None
+_exporters_ready = False
+_exporters_lock = threading.Lock()
+
+def _init_exporters():
+    global _jsonl, _otel, _exporters_ready
+    with _exporters_lock:
+        if _exporters_ready:
+            return
+        if "jsonl" in TELEMETRY_EXPORT:
+            _jsonl = _JsonlExporter(TELEMETRY_PATH)
+        if "otel" in TELEMETRY_EXPORT:
+            try:
+                from opentelemetry import trace, metrics
+                _otel = {"tracer": trace.get_tracer("guidance-pipeline"), "meter": metrics.get_meter("guidance-pipeline"),
+                         "counters": {}}
+            except ImportError:
+                print("[telemetry] TELEMETRY_EXPORT=otel needs the opentelemetry-api package; skipping OTel export")
+        _exporters_ready = True
+
+def _otel_counter(name: str):
+    c = _otel["counters"].get(name)
+    if c is None:
+        c = _otel["counters"][name] = _otel["meter"].create_counter(name)
+    return c
+
+@contextmanager
+def span(name: str, **attrs):
+    if not _exporters_ready:
+        _init_exporters()
+    parent = _span_var.get()
+    token = _span_var.set(name)
+    otel_cm = _otel["tracer"].start_as_current_span(name, attributes={k: v for k, v in attrs.items() if v is not None}) if _otel else None
+    if otel_cm is not None:
+        otel_cm.__enter__()
+    start_wall, start = time.time(), time.perf_counter()
+    error = None
+    try:
+        yield
+    except BaseException as e:
+        error = e
+        raise
+    finally:
+        seconds = time.perf_counter() - start
+        _span_var.reset(token)
+        targets = _targets()
+        for r in targets:
+            r.add_span(name, seconds, error is not None)
+        if otel_cm is not None:
+            otel_cm.__exit__(type(error) if error else None, error, error.__traceback__ if error else None)
+        if _jsonl is not None:
+            _jsonl.write({"type": "span", "run": targets[-1].id if len(targets) > 1 else None, "name": name,
+                          "parent": parent, "start": start_wall, "seconds": round(seconds, 6), "pid": os.getpid(),
+                          "error": repr(error) if error else None, "attrs": attrs})
+
+def count(name: str, value: float = 1):
+    if not value:
+        return
+    if not _exporters_ready:
+        _init_exporters()
+    for r in _targets():
+        r.add(name, value)
+    if _otel is not None:
+        _otel_counter(name).add(value)
+
+def traced(name: str):
+    def deco(fn):
+        if inspect.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def awrapper(*args, **kwargs):
+                with span(name):
+                    return await fn(*args, **kwargs)
+            return awrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return deco
+
+@contextmanager
+def run(name: str):
+    # Everything recorded inside (including asyncio tasks and asyncio.to_thread calls, which copy the
+    # context) lands in the yielded Run; the summary is exported when the block ends.
+    r = Run(name)
+    token = _run_var.set(r)
+    with _active_lock:
+        _active.append(r)
+    try:
+        with span(f"run.{name}"):
+            yield r
+    finally:
+        r.ended = time.time()
+        with _active_lock:
+            _active.remove(r)
+        _run_var.reset(token)
+        if _jsonl is not None:
+            _jsonl.write({"type": "run", **r.summary()})
+
+def format_summary(summary: Dict[str, Any], top: int = 8) -> str:
+    lines = [f"[telemetry] {summary['run']} {summary['seconds']:.1f}s"]
+    for s in summary["stages"][:top]:
+        lines.append(f"  {s['stage']:<28} {s['count']:>6}x {s['seconds']:>9.2f}s  mean {s['mean_ms']:.0f}ms  max {s['max_ms']:.0f}ms")
+    for k, v in summary["counters"].items():
+        lines.append(f"  {k:<28} {v:>10g}")
+    return "\n".join(lines)
@@ -0,0 +1,29 @@
+# Shared fixtures: a temporary local store and the stand-in OpenAI server of src/fake_openai.py.
+import pytest
+
+from src import batch_extract, guidance, llm_cache, stores
+from src.fake_openai import serve
+
+@pytest.fixture
+def openai_server(tmp_path, monkeypatch):
+    # Local store, batch state and no LLM cache under tmp_path; start(**options) (re)points the client
+    # at a fresh stand-in server.
+    previous = stores._store
+    stores.set_store(stores.LocalStore(str(tmp_path / "store")))
+    monkeypatch.setattr(batch_extract, "BATCH_DIR", str(tmp_path / "batches"))
+    monkeypatch.setattr(llm_cache, "LLM_CACHE_BACKEND", "off")
+    monkeypatch.setattr(llm_cache, "_cache", None)
+    monkeypatch.setenv("OPENAI_API_KEY", "test")
+    servers = []
+
+    def start(**options):
+        server, url = serve(**options)
+        servers.append(server)
+        monkeypatch.setenv("OPENAI_BASE_URL", url)
+        monkeypatch.setattr(guidance, "_client", None)
+        return server
+
+    yield start
+    for server in servers:
+        server.shutdown()
+    stores.set_store(previous)
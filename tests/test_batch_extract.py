@@ -0,0 +1,78 @@
+# Batch API extraction end to end against the stand-in server of src/fake_openai.py and a temporary
+# local store: prepare → submit → poll → ingest, resuming from the saved state, with injected failures.
+import json
+
+from src import batch_extract, guidance
+from src.cloud_store import upsert_row, fetch_rows
+
+TICKER = "AAA"
+QUARTERS = [(2024, "Q1"), (2024, "Q2"), (2024, "Q3"), (2024, "Q4")]
+STALE = [{"metric": "Stale", "source": "press_release"}]
+
+def seed():
+    # One press release per quarter with one guidance paragraph, and a stale guidance row to overwrite.
+    for n, (year, quarter) in enumerate(QUARTERS):
+        text = ("Press release.\n\n"
+                f"For the full year {year} we expect revenue of ${10 + n}.0 billion to ${10 + n}.5 billion.\n")
+        upsert_row(TICKER, year, quarter, "press_release", "text", None, f"https://example.com/{quarter}", text)
+        upsert_row(TICKER, year, quarter, "guidance_json", "json", None, None, json.dumps(STALE))
+
+def stored_items():
+    rows = fetch_rows(TICKER, file_type="guidance_json", file_format="json", columns="year,quarter,text_content")
+    return {(r["year"], r["quarter"]): json.loads(r["text_content"]) for r in rows}
+
+def prepare(**kwargs):
+    # A tiny token budget sends every document in its own request, so failures hit single quarters.
+    return batch_extract.prepare_batch([TICKER], start_year=2024, end_year=2024, token_budget=1, **kwargs)
+
+def test_batch_run_resumes_from_saved_state(openai_server):
+    openai_server(batch_polls=2)
+    seed()
+    state = prepare(run_id="resume")
+    assert len(state["requests"]) == len(QUARTERS)
+    batch_extract.submit_batch(state)
+    assert not batch_extract.poll_batch(state)
+
+    # A new process picks the run up from its state file and finishes it.
+    state = batch_extract.load_state("resume")
+    assert state["phase"] == "submitted"
+    summary = batch_extract.run_batch(state, poll_seconds=0)
+    assert summary["quarters"] == len(QUARTERS) and not summary["failed"]
+    items = stored_items()
+    for year, quarter in QUARTERS:
+        assert [it["metric"] for it in items[(year, quarter)]] == ["revenue"]
+
+    # An ingested run is not submitted or written again.
+    assert batch_extract.run_batch(batch_extract.load_state("resume")) == summary
+
+def test_failed_requests_leave_stored_rows(openai_server):
+    openai_server(fail_every=2)
+    seed()
+    summary = batch_extract.run_batch(prepare(run_id="failing"), poll_seconds=0)
+    failed = {(year, quarter) for _t, year, quarter, _src, _err in summary["failed"]}
+    assert failed == {QUARTERS[1], QUARTERS[3]}
+    assert summary["quarters"] == 2 and summary["quarters_skipped"] == 2
+    items = stored_items()
+    for period in QUARTERS:
+        if period in failed:
+            assert items[period] == STALE
+        else:
+            assert [it["metric"] for it in items[period]] == ["revenue"]
+
+    # The next incremental run extracts only the documents of the quarters that failed.
+    openai_server()
+    summary = batch_extract.run_batch(prepare(run_id="retry", incremental=True), poll_seconds=0)
+    assert summary["documents"] == 2 and summary["quarters"] == 2 and not summary["failed"]
+    assert all([it["metric"] for it in its] == ["revenue"] for its in stored_items().values())
+
+def test_find_batch_pages_through_all_batches(openai_server):
+    openai_server()
+    client = guidance.openai_client()
+    fid = client.files.create(file=("in.jsonl", b"\n"), purpose="batch").id
+    create = lambda run_id: client.batches.create(input_file_id=fid, endpoint=batch_extract.ENDPOINT, completion_window="24h",
+                                                  metadata={"run_id": run_id, "part": "0"}).id
+    wanted = create("old-run")
+    for n in range(150):
+        create(f"newer-{n}")
+    assert batch_extract._find_batch(client, "old-run", 0) == wanted
+    assert batch_extract._find_batch(client, "old-run", 1) is None
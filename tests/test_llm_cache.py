@@ -0,0 +1,67 @@
+# The LLM cache is keyed per candidate, so results extracted once are reused however later runs pack
+# candidates into requests: another token budget, a document dropped or added, or the Batch API.
+import json
+
+import pytest
+
+from src import batch_extract, guidance, llm_cache
+from src.cloud_store import upsert_row, fetch_rows
+
+TICKER = "AAA"
+QUARTERS = [(2024, "Q1"), (2024, "Q2"), (2024, "Q3")]
+
+@pytest.fixture
+def cached_run(openai_server, tmp_path, monkeypatch):
+    monkeypatch.setattr(llm_cache, "LLM_CACHE_BACKEND", "sqlite")
+    monkeypatch.setattr(llm_cache, "_cache", llm_cache.SQLiteCache(str(tmp_path / "llm_cache.sqlite")))
+    openai_server()
+    return openai_server
+
+def seed(quarters):
+    # Two guidance paragraphs per press release, so every document has several candidates.
+    for n, (year, quarter) in enumerate(quarters):
+        text = ("Press release.\n\n"
+                f"For the full year {year} we expect revenue of ${10 + n}.0 billion to ${10 + n}.5 billion.\n\n"
+                f"For {quarter} {year} we expect gross margin of {40 + n} percent.\n")
+        upsert_row(TICKER, year, quarter, "press_release", "text", None, f"https://example.com/{quarter}", text)
+
+def stored_items():
+    rows = fetch_rows(TICKER, file_type="guidance_json", file_format="json", columns="year,quarter,text_content")
+    return {(r["year"], r["quarter"]): json.loads(r["text_content"]) for r in rows}
+
+def extract(**kwargs):
+    return guidance.extract_async(TICKER, start_year=2024, end_year=2024, **kwargs)
+
+def test_cache_survives_repacking(cached_run):
+    seed(QUARTERS)
+    first = extract()
+    assert first["requests"] == 1 and first["cache"]["hits"] == 0
+    candidates = first["cache"]["misses"]
+    items = stored_items()
+
+    # One request per candidate instead of one for all: every candidate is answered from the cache.
+    again = extract(token_budget=1)
+    assert again["requests"] == candidates
+    assert again["cache"] == {"hits": candidates, "misses": 0, "tokens_saved": again["cache"]["tokens_saved"]}
+    assert stored_items() == items
+
+def test_new_document_sends_only_its_candidates(cached_run):
+    seed(QUARTERS[:2])
+    first = extract()
+    seed(QUARTERS)
+    # Q3 lands in the same packed request as Q1 and Q2, whose candidates are still cached.
+    again = extract()
+    assert again["requests"] == 1
+    assert again["cache"]["hits"] == first["cache"]["misses"]
+    assert again["cache"]["misses"] == again["plan"]["sent"] - first["cache"]["misses"] > 0
+    assert all(len(its) == 2 for its in stored_items().values())
+
+def test_batch_run_uses_online_results(cached_run):
+    seed(QUARTERS)
+    extract()
+    items = stored_items()
+    state = batch_extract.prepare_batch([TICKER], start_year=2024, end_year=2024, token_budget=1, run_id="cached")
+    assert not state["parts"] and not state["cache"]["misses"]
+    summary = batch_extract.run_batch(state, poll_seconds=0)
+    assert summary["quarters"] == len(QUARTERS) and not summary["failed"]
+    assert stored_items() == items
@@ -0,0 +1,135 @@
+# The indexed merge (user-014) must return exactly what the pairwise merge returned. merge_items is
+# checked against merge_items_pairwise, the reference kept in src/merge.py, and bucketize and merge_frame
+# against the original bucketize below and merge_items, on randomized groups of guidance items.
+import copy
+import json
+import random
+from typing import Dict, Any, List, Tuple
+
+from src.merge import (
+    merge_items,
+    merge_items_pairwise,
+    merge_frame,
+    bucketize,
+    canon_metric,
+    canon_period,
+    canon_units,
+    to_base,
+)
+
+# ---- reference: bucketize before the indexed merge ----------------------------------------------
+
+def ref_bucketize(items_by_source: Dict[str, List[Dict[str, Any]]]) -> Dict[Tuple, List[Dict[str, Any]]]:
+    buckets: Dict[Tuple, List[Dict[str, Any]]] = {}
+    for src, lst in items_by_source.items():
+        for it in (lst or []):
+            metric = canon_metric(it.get("metric", ""))
+            period = it.get("period") or ""
+            ptype = (it.get("period_type") or "").lower().strip()
+            if ptype not in ("quarter", "full year"):
+                ptype, fy, q = canon_period(period)
+            else:
+                ptype2, fy, q = canon_period(period)
+                if not it.get("period_type"):
+                    ptype = ptype2
+            units = canon_units(it.get("units"))
+            low = to_base(it.get("low_end"), units)
+            high = to_base(it.get("high_end"), units)
+            if low is None and high is not None:
+                low = high
+            if high is None and low is not None:
+                high = low
+            item = dict(it)
+            item["source"] = it.get("source") or src
+            item["units"] = units
+            item["low_end"] = low
+            item["high_end"] = high
+            key = (metric, ptype, fy, q)
+            buckets.setdefault(key, []).append(item)
+    return buckets
+
+# ---- randomized groups ----------------------------------------------------------------------------
+
+SOURCES = ["press_release", "presentation", "transcript", "webcast"]
+METRICS = ["Revenue", "net sales", "EPS", "Diluted earnings per share", "Gross Margin", "GPM", "op margin",
+           "Operating income", "CapEx", "Free cash flow", "ARR", "Headcount", "", None]
+PERIODS = ["Q3 FY24", "q1 2025", "FY2025", "FY 24", "full year 2024", "Full Year", "fiscal 2025", "Q4", "", None]
+PERIOD_TYPES = ["quarter", "full year", "Quarter ", "FULL YEAR", "annual", "", None]
+UNITS = ["USD", "$", "usd millions", "bn", "%", "percent", "pp", "EPS", "eps diluted", "x", "", None]
+BASES = [0.1, 1.0, 1.05, 12.0, 45.5, 46.0, 1e6, 1.005e6, 2.5e9, -3.0]
+
+def random_value(rng: random.Random, nan_ok: bool):
+    r = rng.random()
+    if r < 0.15:
+        return None
+    if nan_ok and r < 0.18:
+        return rng.choice([float("nan"), float("inf"), float("-inf")])
+    base = rng.choice(BASES)
+    # Jitter around the close_enough tolerances (0.10 percent points, 0.01 EPS, 1% relative).
+    return base + rng.choice([0.0, 0.0, 0.005, -0.009, 0.05, 0.11, 0.02 * base, -0.009 * base])
+
+def random_item(rng: random.Random, nan_ok: bool = True) -> Dict[str, Any]:
+    it = {
+        "metric": rng.choice(METRICS),
+        "period": rng.choice(PERIODS),
+        "period_type": rng.choice(PERIOD_TYPES),
+        "units": rng.choice(UNITS),
+        "low_end": random_value(rng, nan_ok),
+        "high_end": random_value(rng, nan_ok),
+        "guidance_value_text": f"value {rng.randint(0, 99)}",
+        "filing_date": rng.choice(["2024-05-01", "2024-08-01", None]),
+        "provenance": rng.sample(["u1", "u2", "u3", "u4"], rng.randint(0, 2)),
+    }
+    if rng.random() < 0.3:
+        it["source"] = rng.choice(SOURCES)
+    if rng.random() < 0.1:
+        it.pop("metric")
+    return it
+
+def random_group(rng: random.Random, nan_ok: bool = True) -> Dict[str, List[Dict[str, Any]]]:
+    return {src: [random_item(rng, nan_ok) for _ in range(rng.randint(0, 12))]
+            for src in rng.sample(SOURCES, rng.randint(1, len(SOURCES)))}
+
+def same(a, b) -> bool:
+    # JSON spells NaN the same on both sides, where == would not.
+    return json.dumps(a, sort_keys=True, default=str) == json.dumps(b, sort_keys=True, default=str)
+
+def test_merge_items_matches_pairwise():
+    rng = random.Random(1405)
+    for _ in range(3000):
+        group = random_group(rng)
+        assert same(merge_items(copy.deepcopy(group)), merge_items_pairwise(copy.deepcopy(group)))
+
+def test_merge_items_matches_pairwise_on_large_buckets():
+    # Few metrics and periods, so buckets hold many items and the bisect window is exercised.
+    rng = random.Random(99)
+    for _ in range(50):
+        group = {src: [dict(random_item(rng), metric="Revenue", period="Q3 FY24", period_type="quarter")
+                       for _ in range(rng.randint(50, 200))] for src in SOURCES}
+        assert same(merge_items(copy.deepcopy(group)), merge_items_pairwise(copy.deepcopy(group)))
+
+def test_bucketize_matches_reference():
+    rng = random.Random(7)
+    for _ in range(2000):
+        group = random_group(rng)
+        got, want = bucketize(copy.deepcopy(group)), ref_bucketize(copy.deepcopy(group))
+        assert list(got) == list(want)
+        assert same(list(got.values()), list(want.values()))
+
+def test_merge_frame_matches_merge_items():
+    import pandas as pd
+    rng = random.Random(3)
+    for _ in range(300):
+        groups = {t: random_group(rng, nan_ok=False) for t in rng.sample(["AAA", "BBB", "CCC"], rng.randint(1, 3))}
+        rows = [dict(it, ticker=t, source=src) for t, g in groups.items() for src, lst in g.items() for it in lst]
+        if not rows:
+            continue
+        want = []
+        for t, g in groups.items():
+            for it in merge_items(copy.deepcopy(g)):
+                want.append(dict(it, ticker=t))
+        frame = merge_frame(pd.DataFrame(copy.deepcopy(rows)))
+        got = [{k: v for k, v in r.items() if v is not None or k in ("low_end", "high_end", "average")}
+               for r in frame.astype(object).where(frame.notna(), None).to_dict("records")]
+        want = [{k: v for k, v in it.items() if v is not None or k in ("low_end", "high_end", "average")} for it in want]
+        assert same(got, want)
@@ -0,0 +1,174 @@
+# The single-pass prefilter (user-010) must mine exactly what the original implementation mined.
+# The original is kept below verbatim as the reference; inputs are randomized paragraphs built from
+# guidance phrases, numbers, periods, safe-harbor text, non-ASCII letters and unusual whitespace.
+import re
+import random
+from typing import List, Dict, Any, Iterable, Iterator
+
+from src import prefilter
+
+# ---- reference: src/prefilter.py before the single-pass rewrite ----------------------------------
+
+GUIDANCE_RGX = re.compile(
+    r"(guidance|outlook|forecast|expect|expects|we\s+expect|we\s+forecast|full\s+year|FY\d{2,4}|Q[1-4]\s*(?:FY)?\d{2,4}|quarterly\s+outlook)",
+    re.I,
+)
+NUMBER_SPAN = re.compile(
+    r"(\$?\s?\d[\d,]*(?:\.\d+)?\s*(?:billion|bn|million|m|percent|%|bps|basis points|eps|dollars)?)",
+    re.I,
+)
+PERIOD_RGX = re.compile(
+    r"(Q[1-4]\s*(?:FY)?\d{2,4}|FY\s?\d{2,4}|FY\d{2}|full\s+year\s+\d{4}|full\s+year)",
+    re.I,
+)
+
+METRIC_DICT = {
+    "revenue": ["revenue", "sales", "top line"],
+    "eps": ["eps", "earnings per share"],
+    "gross margin": ["gross margin", "gpm", "gross profit margin"],
+    "operating margin": ["operating margin", "op margin"],
+    "op income": ["operating income", "op income"],
+    "capex": ["capex", "capital expenditures"],
+    "fcf": ["free cash flow", "fcf"],
+    "arr": ["arr", "annual recurring revenue"],
+}
+
+def ref_guess_metric(text: str) -> str:
+    t = text.lower()
+    for k, alts in METRIC_DICT.items():
+        if any(a in t for a in alts):
+            return k
+    return ""
+
+def ref_normalize_value_span(s: str):
+    t = s.lower().replace(",", "").strip()
+    units = None
+    if "eps" in t:
+        units = "EPS"
+    elif "billion" in t or "bn" in t or "$" in t or "million" in t or " m" in t:
+        units = "USD"
+    elif "%" in t or "percent" in t:
+        units = "percent"
+    rng = re.split(r"\s*(?:to|-|–|—|~)\s*", t)
+    def as_num(x):
+        x = x.replace("about", "").replace("approx", "").replace("$", "").strip()
+        x_clean = re.sub(r"[^\d.]", "", x)
+        return float(x_clean) if x_clean else None
+    if len(rng) == 2:
+        low, high = as_num(rng[0]), as_num(rng[1])
+    else:
+        low = as_num(t)
+        high = None
+    if units == "USD":
+        if low is not None and ("billion" in t or "bn" in t):
+            low *= 1e9
+        if high is not None and ("billion" in t or "bn" in t):
+            high *= 1e9
+        if low is not None and ("million" in t or re.search(r"\bm\b", t)):
+            low *= 1e6
+        if high is not None and ("million" in t or re.search(r"\bm\b", t)):
+            high *= 1e6
+    return units, low, high
+
+PARA_BREAK = re.compile(r"\n{2,}")
+WS = re.compile(r"\s+")
+
+def ref_split_paragraphs(text: str) -> List[str]:
+    parts = PARA_BREAK.split(text)
+    return [WS.sub(" ", p).strip() for p in parts if p.strip()]
+
+def ref_filter_paragraphs(paras: Iterable[str]) -> Iterator[str]:
+    for p in paras:
+        if GUIDANCE_RGX.search(p) or NUMBER_SPAN.search(p):
+            if "safe harbor" in p.lower() or "forward-looking statements" in p.lower():
+                continue
+            yield p
+
+def ref_prefilter(text: str) -> List[str]:
+    return list(ref_filter_paragraphs(ref_split_paragraphs(text)))
+
+def ref_mine_candidates(text: str) -> List[Dict[str, Any]]:
+    cands = []
+    for p in ref_filter_paragraphs(ref_split_paragraphs(text)):
+        metric = ref_guess_metric(p)
+        period_m = PERIOD_RGX.search(p)
+        num_m = NUMBER_SPAN.search(p)
+        if not (period_m or num_m):
+            continue
+        guidance_value_text = num_m.group(1) if num_m else ""
+        units, low, high = ref_normalize_value_span(guidance_value_text) if guidance_value_text else (None, None, None)
+        cands.append({
+            "metric": metric,
+            "guidance_value_text": guidance_value_text.strip(),
+            "low_end": low,
+            "high_end": high,
+            "units": units,
+            "period": period_m.group(0) if period_m else "",
+            "context": p[:800],
+        })
+    return cands
+
+# ---- randomized inputs ------------------------------------------------------------------------
+
+WORDS = [
+    "we", "expect", "Expects", "guidance", "OUTLOOK", "forecast", "We  Forecast", "full year", "Full\tYear",
+    "quarterly outlook", "revenue", "Sales", "top line", "EPS", "earnings per share", "gross margin", "GPM",
+    "op margin", "Operating Income", "capex", "Capital Expenditures", "free cash flow", "FCF", "ARR", "arrears",
+    "of", "to", "about", "approx", "between", "and", "the", "company", "Safe Harbor", "forward-looking statements",
+    "Q3", "q2 FY2025", "Q4FY24", "FY24", "fy 2025", "FY2026", "full year 2024", "m", "bn", "bps", "basis points",
+    "dollars", "percent", "%", "~", "-", "–", "—",
+    # Non-ASCII: case folding that changes length or maps onto ASCII (Kelvin sign, dotted I, sharp s).
+    "İncome", "Straße", "K", "ﬁscal", "Ⅷ", "é", "Ø",
+]
+NUMBERS = ["$1.2 billion", "$10.0 billion to $10.5 billion", "3-5%", "12 percent", "$0.85", "1,234.5 million",
+           "40 bps", "2.1bn", "$3 m", "7", "0.5 EPS", "18–20%", "$ 4"]
+SPACES = [" ", " ", " ", "  ", "\t", " ", " ", "\x1c", "\x85", "　"]
+
+ASCII_WORDS = [w for w in WORDS if w.isascii()]
+ASCII_NUMBERS = [n for n in NUMBERS if n.isascii()]
+ASCII_SPACES = [s for s in SPACES if s.isascii()]
+
+def random_paragraph(rng: random.Random) -> str:
+    # Half the paragraphs are pure ASCII, which take the lower-cased fast path of scan_paragraph.
+    ascii_only = rng.random() < 0.5
+    words, numbers, spaces = (ASCII_WORDS, ASCII_NUMBERS, ASCII_SPACES) if ascii_only else (WORDS, NUMBERS, SPACES)
+    parts = []
+    for _ in range(rng.randint(1, 24)):
+        parts.append(rng.choice(numbers) if rng.random() < 0.2 else rng.choice(words))
+        parts.append(rng.choice(spaces))
+    return "".join(parts)
+
+def random_text(rng: random.Random) -> str:
+    breaks = ["\n\n", "\n\n\n", "\n", "\n \n", "\n\n  "]
+    return "".join(random_paragraph(rng) + rng.choice(breaks) for _ in range(rng.randint(1, 12)))
+
+def test_mining_matches_reference():
+    rng = random.Random(20240501)
+    for _ in range(3000):
+        text = random_text(rng)
+        assert prefilter.split_paragraphs(text) == ref_split_paragraphs(text)
+        assert prefilter.prefilter(text) == ref_prefilter(text)
+        assert prefilter.mine_candidates(text) == ref_mine_candidates(text)
+
+def test_streamed_paragraphs_match_reference():
+    rng = random.Random(7)
+    for _ in range(500):
+        text = random_text(rng)
+        lines = text.split("\n")
+        cuts = sorted(rng.sample(range(len(lines) + 1), min(3, len(lines) + 1)))
+        chunks = ["\n".join(lines[a:b]) for a, b in zip([0] + cuts, cuts + [len(lines)])]
+        assert list(prefilter.iter_paragraphs(chunks)) == ref_split_paragraphs("\n".join(chunks))
+
+def outcome(fn, *args):
+    try:
+        return fn(*args)
+    except Exception as e:
+        return type(e)
+
+def test_metric_and_value_helpers_match_reference():
+    rng = random.Random(11)
+    for _ in range(2000):
+        p = random_paragraph(rng)
+        assert prefilter.guess_metric(p) == ref_guess_metric(p)
+        span = rng.choice(NUMBERS) + rng.choice(["", " to " + rng.choice(NUMBERS), " million", " m"])
+        assert outcome(prefilter.normalize_value_span, span) == outcome(ref_normalize_value_span, span)